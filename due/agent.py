@@ -4,13 +4,18 @@ entities that can take part in Episodes (:mod:`due.episode`), receiving and
 issuing Events (:mod:`due.event`).
 """
 import uuid
+import asyncio
+from itertools import islice
 from abc import ABCMeta, abstractmethod
 from datetime import datetime
 
 from due.event import Event
 from due import episode
+from due.execution import run_action
 from due.util.python import dynamic_import
 
+DEFAULT_LEARN_CHUNK_SIZE = 1000
+
 class Agent(metaclass=ABCMeta):
 	"""
 	Participants in an Episodes are called Agents. An Agent models an unique
@@ -28,6 +33,13 @@ class Agent(metaclass=ABCMeta):
 	:type name: `str`
 	"""
 
+	action_executor = None
+	"""
+	If set to a :class:`due.execution.ActionExecutor`, the Agent's Actions run
+	in the background. Otherwise, they run synchronously in :meth:`Agent.act_events`
+	and :meth:`Agent.do`.
+	"""
+
 	def __init__(self, agent_id=None):
 		self.id = agent_id if agent_id is not None else str(uuid.uuid1())
 
@@ -73,6 +85,28 @@ class Agent(metaclass=ABCMeta):
 		"""
 		pass
 
+	def learn_stream(self, episodes, chunk_size=DEFAULT_LEARN_CHUNK_SIZE):
+		"""
+		Learn the Episodes of an iterable (eg. a generator reading an archive
+		from disk) in chunks of `chunk_size` Episodes, so that the whole source
+		is never held in memory at once. The model is updated after each chunk.
+
+		By default, this calls :meth:`Agent.learn_episodes` on each chunk:
+		Agents that can update their model incrementally should override it.
+
+		:param episodes: an iterable of Episodes
+		:type episodes: iterable of :class:`due.episode.Episode`
+		:param chunk_size: number of Episodes learned at once
+		:type chunk_size: `int`
+		:return: the number of learned Episodes
+		:rtype: `int`
+		"""
+		result = 0
+		for chunk in _chunks(episodes, chunk_size):
+			self.learn_episodes(chunk)
+			result += len(chunk)
+		return result
+
 	def learn_episode(self, episode):
 		"""
 		Submit an Episode for the Agent to learn. By default, this just wraps a
@@ -153,6 +187,23 @@ class Agent(metaclass=ABCMeta):
 		"""
 		pass
 
+	def batch_utterance_callback(self, episodes):
+		"""
+		Process a batch of Episodes whose last Event is an Utterance, and
+		return the response Events for each of them. Serving channels that
+		collect concurrent requests (eg. :mod:`due.serve.http`) call this
+		instead of :meth:`Agent.utterance_callback`, so that Agents can run a
+		single inference on the whole batch.
+
+		By default, :meth:`Agent.utterance_callback` is called on each Episode.
+
+		:param episodes: the Episodes where the Utterances were acted
+		:type episodes: `list` of :class:`due.episode.Episode`
+		:return: A list of response Events per each Episode
+		:rtype: `list` of (`list` of :class:`due.event.Event`)
+		"""
+		return [self.utterance_callback(e) or [] for e in episodes]
+
 	@abstractmethod
 	def action_callback(self, episode):
 		"""
@@ -190,10 +241,31 @@ class Agent(metaclass=ABCMeta):
 		"""
 		for e in events:
 			if e.type == Event.Type.Action:
-				e.payload.run()
+				self.run_action(e)
 
 			episode.add_event(e)
 
+	def run_action(self, event):
+		"""
+		Run the Action of the given Event, recording its
+		:class:`due.execution.ActionOutcome` in `event.outcome`. If the Agent
+		has an :attr:`Agent.action_executor`, the Action is submitted to it,
+		and this returns immediately: `event.outcome` is set when the Action
+		completes, which is usually after the Event was added to the Episode
+		(and to its :class:`due.eventlog.EventLog`, which won't record the
+		outcome). Otherwise, the Action runs inline, and the exceptions it
+		raises are propagated to the caller.
+
+		:param event: an Action Event
+		:type event: :class:`due.event.Event`
+		:return: the outcome of the Action, or the Future of the outcome
+		:rtype: :class:`due.execution.ActionOutcome` or :class:`concurrent.futures.Future`
+		"""
+		if self.action_executor is not None:
+			return self.action_executor.submit(event)
+		event.outcome = run_action(event.payload, reraise=True)
+		return event.outcome
+
 	def say(self, sentence, episode):
 		"""
 		Create an Event out of the given sentence and act the new Event in
@@ -217,8 +289,8 @@ class Agent(metaclass=ABCMeta):
 		:param action: An Action
 		:type action: :class:`due.action.Action`
 		"""
-		action.run()
 		action_event = Event(Event.Type.Action, datetime.now(), self.id, action)
+		self.run_action(action_event)
 		episode.add_event(action_event)
 
 	def leave(self, episode):
@@ -231,5 +303,99 @@ class Agent(metaclass=ABCMeta):
 		leave_event = Event(Event.Type.Leave, datetime.now(), self.id, None)
 		episode.add_event(leave_event)
 
+	def close(self):
+		"""
+		Release the resources of the Agent (eg. background threads), once it
+		is not served anymore. Agents that are closed should not be used
+		again. By default, this does nothing.
+		"""
+		pass
+
 	def __str__(self):
 		return f"<Agent: {self.id}>"
+
+class AsyncAgent(Agent):
+	"""
+	An Agent that implements the **asynchronous protocol**: its
+	:meth:`Agent.utterance_callback`, :meth:`Agent.action_callback` and
+	:meth:`Agent.leave_callback` are coroutines. This is meant for Agents that
+	spend their time waiting (eg. on remote services) rather than computing: in
+	a :class:`due.episode.AsyncLiveEpisode`, their callbacks are awaited on the
+	event loop, which can serve many Episodes in the meantime.
+
+	.. code-block:: python
+
+		class RemoteAgent(AsyncAgent):
+			async def utterance_callback(self, episode):
+				answer = await remote_model.answer(episode.last_event().payload)
+				return [Event(Event.Type.Utterance, datetime.now(), self.id, answer)]
+
+	AsyncAgents can still take part in synchronous :class:`due.episode.LiveEpisode`
+	objects, as long as no event loop is running in the current thread: their
+	callbacks are then run to completion with :func:`asyncio.run`.
+	"""
+
+	async def async_event_callback(self, event, episode):
+		"""
+		The asynchronous version of :meth:`Agent.event_callback`, which awaits
+		the handler of the given Event type.
+
+		:param event: The new Event
+		:type event: :class:`due.event.Event`
+		:param episode: The Episode where the Event was acted
+		:type episode: :class:`due.episode.Episode`
+		:return: A list of response Events
+		:rtype: `list` of :class:`due.event.Event`
+		"""
+		if event.type == Event.Type.Utterance:
+			result = await self.utterance_callback(episode)
+		elif event.type == Event.Type.Action:
+			result = await self.action_callback(episode)
+		elif event.type == Event.Type.Leave:
+			result = await self.leave_callback(episode)
+
+		return result if result else []
+
+	def event_callback(self, event, episode):
+		return _run_coroutine(self.async_event_callback(event, episode))
+
+	def batch_utterance_callback(self, episodes):
+		async def answer_all():
+			results = await asyncio.gather(*[self.utterance_callback(e) for e in episodes])
+			return [r or [] for r in results]
+		return _run_coroutine(answer_all())
+
+	def start_episode(self, other):
+		"""
+		Create a new :class:`due.episode.AsyncLiveEpisode` to engage another
+		Agent in a new conversation.
+
+		:param other_agent: The Agent you are inviting to the conversation.
+		:type other_agent: :class:`due.agent.Agent`
+		:return: a new Episode object
+		:rtype: :class:`due.episode.AsyncLiveEpisode`
+		"""
+		result = episode.AsyncLiveEpisode(self, other)
+		other.new_episode_callback(result)
+		return result
+
+#
+# Helpers
+#
+
+def _chunks(iterable, chunk_size):
+	if chunk_size < 1:
+		raise ValueError("Chunk size must be positive")
+	iterator = iter(iterable)
+	chunk = list(islice(iterator, chunk_size))
+	while chunk:
+		yield chunk
+		chunk = list(islice(iterator, chunk_size))
+
+def _run_coroutine(coroutine):
+	try:
+		asyncio.get_running_loop()
+	except RuntimeError:
+		return asyncio.run(coroutine)
+	coroutine.close()
+	raise RuntimeError("AsyncAgent callbacks cannot be run synchronously from a running event loop: use an AsyncLiveEpisode")
@@ -0,0 +1,271 @@
+"""
+An Episode Archive is an append-only file of saved Episodes that can be read
+back one Episode at a time, without deserializing the whole collection.
+
+Each Episode is stored as a separately decodable record (a JSON document in the
+**standard** format of :meth:`due.episode.Episode.save`) in a data file. A
+sidecar index file (same path, with a `.idx` suffix) maps each Episode ID to the
+offset and length of its record, together with the time range the Episode
+spans. This allows:
+
+* O(1) retrieval of a single Episode by ID (:meth:`EpisodeArchive.get`)
+* scans of the Episodes that overlap a time range (:meth:`EpisodeArchive.scan`)
+* memory-mapped reads of the data file, when the archive is opened read-only
+
+This is how you archive a corpus, and fetch back one of its Episodes:
+
+.. code-block:: python
+
+	from due.archive import EpisodeArchive
+
+	with EpisodeArchive('episodes.duea', mode='w') as archive:
+		archive.add_episodes(episodes)
+
+	with EpisodeArchive('episodes.duea') as archive:
+		episode = archive.get(episode_id)
+
+API
+===
+"""
+import os
+import json
+import mmap
+import bisect
+import logging
+from collections import namedtuple
+
+from due.episode import Episode
+from due.util.time import convert_datetime, json_default
+
+INDEX_SUFFIX = '.idx'
+INDEX_VERSION = 1
+
+ArchiveRecord = namedtuple('ArchiveRecord', ['id', 'offset', 'length', 'start', 'end'])
+
+class EpisodeArchive(object):
+	"""
+	A random-access archive of Episodes, backed by a data file and an index file.
+
+	Archives can be opened in one of the following modes:
+
+	* `r`: read only (default). The data file is memory-mapped
+	* `w`: create a new archive, overwriting any existing one
+	* `a`: append Episodes to an existing archive, or create a new one
+
+	The index is written to disk by :meth:`flush` and :meth:`close`: Episodes
+	that are added after the last flush will not be visible to other readers.
+
+	:param path: path of the archive data file
+	:type path: `str`
+	:param mode: 'r', 'w' or 'a'
+	:type mode: `str`
+	"""
+
+	def __init__(self, path, mode='r'):
+		if mode not in ('r', 'w', 'a'):
+			raise ValueError(f"Unsupported archive mode '{mode}'. Supported modes are 'r', 'w' or 'a'")
+
+		self._logger = logging.getLogger(__name__ + ".EpisodeArchive")
+		self.path = path
+		self.index_path = path + INDEX_SUFFIX
+		self.mode = mode
+		self._records = []
+		self._by_id = {}
+		self._by_start = None
+		self._mmap = None
+		self._dirty = False
+
+		if mode == 'w':
+			self._file = open(path, 'w+b')
+			self._dirty = True
+		elif mode == 'a':
+			if os.path.exists(path):
+				self._load_index()
+			self._file = open(path, 'a+b')
+		else:
+			self._load_index()
+			self._file = open(path, 'rb')
+			if os.fstat(self._file.fileno()).st_size > 0:
+				self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+	def __len__(self):
+		return len(self._records)
+
+	def __contains__(self, episode_id):
+		return str(episode_id) in self._by_id
+
+	def __iter__(self):
+		for record in self._records:
+			yield self._read(record)
+
+	def ids(self):
+		"""
+		Return the IDs of the archived Episodes, in insertion order.
+
+		:return: a list of Episode IDs
+		:rtype: `list` of `str`
+		"""
+		return [r.id for r in self._records]
+
+	def record(self, episode_id):
+		"""
+		Return the index record of the Episode with the given ID.
+
+		:param episode_id: the ID of an archived Episode
+		:type episode_id: `str`
+		:return: the index record of the Episode
+		:rtype: :class:`ArchiveRecord`
+		"""
+		key = str(episode_id)
+		if key not in self._by_id:
+			raise KeyError(f"Episode '{episode_id}' not found in archive {self.path}")
+		return self._by_id[key]
+
+	def add(self, episode):
+		"""
+		Append an Episode to the archive.
+
+		:param episode: the Episode to archive
+		:type episode: :class:`due.episode.Episode`
+		"""
+		if self.mode == 'r':
+			raise ValueError("Cannot add Episodes to an archive opened in read mode")
+
+		key = str(episode.id)
+		if key in self._by_id:
+			raise ValueError(f"Episode '{key}' is already in archive {self.path}")
+
+		data = json.dumps(episode.save(), default=json_default).encode('utf-8')
+		offset = self._file.tell()
+		self._file.write(data)
+		start, end = _time_range(episode)
+		record = ArchiveRecord(key, offset, len(data), start, end)
+		self._records.append(record)
+		self._by_id[key] = record
+		self._by_start = None
+		self._dirty = True
+
+	def add_episodes(self, episodes):
+		"""
+		Append a sequence of Episodes to the archive.
+
+		:param episodes: the Episodes to archive
+		:type episodes: iterable of :class:`due.episode.Episode`
+		"""
+		for e in episodes:
+			self.add(e)
+
+	def get(self, episode_id):
+		"""
+		Load the Episode with the given ID. Only the Episode's record is read
+		and decoded.
+
+		:param episode_id: the ID of an archived Episode
+		:type episode_id: `str`
+		:return: the archived Episode
+		:rtype: :class:`due.episode.Episode`
+		"""
+		return self._read(self.record(episode_id))
+
+	def get_at(self, position):
+		"""
+		Load the Episode that was archived in the given position.
+
+		:param position: insertion index of the Episode
+		:type position: `int`
+		:return: the archived Episode
+		:rtype: :class:`due.episode.Episode`
+		"""
+		return self._read(self._records[position])
+
+	def scan(self, start=None, end=None):
+		"""
+		Generate the Episodes that overlap the given time range, sorted by
+		their starting time. An Episode overlaps the range if any of its Events
+		(or the Episode itself) is timestamped between `start` and `end`,
+		boundaries included.
+
+		:param start: beginning of the range. If `None`, the range is open
+		:type start: `datetime`
+		:param end: end of the range. If `None`, the range is open
+		:type end: `datetime`
+		:return: a generator of Episodes
+		:rtype: generator of :class:`due.episode.Episode`
+		"""
+		if self._by_start is None:
+			self._by_start = sorted(self._records, key=lambda r: r.start)
+
+		records = self._by_start
+		if end is not None:
+			stop = bisect.bisect_right([r.start for r in records], end)
+			records = records[:stop]
+
+		for r in records:
+			if start is None or r.end >= start:
+				yield self._read(r)
+
+	def flush(self):
+		"""
+		Flush the data file and write the index to disk. The index is replaced
+		atomically, so that concurrent readers never see a partial one.
+		"""
+		if self.mode == 'r' or not self._dirty:
+			return
+
+		self._file.flush()
+		os.fsync(self._file.fileno())
+		saved_index = {
+			'version': INDEX_VERSION,
+			'episodes': [[r.id, r.offset, r.length, r.start.isoformat(), r.end.isoformat()] for r in self._records]
+		}
+		tmp_path = self.index_path + '.tmp'
+		with open(tmp_path, 'w') as f:
+			json.dump(saved_index, f)
+		os.replace(tmp_path, self.index_path)
+		self._dirty = False
+
+	def close(self):
+		"""
+		Flush and close the archive.
+		"""
+		if self._file.closed:
+			return
+		self.flush()
+		if self._mmap is not None:
+			self._mmap.close()
+			self._mmap = None
+		self._file.close()
+
+	def _read(self, record):
+		if self._mmap is not None:
+			data = self._mmap[record.offset:record.offset + record.length]
+		else:
+			self._file.flush()
+			data = os.pread(self._file.fileno(), record.length, record.offset)
+		return Episode.load(json.loads(data))
+
+	def _load_index(self):
+		with open(self.index_path, 'r') as f:
+			saved_index = json.load(f)
+
+		if saved_index['version'] != INDEX_VERSION:
+			raise ValueError(f"Unsupported archive index version: {saved_index['version']}")
+
+		for id_, offset, length, start, end in saved_index['episodes']:
+			record = ArchiveRecord(id_, offset, length, convert_datetime(start), convert_datetime(end))
+			self._records.append(record)
+			self._by_id[id_] = record
+
+#
+# Helpers
+#
+
+def _time_range(episode):
+	timestamps = [episode.timestamp] + [e.timestamp for e in episode.events]
+	return min(timestamps), max(timestamps)
@@ -0,0 +1,375 @@
+"""
+A compact, safe binary format for saved Episodes, built on the standard library
+only. It is meant for corpora, which are mostly made of short utterances with
+repeated agent IDs and monotonically increasing timestamps:
+
+* Agent IDs are stored once per stream in a **string table**, and events refer to
+  them by index
+* Timestamps are stored as **varint-encoded deltas** (in microseconds) from the
+  previous timestamp in the Episode
+* Event types are stored as one-byte **type codes**, followed by a
+  **length-prefixed UTF-8** payload. Action payloads are embedded as JSON
+
+A stream starts with a magic header, and contains either a single Episode, or a
+sequence of Episodes terminated by an end marker. Each Episode is a
+length-prefixed record, so streams can be encoded and decoded one Episode at a
+time:
+
+.. code-block:: python
+
+	from due.codec import EpisodeEncoder, EpisodeDecoder
+
+	with open('corpus.dueb', 'wb') as f:
+		with EpisodeEncoder(f) as encoder:
+			for e in episodes:
+				encoder.write(e.save())
+
+	with open('corpus.dueb', 'rb') as f:
+		for saved_episode in EpisodeDecoder(f):
+			...
+
+The format can also be used through :func:`due.persistence.serialize` and
+:func:`due.persistence.deserialize` with `file_format='binary'`.
+
+API
+===
+"""
+import io
+import json
+from datetime import datetime, timedelta
+
+from due.event import Event
+from due.util.time import convert_datetime
+
+MAGIC = b'DUEB'
+VERSION = 1
+
+CONTAINER_SINGLE = 0
+CONTAINER_STREAM = 1
+
+TYPE_CODES = {
+	Event.Type.Utterance.value: 0,
+	Event.Type.Leave.value: 1,
+	Event.Type.Action.value: 2,
+}
+TYPE_NAMES = {v: k for k, v in TYPE_CODES.items()}
+
+PAYLOAD_NONE = 0
+PAYLOAD_STR = 1
+PAYLOAD_JSON = 2
+
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+class EpisodeEncoder(object):
+	"""
+	Write saved Episodes (see :meth:`due.episode.Episode.save`) to a binary
+	file object, one at a time. Agent IDs are collected in a string table that
+	is shared by all the Episodes in the stream.
+
+	:param f: a file object open in binary mode
+	:type f: file object
+	:param single: if `True`, the stream will contain exactly one Episode
+	:type single: `bool`
+	"""
+
+	def __init__(self, f, single=False):
+		self._f = f
+		self._single = single
+		self._count = 0
+		self._strings = {}
+		f.write(MAGIC + bytes([VERSION, CONTAINER_SINGLE if single else CONTAINER_STREAM]))
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+	def write(self, saved_episode):
+		"""
+		Encode a saved Episode and write it to the stream.
+
+		:param saved_episode: an Episode, as returned by :meth:`due.episode.Episode.save`
+		:type saved_episode: `dict`
+		"""
+		if self._single and self._count > 0:
+			raise ValueError("Cannot write more than one Episode in a single-Episode stream")
+
+		if saved_episode.get('format', 'standard') != 'standard':
+			saved_episode = _standard_saved_episode(saved_episode)
+
+		out = bytearray()
+		self._encode_episode(saved_episode, out)
+		_write_varint(len(out), self._f)
+		self._f.write(out)
+		self._count += 1
+
+	def close(self):
+		"""
+		Terminate the stream. The underlying file object is not closed.
+		"""
+		if not self._single:
+			_write_varint(0, self._f)
+
+	def _encode_episode(self, saved_episode, out):
+		_encode_value(saved_episode['id'], out)
+		timestamp = _to_micros(saved_episode['timestamp'])
+		_encode_varint(_zigzag(timestamp), out)
+		self._encode_agent(saved_episode['starter_agent'], out)
+		_encode_varint(len(saved_episode['invited_agents']), out)
+		for agent in saved_episode['invited_agents']:
+			self._encode_agent(agent, out)
+
+		events = saved_episode['events']
+		_encode_varint(len(events), out)
+		last_timestamp = timestamp
+		for e in events:
+			payload = e['payload']
+			if e['type'] == Event.Type.Action.value:
+				payload = json.dumps(payload)
+				payload_code = PAYLOAD_JSON
+			elif payload is None:
+				payload_code = PAYLOAD_NONE
+			elif isinstance(payload, str):
+				payload_code = PAYLOAD_STR
+			else:
+				payload = json.dumps(payload)
+				payload_code = PAYLOAD_JSON
+
+			out.append(TYPE_CODES[e['type']] << 2 | payload_code)
+			timestamp = _to_micros(e['timestamp'])
+			_encode_varint(_zigzag(timestamp - last_timestamp), out)
+			last_timestamp = timestamp
+			self._encode_agent(e['agent'], out)
+			if payload_code != PAYLOAD_NONE:
+				_encode_str(payload, out)
+
+	def _encode_agent(self, agent_id, out):
+		"""
+		Agents are encoded as an index in the string table, shifted by one (0
+		means `None`). A new agent is encoded with the next free index, followed
+		by its ID.
+		"""
+		if agent_id is None:
+			out.append(0)
+			return
+
+		index = self._strings.get(agent_id)
+		if index is not None:
+			_encode_varint(index, out)
+		else:
+			index = len(self._strings) + 1
+			self._strings[agent_id] = index
+			_encode_varint(index, out)
+			_encode_str(agent_id, out)
+
+class EpisodeDecoder(object):
+	"""
+	Read saved Episodes from a binary file object that was written by
+	:class:`EpisodeEncoder`. Iterating over the decoder yields saved Episodes in
+	the **standard** format, one at a time (see :meth:`due.episode.Episode.load`).
+
+	:param f: a file object open in binary mode
+	:type f: file object
+	"""
+
+	def __init__(self, f):
+		self._f = f
+		self._strings = []
+		self._done = False
+		header = f.read(len(MAGIC) + 2)
+		if header[:len(MAGIC)] != MAGIC:
+			raise ValueError("Not a binary Episode stream: invalid header")
+		if header[len(MAGIC)] != VERSION:
+			raise ValueError(f"Unsupported binary Episode stream version: {header[len(MAGIC)]}")
+		self.single = header[len(MAGIC) + 1] == CONTAINER_SINGLE
+
+	def __iter__(self):
+		while not self._done:
+			length = _read_varint(self._f)
+			if length is None or length == 0:
+				self._done = True
+				return
+			data = self._f.read(length)
+			if len(data) < length:
+				raise ValueError("Truncated binary Episode stream")
+			yield self._decode_episode(data)
+			if self.single:
+				self._done = True
+
+	def _decode_episode(self, data):
+		episode_id, pos = _decode_value(data, 0)
+		timestamp, pos = _decode_varint(data, pos)
+		timestamp = _unzigzag(timestamp)
+		starter_agent, pos = self._decode_agent(data, pos)
+		n_invited, pos = _decode_varint(data, pos)
+		invited_agents = []
+		for _ in range(n_invited):
+			agent, pos = self._decode_agent(data, pos)
+			invited_agents.append(agent)
+
+		n_events, pos = _decode_varint(data, pos)
+		events = []
+		last_timestamp = timestamp
+		for _ in range(n_events):
+			code = data[pos]
+			pos += 1
+			delta, pos = _decode_varint(data, pos)
+			last_timestamp += _unzigzag(delta)
+			agent, pos = self._decode_agent(data, pos)
+			payload_code = code & 0b11
+			if payload_code == PAYLOAD_NONE:
+				payload = None
+			else:
+				payload, pos = _decode_str(data, pos)
+				if payload_code == PAYLOAD_JSON:
+					payload = json.loads(payload)
+			events.append({
+				'type': TYPE_NAMES[code >> 2],
+				'timestamp': _from_micros(last_timestamp).isoformat(),
+				'agent': agent,
+				'payload': payload
+			})
+
+		return {
+			'id': episode_id,
+			'timestamp': _from_micros(timestamp),
+			'starter_agent': starter_agent,
+			'invited_agents': invited_agents,
+			'events': events,
+			'format': 'standard'
+		}
+
+	def _decode_agent(self, data, pos):
+		index, pos = _decode_varint(data, pos)
+		if index == 0:
+			return None, pos
+		if index <= len(self._strings):
+			return self._strings[index-1], pos
+
+		agent_id, pos = _decode_str(data, pos)
+		self._strings.append(agent_id)
+		return agent_id, pos
+
+def dump(saved_thing, f):
+	"""
+	Write a saved Episode, or a list of saved Episodes, to a binary file object.
+
+	:param saved_thing: a saved Episode, or a list of saved Episodes
+	:type saved_thing: `dict` or `list` of `dict`
+	:param f: a file object open in binary mode
+	:type f: file object
+	"""
+	single = isinstance(saved_thing, dict)
+	with EpisodeEncoder(f, single=single) as encoder:
+		for e in ([saved_thing] if single else saved_thing):
+			encoder.write(e)
+
+def load(f):
+	"""
+	Read a saved Episode, or a list of saved Episodes, from a binary file
+	object that was written with :func:`dump`.
+
+	:param f: a file object open in binary mode
+	:type f: file object
+	:return: a saved Episode, or a list of saved Episodes
+	:rtype: `dict` or `list` of `dict`
+	"""
+	decoder = EpisodeDecoder(f)
+	result = list(decoder)
+	return result[0] if decoder.single else result
+
+def dumps(saved_thing):
+	"""Same as :func:`dump`, but return `bytes` instead of writing to a file."""
+	f = io.BytesIO()
+	dump(saved_thing, f)
+	return f.getvalue()
+
+def loads(data):
+	"""Same as :func:`load`, but read from a `bytes` object."""
+	return load(io.BytesIO(data))
+
+#
+# Helpers
+#
+
+def _standard_saved_episode(saved_episode):
+	from due.episode import Episode
+	return Episode.load(saved_episode).save()
+
+def _to_micros(timestamp):
+	timestamp = convert_datetime(timestamp)
+	if timestamp.tzinfo is not None:
+		raise ValueError("Timezone-aware timestamps are not supported by the binary Episode format")
+	return (timestamp - EPOCH) // MICROSECOND
+
+def _from_micros(micros):
+	return EPOCH + timedelta(microseconds=micros)
+
+def _zigzag(n):
+	return n << 1 if n >= 0 else (-n << 1) - 1
+
+def _unzigzag(n):
+	return n >> 1 if not n & 1 else -((n + 1) >> 1)
+
+def _encode_varint(n, out):
+	while n > 0x7f:
+		out.append((n & 0x7f) | 0x80)
+		n >>= 7
+	out.append(n)
+
+def _write_varint(n, f):
+	out = bytearray()
+	_encode_varint(n, out)
+	f.write(out)
+
+def _decode_varint(data, pos):
+	result = 0
+	shift = 0
+	while True:
+		b = data[pos]
+		pos += 1
+		result |= (b & 0x7f) << shift
+		if not b & 0x80:
+			return result, pos
+		shift += 7
+
+def _read_varint(f):
+	"""Read a varint from a file object. Return `None` at the end of the file."""
+	result = 0
+	shift = 0
+	while True:
+		b = f.read(1)
+		if not b:
+			if shift:
+				raise ValueError("Truncated binary Episode stream")
+			return None
+		result |= (b[0] & 0x7f) << shift
+		if not b[0] & 0x80:
+			return result
+		shift += 7
+
+def _encode_str(s, out):
+	encoded = s.encode('utf-8')
+	_encode_varint(len(encoded), out)
+	out += encoded
+
+def _decode_str(data, pos):
+	length, pos = _decode_varint(data, pos)
+	end = pos + length
+	return data[pos:end].decode('utf-8'), end
+
+def _encode_value(value, out):
+	"""Encode a `str` as it is, anything else as JSON."""
+	if isinstance(value, str):
+		out.append(PAYLOAD_STR)
+		_encode_str(value, out)
+	else:
+		out.append(PAYLOAD_JSON)
+		_encode_str(json.dumps(value), out)
+
+def _decode_value(data, pos):
+	code = data[pos]
+	value, pos = _decode_str(data, pos + 1)
+	return (value, pos) if code == PAYLOAD_STR else (json.loads(value), pos)
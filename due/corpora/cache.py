@@ -0,0 +1,46 @@
+"""
+Corpora are parsed from their raw resource files only once: the resulting
+Episodes are stored as a :class:`due.archive.EpisodeArchive` in the Resource
+Manager's artifact cache (see
+:meth:`due.util.resources.ResourceManager.cached_artifact`), and streamed from
+there as long as the resource file doesn't change.
+"""
+import os
+
+from due.archive import EpisodeArchive
+
+ARCHIVE_FILENAME = 'episodes.duea'
+
+def cached_archive_path(rm, name, version, parse_f):
+	"""
+	Return the path of the cached archive of the Episodes in the given corpus
+	resource. If the archive is not in cache, it is built with the Episodes
+	generated by `parse_f`.
+
+	:param rm: a Resource Manager
+	:type rm: :class:`due.util.resources.ResourceManager`
+	:param name: the name of the corpus resource
+	:type name: `str`
+	:param version: version of the corpus parser
+	:type version: `str`
+	:param parse_f: a function generating the Episodes in the corpus
+	:type parse_f: `callable`
+	:return: path of an Episode Archive
+	:rtype: `str`
+	"""
+	def build(path):
+		with EpisodeArchive(os.path.join(path, ARCHIVE_FILENAME), mode='w') as archive:
+			archive.add_episodes(parse_f())
+
+	return os.path.join(rm.cached_artifact(name, version, build), ARCHIVE_FILENAME)
+
+def cached_episodes(rm, name, version, parse_f):
+	"""
+	Generate the Episodes in the given corpus resource, reading them from
+	cache. See :func:`cached_archive_path` for an explanation of the parameters.
+
+	:return: the Episodes in the corpus
+	:rtype: generator of :class:`due.episode.Episode`
+	"""
+	with EpisodeArchive(cached_archive_path(rm, name, version, parse_f)) as archive:
+		yield from archive
@@ -7,32 +7,42 @@ There are some givens to consider when using this corpus:
 * No **timestamp** information is provided in the dataset. The first returned \
 episode symbolically starts the day the paper was published, 15/6/2011, at noon, \
 all the following events through the episodes are placed 1 second apart one \
-another.
+another. Each Episode is timestamped as its first event.
 * The corpus only contains **one on one** conversations only.
 * Context-wise, episodes are **not self-contained**. That is, an episode in the \
 corpus may start in the middle of a longer conversation, and may end before \
 that conversation is finished.
+
+The first time the corpus is loaded, the parsed Episodes are cached in the
+Resource Manager's artifact cache (see :mod:`due.corpora.cache`), so it's parsed
+again only when the corpus ZIP file changes.
 """
 
-import re
-import ast
-from datetime import datetime, timedelta
+import logging
+from datetime import datetime
 
+import numpy as np
 import pandas as pd
 
 from due.util.python import is_notebook
 if is_notebook():
 	from tqdm import tqdm_notebook as tqdm
 else:
-	import tqdm
+	from tqdm import tqdm
 
+from due.archive import EpisodeArchive
+from due.corpora.cache import cached_archive_path
+from due.corpora.corpus import ArchiveCorpus
 from due.episode import Episode
 from due.event import Event
 from due import resource_manager
 
 rm = resource_manager
+logger = logging.getLogger(__name__)
 
 START_DATE = datetime(2011, 6, 15, 12, 0)
+SEPARATOR = ' +++$+++ '
+PARSER_VERSION = 'episodes-1'
 
 def load():
 	return list(episodes())
@@ -40,32 +50,58 @@ def load():
 def episodes():
 	"""
 	Returns the Cornell Movie-Dialog Corpus as a list of
-	:class:`due.episode.Episode`\ s
+	:class:`due.episode.Episode`\\ s
 
 	TODO: return agents dictionary
 
 	:return: The Cornell Movie-Dialog Corpus
 	:rtype: `list` of :class:`due.episode.Episode`
 	"""
-	global current_date
-
-	with _open_cornell('movie_conversations.txt') as f:
-		df_conversations = _read_cornell(f, ['character_id_A', 'character_id_B', 'movie_id', 'utterance_list'])
-		df_conversations['utterance_list'] = df_conversations['utterance_list'].apply(ast.literal_eval)
+	path = cached_archive_path(rm, 'corpora.cornell', PARSER_VERSION, parse)
+	with EpisodeArchive(path) as archive:
+		yield from tqdm(archive, total=len(archive))
 
-	# with _open_cornell('movie_characters_metadata.txt') as f:
-	# 	df_characters = _read_cornell(f, ['character_id', 'character_name', 'movie_id', 'movie_title', 'gender', 'credits_position'])
+def corpus():
+	"""
+	Returns the Cornell Movie-Dialog Corpus as a random-access
+	:class:`due.corpora.corpus.Corpus`, backed by the cached Episode Archive.
 
-	with _open_cornell('movie_lines.txt') as f:
-		df_lines = _read_cornell(f, ['line_id', 'character_id', 'movie_id', 'character_name', 'utterance'])
-		df_lines.set_index('line_id', inplace=True)
+	:return: The Cornell Movie-Dialog Corpus
+	:rtype: :class:`due.corpora.corpus.ArchiveCorpus`
+	"""
+	return ArchiveCorpus(cached_archive_path(rm, 'corpora.cornell', PARSER_VERSION, parse))
 
-	current_date = START_DATE
-	for conversation in tqdm(df_conversations.itertuples(), total=len(df_conversations)):
-		events = [_build_event(l_id, df_lines) for l_id in conversation.utterance_list]
-		episode = _build_episode(conversation, events)
-		yield episode
+def parse():
+	"""
+	Parse the corpus files and generate its Episodes, without using the cache.
 
+	:return: The Cornell Movie-Dialog Corpus
+	:rtype: generator of :class:`due.episode.Episode`
+	"""
+	df_conversations = _read_cornell('movie_conversations.txt', ['character_id_A', 'character_id_B', 'movie_id', 'utterance_list'])
+	df_lines = _read_cornell('movie_lines.txt', ['line_id', 'character_id', 'movie_id', 'character_name', 'utterance'])
+
+	# One row per line in each conversation, in conversation order
+	df_conversations['line_id'] = df_conversations['utterance_list'].str.strip("[]").str.replace("'", "", regex=False).str.split(", ")
+	df_conversations['conversation'] = np.arange(len(df_conversations))
+	df_events = df_conversations[['conversation', 'line_id']].explode('line_id')
+	df_events = df_events.merge(df_lines[['line_id', 'character_id', 'utterance']], on='line_id', how='inner', sort=False)
+
+	n_events = len(df_events)
+	timestamps = (pd.Timestamp(START_DATE) + pd.to_timedelta(np.arange(n_events), unit='s')).to_pydatetime()
+	conversations = df_events['conversation'].to_numpy()
+	boundaries = np.flatnonzero(np.diff(conversations)) + 1
+	starts = np.concatenate([[0], boundaries])
+	ends = np.concatenate([boundaries, [n_events]])
+	agents = df_events['character_id'].tolist()
+	utterances = df_events['utterance'].tolist()
+	characters_A = df_conversations['character_id_A'].tolist()
+	characters_B = df_conversations['character_id_B'].tolist()
+
+	for start, end in zip(starts.tolist(), ends.tolist()):
+		conversation = conversations[start]
+		events = [Event(Event.Type.Utterance, timestamps[i], agents[i], utterances[i]) for i in range(start, end)]
+		yield _build_episode(characters_A[conversation], characters_B[conversation], events)
 
 #
 # Helpers
@@ -75,21 +111,23 @@ def _open_cornell(filename):
 	filename_full = 'cornell movie-dialogs corpus/%s' % filename
 	return rm.open_resource_file('corpora.cornell', filename_full, binary=False, encoding='iso-8859-1')
 
-def _read_cornell(file_buffer, columns):
-	return pd.read_csv(file_buffer, sep=re.escape(' +++$+++ '), names=columns, engine='python')
-
-current_date = START_DATE
-def _build_event(line_id, df_lines):
-	global current_date
-	line = df_lines.loc[line_id]
-	result = Event(Event.Type.Utterance, current_date, line.character_id, line.utterance)
-	current_date += timedelta(seconds=1)
-	return result
-
-def _build_episode(conversation, events):
-	agents = set([conversation.character_id_A, conversation.character_id_B])
+def _read_cornell(filename, columns):
+	"""
+	Split the lines of a corpus file on the ` +++$+++ ` separator. This is much
+	faster than any of the Pandas CSV parsers, as none of them supports
+	multi-character separators without falling back to the Python engine.
+	"""
+	with _open_cornell(filename) as f:
+		rows = [l.rstrip('\n').split(SEPARATOR, len(columns) - 1) for l in f if l.strip()]
+	padding = [''] * len(columns)
+	rows = [r if len(r) == len(columns) else (r + padding)[:len(columns)] for r in rows]
+	return pd.DataFrame(rows, columns=columns)
+
+def _build_episode(character_id_A, character_id_B, events):
+	agents = set([character_id_A, character_id_B])
 	starter_agent = events[0].agent
 	invited_agent = (agents - set([starter_agent])).pop()
 	result = Episode(starter_agent, invited_agent)
+	result.timestamp = events[0].timestamp
 	result.events = events
 	return result
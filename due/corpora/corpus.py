@@ -0,0 +1,238 @@
+"""
+A Corpus is a sized, random-access sequence of Episodes. Corpora can be
+iterated like the `episodes()` generators of the corpus modules, but they also
+support indexing, deterministic shuffling, sharding and windowing without
+loading all the Episodes in memory:
+
+.. code-block:: python
+
+	from due.corpora import cornell
+
+	corpus = cornell.corpus()
+	print(len(corpus), corpus[42])
+
+	# The first 1000 Episodes are for testing, the rest for training
+	test, train = corpus.window(0, 1000), corpus.window(1000)
+
+	# Each worker streams its own share of the training set, shuffled
+	for episode in train.shard(worker_id, n_workers).shuffled(seed=epoch):
+		...
+
+Shards and windows are lightweight views over the same Episodes: only the
+Episodes that are actually accessed are read (and decoded, in the case of
+:class:`ArchiveCorpus`). Both can be pickled, and sent to worker processes.
+
+API
+===
+"""
+import random
+from abc import ABCMeta, abstractmethod
+
+from due.archive import EpisodeArchive
+
+DEFAULT_BUFFER_SIZE = 1000
+
+class Corpus(metaclass=ABCMeta):
+	"""
+	Base class of Corpora. Subclasses only implement :meth:`__len__` and
+	:meth:`_get`, which returns the Episode in a (non-negative) position.
+	"""
+
+	@abstractmethod
+	def __len__(self):
+		"""
+		:return: the number of Episodes in the Corpus
+		:rtype: `int`
+		"""
+		pass
+
+	def __getitem__(self, index):
+		if isinstance(index, slice):
+			return self.window(index.start, index.stop, index.step)
+
+		if index < 0:
+			index += len(self)
+		if not 0 <= index < len(self):
+			raise IndexError("corpus index out of range")
+		return self._get(index)
+
+	def __iter__(self):
+		for i in range(len(self)):
+			yield self._get(i)
+
+	def window(self, start=None, stop=None, step=None):
+		"""
+		Return a view of the Episodes in the given range, with the same
+		semantics as :func:`itertools.islice` (and list slicing).
+
+		:param start: index of the first Episode
+		:type start: `int`
+		:param stop: index after the last Episode
+		:type stop: `int`
+		:param step: distance between consecutive Episodes
+		:type step: `int`
+		:return: a view of the Episodes in the window
+		:rtype: :class:`Corpus`
+		"""
+		return CorpusView(self, range(len(self))[start:stop:step])
+
+	def shard(self, worker_id, n_workers):
+		"""
+		Return the share of Episodes of the given worker, when the Corpus is
+		split among `n_workers`. Shards are interleaved (the worker with ID *i*
+		gets Episodes *i*, *i + n_workers*, ...), so they differ in size by at
+		most one Episode.
+
+		:param worker_id: a worker ID, in `range(n_workers)`
+		:type worker_id: `int`
+		:param n_workers: number of workers
+		:type n_workers: `int`
+		:return: a view of the Episodes in the shard
+		:rtype: :class:`Corpus`
+		"""
+		if n_workers < 1 or not 0 <= worker_id < n_workers:
+			raise ValueError("Invalid shard %s of %s" % (worker_id, n_workers))
+		return self.window(worker_id, None, n_workers)
+
+	def shuffled(self, seed=None, buffer_size=DEFAULT_BUFFER_SIZE):
+		"""
+		Generate the Episodes in a pseudo-random order, keeping at most
+		`buffer_size` Episodes in memory. Episodes are read sequentially into a
+		buffer, and each output Episode is drawn at random from the buffer.
+
+		The order only depends on `seed`, `buffer_size` and the content of
+		the Corpus, so a training job can be replayed exactly.
+
+		:param seed: the seed of the random generator
+		:type seed: `int`
+		:param buffer_size: size of the shuffle buffer. The larger, the closer to a uniform shuffle
+		:type buffer_size: `int`
+		:return: the Episodes in the Corpus, shuffled
+		:rtype: generator of :class:`due.episode.Episode`
+		"""
+		if buffer_size < 1:
+			raise ValueError("Shuffle buffer size must be positive")
+
+		rng = random.Random(seed)
+		buffer = []
+		for episode in self:
+			if len(buffer) < buffer_size:
+				buffer.append(episode)
+				continue
+			i = rng.randrange(buffer_size)
+			yield buffer[i]
+			buffer[i] = episode
+
+		rng.shuffle(buffer)
+		yield from buffer
+
+	@abstractmethod
+	def _get(self, index):
+		"""
+		:param index: a position in `range(len(self))`
+		:type index: `int`
+		:return: the Episode in the given position
+		:rtype: :class:`due.episode.Episode`
+		"""
+		pass
+
+	def __repr__(self):
+		return f"<{self.__class__.__name__}: {len(self)} episodes>"
+
+class CorpusView(Corpus):
+	"""
+	A subset of the Episodes of another Corpus, selected by a `range` of
+	indices. Views of views are flattened, so access is always one lookup
+	away from the underlying Corpus.
+
+	:param corpus: the underlying Corpus
+	:type corpus: :class:`Corpus`
+	:param indices: the indices of the selected Episodes in `corpus`
+	:type indices: `range`
+	"""
+
+	def __init__(self, corpus, indices):
+		if isinstance(corpus, CorpusView):
+			corpus, indices = corpus.corpus, _compose_ranges(corpus.indices, indices)
+		self.corpus = corpus
+		self.indices = indices
+
+	def __len__(self):
+		return len(self.indices)
+
+	def _get(self, index):
+		return self.corpus._get(self.indices[index])
+
+class ListCorpus(Corpus):
+	"""
+	A Corpus of Episodes that are kept in memory.
+
+	:param episodes: the Episodes in the Corpus
+	:type episodes: iterable of :class:`due.episode.Episode`
+	"""
+
+	def __init__(self, episodes):
+		self.episodes = list(episodes)
+
+	def __len__(self):
+		return len(self.episodes)
+
+	def _get(self, index):
+		return self.episodes[index]
+
+class ArchiveCorpus(Corpus):
+	"""
+	A Corpus that reads Episodes from an :class:`due.archive.EpisodeArchive`.
+	The archive is opened lazily (once per process), and each Episode is
+	decoded only when it's accessed.
+
+	:param path: path of an Episode Archive
+	:type path: `str`
+	"""
+
+	def __init__(self, path):
+		self.path = path
+		self._archive = None
+
+	def __len__(self):
+		return len(self.archive)
+
+	@property
+	def archive(self):
+		"""
+		The underlying, read-only Episode Archive
+		"""
+		if self._archive is None:
+			self._archive = EpisodeArchive(self.path)
+		return self._archive
+
+	def close(self):
+		"""
+		Close the underlying archive. It will be opened again if needed.
+		"""
+		if self._archive is not None:
+			self._archive.close()
+			self._archive = None
+
+	def __getstate__(self):
+		return {'path': self.path, '_archive': None}
+
+	def _get(self, index):
+		return self.archive.get_at(index)
+
+#
+# Helpers
+#
+
+def _compose_ranges(outer, inner):
+	"""
+	Return the range of the items of `outer` that are selected by `inner`,
+	whose values are indices in `outer`. Unlike re-slicing `outer` with the
+	bounds of `inner`, this works with negative steps, whose normalized stop
+	can be -1.
+	"""
+	if not inner:
+		return range(0)
+	start = outer[inner[0]]
+	step = outer.step * inner.step
+	return range(start, start + step * len(inner), step)
@@ -0,0 +1,96 @@
+import unittest
+import tempfile
+import shutil
+import os
+from datetime import datetime, timedelta
+
+from due.util.resources import ResourceManager
+from due.corpora import cornell
+from due.event import Event
+
+CORPUS_DIR = 'cornell movie-dialogs corpus'
+
+LINES = [
+	('L1', 'u0', 'm0', 'BIANCA', 'Hi there'),
+	('L2', 'u2', 'm0', 'CAMERON', 'Hello, Bianca'),
+	('L3', 'u0', 'm0', 'BIANCA', 'How are you?'),
+	('L4', 'u2', 'm0', 'CAMERON', 'Fine +++ thanks'),
+	('L5', 'u3', 'm1', 'JOE', 'Café!'),
+]
+
+CONVERSATIONS = [
+	('u0', 'u2', 'm0', "['L1', 'L2', 'L3']"),
+	('u2', 'u0', 'm0', "['L4']"),
+	('u3', 'u4', 'm1', "['L5', 'L2']"),
+]
+
+def _write_corpus(resource_folder):
+	root = os.path.join(resource_folder, 'zip_tmp_root')
+	os.makedirs(os.path.join(root, CORPUS_DIR))
+	with open(os.path.join(root, CORPUS_DIR, 'movie_lines.txt'), 'w', encoding='iso-8859-1') as f:
+		for l in LINES:
+			print(' +++$+++ '.join(l), file=f)
+	with open(os.path.join(root, CORPUS_DIR, 'movie_conversations.txt'), 'w', encoding='iso-8859-1') as f:
+		for c in CONVERSATIONS:
+			print(' +++$+++ '.join(c), file=f)
+	shutil.make_archive(os.path.join(resource_folder, 'cornell_movie_dialogs_corpus'), 'zip', root)
+	shutil.rmtree(root)
+
+class TestCornell(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp_dir = tempfile.TemporaryDirectory()
+		_write_corpus(self.tmp_dir.name)
+		self.rm = ResourceManager(resource_folder=self.tmp_dir.name)
+		self.rm.register_resource('corpora.cornell', 'fake Cornell corpus', 'http://fake.com/cornell.zip', 'cornell_movie_dialogs_corpus.zip')
+		self._original_rm = cornell.rm
+		cornell.rm = self.rm
+
+	def tearDown(self):
+		cornell.rm = self._original_rm
+		self.tmp_dir.cleanup()
+
+	def test_parse(self):
+		episodes = list(cornell.parse())
+		self.assertEqual(len(episodes), 3)
+
+		self.assertEqual([e.payload for e in episodes[0].events], ['Hi there', 'Hello, Bianca', 'How are you?'])
+		self.assertEqual([e.agent for e in episodes[0].events], ['u0', 'u2', 'u0'])
+		self.assertEqual(episodes[0].starter_id, 'u0')
+		self.assertEqual(episodes[0].invited_id, 'u2')
+		self.assertEqual(episodes[1].starter_id, 'u2')
+		self.assertEqual(episodes[1].invited_id, 'u0')
+		self.assertEqual(episodes[1].events[0].payload, 'Fine +++ thanks')
+		self.assertEqual(episodes[2].events[0].payload, 'Café!')
+
+		timestamps = [e.timestamp for episode in episodes for e in episode.events]
+		expected = [cornell.START_DATE + timedelta(seconds=i) for i in range(6)]
+		self.assertEqual(timestamps, expected)
+		self.assertEqual(episodes[1].timestamp, cornell.START_DATE + timedelta(seconds=3))
+		self.assertTrue(all(e.type == Event.Type.Utterance for episode in episodes for e in episode.events))
+
+	def test_cache(self):
+		episodes = list(cornell.episodes())
+		cache = self.rm.list_cache('corpora.cornell')
+		self.assertEqual(len(cache), 1)
+		self.assertEqual(cache[0].version, cornell.PARSER_VERSION)
+
+		self.assertEqual(list(cornell.episodes()), episodes)
+		self.assertEqual(self.rm.cache_hits, 1)
+		self.assertEqual([e.save()['events'] for e in episodes], [e.save()['events'] for e in cornell.parse()])
+
+		# Touching the corpus invalidates the cache
+		zip_path = self.rm.resource_path('corpora.cornell')
+		os.utime(zip_path, ns=(0, 0))
+		list(cornell.episodes())
+		new_cache = self.rm.list_cache('corpora.cornell')
+		self.assertEqual(len(new_cache), 1)
+		self.assertNotEqual(new_cache[0].path, cache[0].path)
+
+	def test_corpus(self):
+		corpus = cornell.corpus()
+		episodes = list(cornell.episodes())
+		self.assertEqual(len(corpus), 3)
+		self.assertEqual(corpus[1], episodes[1])
+		self.assertEqual(list(corpus.window(1)), episodes[1:])
+		corpus.close()
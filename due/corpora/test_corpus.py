@@ -0,0 +1,76 @@
+import unittest
+import os
+import pickle
+import tempfile
+
+from due.archive import EpisodeArchive
+from due.corpora import toy
+from due.corpora.corpus import *
+
+class TestCorpus(unittest.TestCase):
+
+	def setUp(self):
+		self.episodes = list(toy.episodes())
+		self.corpus = toy.corpus()
+
+	def test_random_access(self):
+		self.assertEqual(len(self.corpus), len(self.episodes))
+		self.assertEqual(self.corpus[0], self.episodes[0])
+		self.assertEqual(self.corpus[-1], self.episodes[-1])
+		self.assertEqual(list(self.corpus), self.episodes)
+		with self.assertRaises(IndexError):
+			self.corpus[len(self.episodes)]
+		with self.assertRaises(TypeError):
+			Corpus()
+
+	def test_window(self):
+		self.assertEqual(list(self.corpus.window(1, 4)), self.episodes[1:4])
+		self.assertEqual(list(self.corpus.window(None, None, 2)), self.episodes[::2])
+		self.assertEqual(list(self.corpus[1:]), self.episodes[1:])
+
+		view = self.corpus.window(1).window(1, 3)
+		self.assertIs(view.corpus, self.corpus)
+		self.assertEqual(list(view), self.episodes[2:4])
+		self.assertEqual(view[-1], self.episodes[3])
+
+	def test_window_reversed_and_stepped(self):
+		corpus = ListCorpus(range(10))
+		view = corpus.window(2, 8)
+		items = list(range(10))[2:8]
+		for s in [slice(None, None, -1), slice(None, None, 2), slice(4, 0, -2), slice(-1, -5, -1), slice(1, None, 3)]:
+			self.assertEqual(list(view[s]), items[s])
+		self.assertEqual(list(view[::-1][::2]), items[::-1][::2])
+		self.assertEqual(list(corpus[::-1].window(1, 4)), list(range(10))[::-1][1:4])
+
+	def test_shard(self):
+		shards = [list(self.corpus.shard(i, 3)) for i in range(3)]
+		self.assertEqual(sum(len(s) for s in shards), len(self.episodes))
+		self.assertEqual(shards[1], self.episodes[1::3])
+		with self.assertRaises(ValueError):
+			self.corpus.shard(3, 3)
+
+	def test_shuffled(self):
+		ids = [e.id for e in self.episodes]
+		shuffled = [e.id for e in self.corpus.shuffled(seed=42, buffer_size=2)]
+		self.assertEqual(sorted(shuffled), sorted(ids))
+		self.assertEqual([e.id for e in self.corpus.shuffled(seed=42, buffer_size=2)], shuffled)
+
+		shuffled_full = [e.id for e in self.corpus.shuffled(seed=42, buffer_size=len(ids))]
+		self.assertEqual(sorted(shuffled_full), sorted(ids))
+		with self.assertRaises(ValueError):
+			list(self.corpus.shuffled(buffer_size=0))
+
+	def test_archive_corpus(self):
+		with tempfile.TemporaryDirectory() as tmp_dir:
+			path = os.path.join(tmp_dir, 'episodes.duea')
+			with EpisodeArchive(path, mode='w') as archive:
+				archive.add_episodes(self.episodes)
+
+			corpus = ArchiveCorpus(path)
+			self.assertEqual(len(corpus), len(self.episodes))
+			self.assertEqual(corpus[2], self.episodes[2])
+
+			shard = pickle.loads(pickle.dumps(corpus.shard(0, 2)))
+			self.assertEqual(list(shard), self.episodes[::2])
+			shard.corpus.close()
+			corpus.close()
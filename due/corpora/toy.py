@@ -3,8 +3,6 @@ Load a toy corpus that can be used for quick test and development of Due. The
 corpus consists of a small set of hand-crafted smalltalk-ish Episodes between
 two Agents.
 """
-import os
-import tempfile
 try:
     import importlib.resources as importlib_resources
 except ImportError:
@@ -13,15 +11,20 @@ except ImportError:
 from due import corpora
 from due.episode import Episode
 from due.persistence import deserialize
+from due.corpora.corpus import ListCorpus
 
 def episodes():
-    # TODO: add support for file buffers in `deserialize`
-    toy_yaml = importlib_resources.read_text(corpora, 'toy.yaml')
-    with tempfile.TemporaryDirectory() as tmp_dir:
-        path = os.path.join(tmp_dir, 'toy.yaml')
-        with open(path, 'w') as f:
-            f.write(toy_yaml)
-        saved_episodes = deserialize(path)
+    toy_yaml = importlib_resources.read_binary(corpora, 'toy.yaml')
+    saved_episodes = deserialize(toy_yaml, file_format='yaml')
 
     for e in saved_episodes:
         yield Episode.load(e)
+
+def corpus():
+    """
+    Return the toy corpus as a :class:`due.corpora.corpus.Corpus`.
+
+    :return: the toy corpus
+    :rtype: :class:`due.corpora.corpus.ListCorpus`
+    """
+    return ListCorpus(episodes())
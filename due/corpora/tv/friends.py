@@ -6,14 +6,29 @@ https://sites.google.com/site/friendstvcorpus/
 
 Conversations are grouped in **scenes** and each scene is given a brief English
 description (which is currently not modelled in Episodes).
+
+Each scene becomes an Episode, whose starter is the first Agent to speak. Scenes
+often involve more than two characters: all of them except the starter are
+listed in the Episode's `invited_ids`. Scenes with a single speaker are skipped.
+No timestamp is provided in the corpus: every Episode starts on the day the show
+first aired, and its lines are placed 2 seconds apart one another.
+
+The first time the corpus is loaded, the parsed Episodes are cached in the
+Resource Manager's artifact cache (see :mod:`due.corpora.cache`), so it's parsed
+again only when the corpus ZIP file changes.
 """
 import logging
+from itertools import islice
 from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
 
+import numpy as np
 import pandas as pd
 
-from due.event import Event, EventTuple
+from due.event import Event
 from due.episode import Episode
+from due.corpora.cache import cached_episodes, cached_archive_path
+from due.corpora.corpus import ArchiveCorpus
 from due import resource_manager
 
 rm = resource_manager
@@ -21,54 +36,138 @@ logger = logging.getLogger(__name__)
 
 START_DATE = datetime(year=1994, month=9, day=22)
 DELTA = timedelta(seconds=2)
+DEFAULT_CHUNK_SIZE = 500
+PARSER_VERSION = 'episodes-1'
 
-def episodes():
+def episodes(n_jobs=1, chunk_size=DEFAULT_CHUNK_SIZE):
     """
-    Return the list of all the Episodes in the Friends Corpus
+    Generate all the Episodes in the Friends Corpus, in scene order. Episodes
+    are read from cache; if the cache is missing or stale, the corpus is parsed
+    with :func:`parse` first.
+
+    :param n_jobs: number of worker processes, if the corpus needs to be parsed
+    :type n_jobs: `int`
+    :param chunk_size: number of scenes in each chunk (when `n_jobs > 1`)
+    :type chunk_size: `int`
+    :return: the Episodes in the Friends corpus
+    :rtype: generator of :class:`due.episode.Episode`
     """
-    with rm.open_resource_file('corpora.tv.friends', 'friends-final.txt', binary=False) as f:
-        df = pd.read_csv(f, sep='\t', header=None, index_col=0)
+    parse_f = lambda: parse(n_jobs, chunk_size)
+    yield from cached_episodes(rm, 'corpora.tv.friends', PARSER_VERSION, parse_f)
 
-    df.columns = ["scene_id", "person", "gender", "original_line", "line", "metadata", "filename"]
-    scenes = [int(x) for x in set(df['scene_id']) if x.isdigit()]
-    scenes.sort(key=lambda x: int(x))
-
-    for i, scene_id in enumerate(scenes):
-        try:
-            scene_df = df[df['scene_id'] == str(scene_id)]
-            episode = build_episode(scene_df)
-            yield episode
-        except Exception as e:
-            logger.warning("Skipping scene %s because of exception: %s", i, e)
-
-def _get_events_dataframe(df):
-    df_events = df[['person', 'line']]
-    df_events.columns = ['agent', 'payload']
-    timestamp_series = pd.Series(pd.date_range(start=START_DATE, periods=len(df_events), freq=DELTA), index=df_events.index, name='timestamp')    
-    df_events = df_events.join(pd.DataFrame(timestamp_series))
-    df_events['type'] = Event.Type.Utterance
-    df_events = df_events[['type', 'timestamp', 'agent', 'payload']]
-    return df_events
+def corpus(n_jobs=1, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Return the Friends Corpus as a random-access
+    :class:`due.corpora.corpus.Corpus`, backed by the cached Episode Archive.
+    See :func:`episodes` for an explanation of the parameters.
+
+    :return: the Friends corpus
+    :rtype: :class:`due.corpora.corpus.ArchiveCorpus`
+    """
+    parse_f = lambda: parse(n_jobs, chunk_size)
+    return ArchiveCorpus(cached_archive_path(rm, 'corpora.tv.friends', PARSER_VERSION, parse_f))
+
+def parse(n_jobs=1, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Parse the corpus file, and generate all the Episodes in the Friends Corpus,
+    in scene order.
+
+    The corpus file is parsed, sorted and grouped by scene only once; Episodes
+    are then built lazily from the grouped rows. If `n_jobs` is greater than 1,
+    scenes are split in chunks of `chunk_size`, which are turned into Episodes
+    by a pool of `n_jobs` processes. Only a bounded number of chunks is
+    processed ahead of the consumer.
+
+    :param n_jobs: number of worker processes
+    :type n_jobs: `int`
+    :param chunk_size: number of scenes in each chunk (when `n_jobs > 1`)
+    :type chunk_size: `int`
+    :return: the Episodes in the Friends corpus
+    :rtype: generator of :class:`due.episode.Episode`
+    """
+    scenes = _scenes()
+    if n_jobs <= 1:
+        for scene_id, persons, lines in scenes:
+            episode = _build_scene_episode(scene_id, persons, lines)
+            if episode is not None:
+                yield episode
+        return
+
+    chunks = iter(lambda: list(islice(scenes, chunk_size)), [])
+    with ProcessPoolExecutor(n_jobs) as executor:
+        pending = [executor.submit(_build_chunk, c) for c in islice(chunks, 2*n_jobs)]
+        while pending:
+            result = pending.pop(0).result()
+            next_chunk = next(chunks, None)
+            if next_chunk is not None:
+                pending.append(executor.submit(_build_chunk, next_chunk))
+            yield from result
 
 def build_episode(df):
     """
-    Build an Episode out of a Pandas DataFrame of events. The input DataFrame
-    must match the fields of an Event tuple:
-
-    * `type`
-    * `timestamp`
-    * `agent`
-    * `payload`
-    
-    :param df: A Pandas DataFrame representing events
+    Build an Episode out of a Pandas DataFrame of lines from the same scene.
+    The input DataFrame must have the following columns:
+
+    * `person`: the character who speaks the line
+    * `line`: the line
+
+    :param df: A Pandas DataFrame representing lines in a scene
     :type df: :class:`pandas.DataFrame`
-    :return: An Episode containing the given events
+    :return: An Episode containing the given lines as events
     :rtype: :class:`due.episode.Episode`
     """
-    df_events = _get_events_dataframe(df)
-    agents = set(df_events['agent'])
-    starter_agent = df_events.iloc[0].agent
-    invited_agent = (agents - set([starter_agent])).pop() # TODO: multiple agents!
-    result = Episode(starter_agent, invited_agent)
-    result.events = [EventTuple(*e[1:]) for e in df_events.itertuples(name=None)]
+    persons = df['person'].tolist()
+    if len(set(persons)) < 2:
+        raise ValueError("Cannot build an Episode out of a scene with less than two speakers")
+    return _build_episode(persons, df['line'].fillna('').tolist())
+
+#
+# Helpers
+#
+
+def _read_friends():
+    with rm.open_resource_file('corpora.tv.friends', 'friends-final.txt', binary=False) as f:
+        df = pd.read_csv(f, sep='\t', header=None, index_col=0)
+    df.columns = ["scene_id", "person", "gender", "original_line", "line", "metadata", "filename"]
+    return df
+
+def _scenes():
+    """
+    Sort the corpus by scene once (keeping the original order of lines within
+    each scene), and generate `(scene_id, persons, lines)` tuples.
+    """
+    df = _read_friends()
+    df = df[df['scene_id'].astype(str).str.isdigit()]
+    scene_ids = df['scene_id'].astype(int).to_numpy()
+    order = np.argsort(scene_ids, kind='stable')
+    scene_ids = scene_ids[order]
+    persons = df['person'].fillna('').astype(str).to_numpy()[order].tolist()
+    lines = df['line'].fillna('').to_numpy()[order].tolist()
+
+    boundaries = np.flatnonzero(np.diff(scene_ids)) + 1
+    starts = np.concatenate([[0], boundaries]).tolist()
+    ends = np.concatenate([boundaries, [len(scene_ids)]]).tolist()
+    for start, end in zip(starts, ends):
+        yield int(scene_ids[start]), persons[start:end], lines[start:end]
+
+def _build_scene_episode(scene_id, persons, lines):
+    if len(set(persons)) < 2:
+        logger.warning("Skipping scene %s because it has less than two speakers", scene_id)
+        return None
+    return _build_episode(persons, lines)
+
+def _build_chunk(scenes):
+    result = [_build_scene_episode(*s) for s in scenes]
+    return [e for e in result if e is not None]
+
+def _build_episode(persons, lines):
+    starter_agent = persons[0]
+    invited_agents = list(dict.fromkeys(p for p in persons if p != starter_agent))
+    result = Episode(starter_agent, invited_agents[0])
+    result.invited_ids = invited_agents
+    result.timestamp = START_DATE
+    result.events = [
+        Event(Event.Type.Utterance, START_DATE + i*DELTA, person, line)
+        for i, (person, line) in enumerate(zip(persons, lines))
+    ]
     return result
@@ -0,0 +1,71 @@
+import unittest
+import tempfile
+import os
+from zipfile import ZipFile
+from datetime import timedelta
+
+from due.util.resources import ResourceManager
+from due.corpora.tv import friends
+
+ROWS = [
+	# scene_id, person, line
+	('2', 'Monica', 'There\'s nothing to tell!'),
+	('1', 'Ross', 'Hi.'),
+	('2', 'Joey', 'C\'mon, you\'re going out with the guy!'),
+	('1', 'Chandler', 'Hey.'),
+	('2', 'Chandler', 'All right Joey, be nice.'),
+	('3', 'Phoebe', 'Just, \'cause, I don\'t want her to go through what I went through with Carl- oh!'),
+	('x', 'Narrator', 'Not a scene'),
+	('2', 'Monica', 'Okay, everybody relax.'),
+	('10', 'Rachel', 'Oh God'),
+	('10', 'Ross', ''),
+]
+
+def _write_corpus(resource_folder):
+	lines = []
+	for i, (scene_id, person, line) in enumerate(ROWS):
+		lines.append('\t'.join([str(i), scene_id, person, 'F', line, line, '', 'file.txt']))
+	with ZipFile(os.path.join(resource_folder, 'friends_corpus.zip'), 'w') as z:
+		z.writestr('friends-final.txt', '\n'.join(lines) + '\n')
+
+class TestFriends(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp_dir = tempfile.TemporaryDirectory()
+		_write_corpus(self.tmp_dir.name)
+		rm = ResourceManager(resource_folder=self.tmp_dir.name)
+		rm.register_resource('corpora.tv.friends', 'fake Friends corpus', 'http://fake.com/friends.zip', 'friends_corpus.zip')
+		self._original_rm = friends.rm
+		friends.rm = rm
+
+	def tearDown(self):
+		friends.rm = self._original_rm
+		self.tmp_dir.cleanup()
+
+	def test_episodes(self):
+		episodes = list(friends.episodes())
+		self.assertEqual(len(episodes), 3)
+
+		self.assertEqual([e.agent for e in episodes[0].events], ['Ross', 'Chandler'])
+		self.assertEqual(episodes[0].starter_id, 'Ross')
+		self.assertEqual(episodes[0].invited_ids, ['Chandler'])
+
+		self.assertEqual([e.payload for e in episodes[1].events], [r[2] for r in ROWS if r[0] == '2'])
+		self.assertEqual(episodes[1].starter_id, 'Monica')
+		self.assertEqual(episodes[1].invited_id, 'Joey')
+		self.assertEqual(episodes[1].invited_ids, ['Joey', 'Chandler'])
+		self.assertEqual([e.timestamp for e in episodes[1].events], [friends.START_DATE + i*friends.DELTA for i in range(4)])
+
+		self.assertEqual([e.payload for e in episodes[2].events], ['Oh God', ''])
+
+	def test_cache(self):
+		episodes = list(friends.episodes())
+		self.assertEqual(len(friends.rm.list_cache('corpora.tv.friends')), 1)
+		self.assertEqual(list(friends.episodes()), episodes)
+		self.assertEqual(friends.rm.cache_hits, 1)
+
+	def test_parallel(self):
+		episodes = list(friends.parse())
+		parallel_episodes = list(friends.parse(n_jobs=2, chunk_size=1))
+		self.assertEqual([e.save()['events'] for e in parallel_episodes], [e.save()['events'] for e in episodes])
+		self.assertEqual([e.invited_ids for e in parallel_episodes], [e.invited_ids for e in episodes])
@@ -4,6 +4,7 @@ for Episodes, as well as some helper methods to manipulate their content:
 
 	* :class:`Episode` models recorded Episodes that can be used to train agents
 	* :class:`LiveEpisode` models Episodes that are still in progress.
+	* :class:`AsyncLiveEpisode` runs LiveEpisodes on an asyncio event loop.
 	* :func:`extract_utterance_pairs` will extract utterances as strings from Episodes.
 
 API
@@ -14,27 +15,37 @@ import json
 import uuid
 import asyncio
 import logging
+from itertools import islice
 from functools import lru_cache
+from concurrent.futures import Future, ProcessPoolExecutor
 from datetime import datetime
 
 import numpy as np
 import pandas as pd
 
 import due.agent
+from due.retention import RetainedEvents
+from due.util import tracing, metrics
 from due.util.time import convert_datetime, parse_timedelta
 
 UTTERANCE_LABEL = 'utterance'
 MAX_EVENT_RESPONSES = 200
 
+_EVENTS = metrics.REGISTRY.counter('due_events_total', "Events acted in LiveEpisodes", ['type'])
+
 class Episode(object):
 	"""
-	An Episode is a sequence of Events issued by Agents
+	An Episode is a sequence of Events issued by Agents.
+
+	Recorded Episodes (eg. scenes from a corpus) may involve more than two
+	Agents: in this case, `invited_ids` lists all of the invited Agents, and
+	`invited_id` is the first of them.
 	"""
 
 	def __init__(self, starter_agent_id, invited_agent_id):
 		self._logger = logging.getLogger(__name__ + ".Episode")
 		self.starter_id = starter_agent_id
-		self.invited_id = invited_agent_id
+		self.invited_ids = [invited_agent_id]
 		self.id = str(uuid.uuid1())
 		self.timestamp = datetime.now()
 		self.events = []
@@ -42,7 +53,7 @@ class Episode(object):
 	def __eq__(self, other):
 		if isinstance(other, Episode):
 			if self.starter_id != other.starter_id: return False
-			if self.invited_id != other.invited_id: return False
+			if self.invited_ids != other.invited_ids: return False
 			if self.id != other.id: return False
 			if self.timestamp != other.timestamp: return False
 			if self.events != other.events: return False
@@ -53,14 +64,32 @@ class Episode(object):
 	def __ne__(self, other):
 		return not self.__eq__(other)
 
+	@property
+	def invited_id(self):
+		"""
+		The ID of the (first) Agent that was invited to the Episode
+		"""
+		return self.invited_ids[0]
+
+	@invited_id.setter
+	def invited_id(self, value):
+		self.invited_ids[0] = value
+
 	def last_event(self, event_type=None):
 		"""
 		Returns the last event in the Episode. Optionally, events can be filtered
 		by type.
 
+		This is a constant time lookup in LiveEpisodes with a retention window,
+		which keep a pointer to the last Event of each type (see
+		:class:`due.retention.RetainedEvents`).
+
 		:param event_type: an event type, or a collection of types
 		:type event_type: :class:`Event.Type` or list of :class:`Event.Type`
 		"""
+		if isinstance(self.events, RetainedEvents):
+			return self.events.last(event_type)
+
 		event_type = event_type if not isinstance(event_type, Event.Type) else (event_type,)
 		for e in reversed(self.events):
 			if event_type is None or e.type in event_type:
@@ -88,7 +117,7 @@ class Episode(object):
 			'id': self.id,
 			'timestamp': self.timestamp,
 			'starter_agent': str(self.starter_id),
-			'invited_agents': [str(self.invited_id)],
+			'invited_agents': [str(i) for i in self.invited_ids],
 			'events': [e.save() for e in self.events],
 			'format': 'standard'
 		}
@@ -112,6 +141,7 @@ class Episode(object):
 			saved_episode = _uncompact_saved_episode(saved_episode)
 
 		result = Episode(saved_episode['starter_agent'], saved_episode['invited_agents'][0])
+		result.invited_ids = list(saved_episode['invited_agents'])
 		result.id = saved_episode['id']
 		result.timestamp = convert_datetime(saved_episode['timestamp'])
 		result.events = [Event.load(e) for e in saved_episode['events']]
@@ -122,20 +152,33 @@ class LiveEpisode(Episode):
 	A LiveEpisode is an Episode that is currently under way. That is, new Events
 	can be acted in it.
 
+	By default, all the Events are kept in memory, in a plain `list`. A
+	:class:`due.retention.RetentionPolicy` with a `window` can be given to keep
+	only the most recent ones, and spill the others to disk: `events` is then
+	a :class:`due.retention.RetainedEvents` sequence.
+
 	:param starter_agent: the Agent which started the Episode
 	:type starter_agent: :class:`due.agent.Agent`
 	:param invited_agent: the agent invited to the Episode
 	:type invited_agent: :class:`due.agent.Agent`
+	:param event_log: if given, acted Events will be appended to this log
+	:type event_log: :class:`due.eventlog.EventLog`
+	:param retention: the Event retention policy
+	:type retention: :class:`due.retention.RetentionPolicy`
 	"""
-	def __init__(self, starter_agent, invited_agent):
+	def __init__(self, starter_agent, invited_agent, event_log=None, retention=None):
 		super().__init__(starter_agent.id, invited_agent.id)
 		self._logger = logging.getLogger(__name__ + ".LiveEpisode")
+		self.events = RetainedEvents(retention) if retention is not None and retention.window is not None else []
 		self.starter = starter_agent
 		self.invited = invited_agent
 		self._agent_by_id = {
 			starter_agent.id: starter_agent,
 			invited_agent.id: invited_agent
 		}
+		self.event_log = event_log
+		if event_log is not None:
+			event_log.track(self)
 
 	def add_event(self, event):
 		"""
@@ -149,6 +192,14 @@ class LiveEpisode(Episode):
 		:param event: the event that was acted by the Agent
 		:type event: :class:`due.event.Event`
 		"""
+		if not tracing.enabled():
+			self._process_event(event, False)
+			return
+
+		with tracing.span('episode.add_event'):
+			self._process_event(event, True)
+
+	def _process_event(self, event, traced):
 		new_events = [event]
 
 		count = 0
@@ -156,20 +207,41 @@ class LiveEpisode(Episode):
 			e = new_events.pop(0)
 			self._logger.info("New %s event by %s: '%s'", e.type.name, e.agent, e.payload)
 			agent = self.agent_by_id(e.agent)
-			self.events.append(e)
-			e.mark_acted()
-			for a in self._other_agents(agent):
-				self._logger.info("Notifying %s", a)
-				response_events = a.event_callback(e, self)
-				new_events.extend(response_events)
+			if traced:
+				new_events.extend(self._act_traced(agent, e))
+			else:
+				self._append_event(e)
+				new_events.extend(self._notify(agent, e))
 
 			count += 1
 			if count > MAX_EVENT_RESPONSES:
 				self._logger.warning("Agents reached maximum number of responses allowed for a single Event (%s). Further Events won't be notified to Agents", MAX_EVENT_RESPONSES)
 				break
 
-		self.events.extend(new_events)
-		[e.mark_acted() for e in new_events]
+		for e in new_events:
+			self._append_event(e)
+
+	def _notify(self, agent, event):
+		"""Notify an Event to the other participants, and return their responses."""
+		result = []
+		for a in self._other_agents(agent):
+			self._logger.info("Notifying %s", a)
+			result.extend(a.event_callback(event, self))
+		return result
+
+	def _act_traced(self, agent, event):
+		"""
+		Act and notify an Event, storing the breakdown of the time that was
+		spent processing it in its `trace` attribute (and in the Event Log).
+		"""
+		with tracing.trace() as breakdown:
+			seq = self._append_event(event)
+			with tracing.span('episode.notify'):
+				result = self._notify(agent, event)
+		event.trace = breakdown
+		if seq is not None and self.event_log is not None:
+			self.event_log.log_trace(self, seq, breakdown)
+		return result
 
 	def agent_by_id(self, agent_id):
 		"""
@@ -187,29 +259,208 @@ class LiveEpisode(Episode):
 		assert isinstance(result, due.agent.Agent)
 		return result
 
+	def _append_event(self, event):
+		self.events.append(event)
+		event.mark_acted()
+		_EVENTS.labels(type=event.type.name).inc()
+		if self.event_log is not None:
+			return self.event_log.log_event(self, event)
+		return None
+
 	def _other_agents(self, agent):
 		return [self.starter] if agent == self.invited else [self.invited]
 
 class AsyncLiveEpisode(LiveEpisode):
 	"""
 	This is a subclass of :class:`LiveEpisode` that implement asynchronous
-	notification of new Events.
+	notification of new Events, so that a single event loop can run many
+	Episodes concurrently.
+
+	Agents that implement the asynchronous protocol
+	(:class:`due.agent.AsyncAgent`) are notified by awaiting their callbacks
+	on the loop. Other Agents are synchronous, and possibly CPU-bound: their
+	:meth:`due.agent.Agent.event_callback` is offloaded to `executor`, so that
+	it doesn't block the loop. This is the loop's default thread pool, unless
+	another executor is given (eg. an :class:`AgentProcessPool`). Note that
+	synchronous Agents may be notified of Events of different Episodes from
+	different threads at the same time.
+
+	:meth:`add_event` must be called from the thread that runs the event loop.
+	Notifications run as tasks, which are tracked by the Episode: use
+	:meth:`join` to wait until all of them are done, and :meth:`cancel` to
+	abort them.
+
+	:param starter_agent: the Agent which started the Episode
+	:type starter_agent: :class:`due.agent.Agent`
+	:param invited_agent: the agent invited to the Episode
+	:type invited_agent: :class:`due.agent.Agent`
+	:param event_log: if given, acted Events will be appended to this log
+	:type event_log: :class:`due.eventlog.EventLog`
+	:param retention: the Event retention policy
+	:type retention: :class:`due.retention.RetentionPolicy`
+	:param executor: where to run the callbacks of synchronous Agents
+	:type executor: :class:`concurrent.futures.Executor`
 	"""
 
+	def __init__(self, starter_agent, invited_agent, event_log=None, retention=None, executor=None):
+		super().__init__(starter_agent, invited_agent, event_log, retention)
+		self._logger = logging.getLogger(__name__ + ".AsyncLiveEpisode")
+		self.executor = executor
+		self._tasks = set()
+
+	@property
+	def pending(self):
+		"""
+		The number of notifications that are still running
+		"""
+		return len(self._tasks)
+
 	def add_event(self, event):
-		self.events.append(event)
-		event.mark_acted()
-		agent = self.agent_by_id(event.agent)
-		for a in self._other_agents(agent):
-			loop = asyncio.get_event_loop()
-			loop.create_task(self.async_event_callback(a, event))
+		self._add_event(event, 0)
+
+	async def join(self):
+		"""
+		Wait until all the notifications (including the ones of the response
+		Events they produce) are done.
+		"""
+		while self._tasks:
+			await asyncio.wait(list(self._tasks))
+
+	def cancel(self):
+		"""
+		Cancel all the running notifications. Response Events of cancelled
+		callbacks are not acted.
+
+		:return: the number of cancelled notifications
+		:rtype: `int`
+		"""
+		tasks = list(self._tasks)
+		for t in tasks:
+			t.cancel()
+		return len(tasks)
 
 	async def async_event_callback(self, agent, event):
+		"""
+		Notify an Event to the given Agent, and return its response Events.
+
+		:param agent: the Agent to notify
+		:type agent: :class:`due.agent.Agent`
+		:param event: the new Event
+		:type event: :class:`due.event.Event`
+		:return: A list of response Events
+		:rtype: `list` of :class:`due.event.Event`
+		"""
 		self._logger.info("Notifying event %s to agent %s", event, agent)
-		response_events = agent.event_callback(event, self)
-		if response_events:
-			for e in response_events:
-				self.add_event(e)
+		if isinstance(agent, due.agent.AsyncAgent):
+			return await agent.async_event_callback(event, self)
+
+		if isinstance(self.executor, AgentProcessPool):
+			return await asyncio.wrap_future(self.executor.event_callback(agent, event, self))
+		return await asyncio.get_running_loop().run_in_executor(self.executor, agent.event_callback, event, self)
+
+	def _add_event(self, event, depth):
+		try:
+			loop = asyncio.get_running_loop()
+		except RuntimeError:
+			raise RuntimeError("Events can only be added to an AsyncLiveEpisode from a running event loop") from None
+
+		self._logger.info("New %s event by %s: '%s'", event.type.name, event.agent, event.payload)
+		self._append_event(event)
+		if depth >= MAX_EVENT_RESPONSES:
+			self._logger.warning("Agents reached maximum number of responses allowed for a single Event (%s). Further Events won't be notified to Agents", MAX_EVENT_RESPONSES)
+			return
+
+		agent = self.agent_by_id(event.agent)
+		for a in self._other_agents(agent):
+			task = loop.create_task(self._notify(a, event, depth))
+			self._tasks.add(task)
+			task.add_done_callback(self._task_done)
+
+	async def _notify(self, agent, event, depth):
+		response_events = await self.async_event_callback(agent, event)
+		for e in response_events or []:
+			self._add_event(e, depth + 1)
+
+	def _task_done(self, task):
+		self._tasks.discard(task)
+		if not task.cancelled() and task.exception() is not None:
+			self._logger.error("Event notification failed", exc_info=task.exception())
+
+class AgentProcessPool(object):
+	"""
+	An executor that runs the callbacks of synchronous Agents in a pool of
+	worker processes, so that CPU-bound Agents can answer in parallel without
+	contending for the interpreter lock. Pass it as the `executor` of an
+	:class:`AsyncLiveEpisode`.
+
+	Each worker process holds its own copy of the given Agents, which is made
+	when the worker starts: changes to an Agent's state that happen while
+	processing a callback (eg. learning) stay in that worker, and are not
+	seen by the parent process or the other workers. Episodes are sent to the
+	workers in their saved form (see :meth:`Episode.save`).
+
+	:param agents: the Agents whose callbacks will run in the pool
+	:type agents: `list` of :class:`due.agent.Agent`
+	:param max_workers: the number of worker processes (defaults to the number of CPUs)
+	:type max_workers: `int`
+	"""
+
+	def __init__(self, agents, max_workers=None):
+		self.agent_ids = {a.id for a in agents}
+		self._executor = ProcessPoolExecutor(max_workers, initializer=_init_agent_process, initargs=(list(agents),))
+
+	def event_callback(self, agent, event, episode):
+		"""
+		Submit the notification of an Event to one of the pooled Agents.
+
+		:param agent: one of the Agents of the pool
+		:type agent: :class:`due.agent.Agent`
+		:param event: the new Event
+		:type event: :class:`due.event.Event`
+		:param episode: the Episode where the Event was acted
+		:type episode: :class:`due.episode.Episode`
+		:return: a future of the list of response Events
+		:rtype: :class:`concurrent.futures.Future`
+		"""
+		if agent.id not in self.agent_ids:
+			raise ValueError(f"Agent '{agent.id}' is not served by this pool")
+
+		result = Future()
+		def done(f):
+			if f.cancelled():
+				result.cancel()
+			elif f.exception() is not None:
+				result.set_exception(f.exception())
+			else:
+				result.set_result([Event.load(e) for e in f.result()])
+		self._executor.submit(_agent_process_event_callback, agent.id, event.save(), episode.save()).add_done_callback(done)
+		return result
+
+	def shutdown(self, wait=True):
+		"""
+		Stop the worker processes.
+		"""
+		self._executor.shutdown(wait=wait)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.shutdown()
+
+#
+# Process Pool Helpers
+#
+
+_process_agents = {}
+
+def _init_agent_process(agents):
+	_process_agents.update({a.id: a for a in agents})
+
+def _agent_process_event_callback(agent_id, saved_event, saved_episode):
+	episode = Episode.load(saved_episode)
+	response_events = _process_agents[agent_id].event_callback(Event.load(saved_event), episode)
+	return [e.save() for e in response_events or []]
 
 #
 # Save/Load Helpers
@@ -232,8 +483,9 @@ def _compact_saved_event(saved_event):
 	Prepare an Event for compact serialization, meaning that its fields must
 	be writable as a line of CSV). This is always the case, except for Actions,
 	which payloads are objects. In this case, we serialize them as JSON.
+	Tracing breakdowns are not kept in the compact format.
 	"""
-	e = saved_event
+	e = {k: v for k, v in saved_event.items() if k != 'trace'}
 	if e['type'] == Event.Type.Action.value:
 		return {**e, 'payload': json.dumps(e['payload'])}
 	return e
@@ -346,7 +598,7 @@ def extract_utterance_pairs(episode, preprocess_f=None):
 	preprocess_f = lru_cache(4)(preprocess_f) if preprocess_f else lambda x: x
 	result_X = []
 	result_y = []
-	for e1, e2 in zip(episode.events, episode.events[1:]):
+	for e1, e2 in zip(episode.events, islice(episode.events, 1, None)):
 		if not _is_utterance(e1) or not _is_utterance(e2):
 			raise NotImplementedError("Non-utterance Events are not supported yet")
 
@@ -50,6 +50,8 @@ class Event(EventTuple):
 			raise ValueError('`agent` value is not a `str` object. Please provide a ' \
 				             'string ID to ensure correct serialization.')
 		self.acted = None
+		self.outcome = None
+		self.trace = None
 
 	def mark_acted(self, timestamp=None):
 		"""
@@ -65,7 +67,8 @@ class Event(EventTuple):
 
 	def save(self):
 		"""
-		Export the Event to a serializable `list`.
+		Export the Event to a serializable `list`. The tracing breakdown of
+		the Event (see :mod:`due.util.tracing`) is saved too, if any.
 
 		:return: a saved Event
 		:rtype: `list`
@@ -77,7 +80,10 @@ class Event(EventTuple):
 		if self.type == Event.Type.Action:
 			result = result._replace(payload=self.payload.save())
 
-		return dict(result._asdict())
+		result = dict(result._asdict())
+		if self.trace is not None:
+			result['trace'] = dict(self.trace)
+		return result
 
 	@staticmethod
 	def load(saved):
@@ -88,12 +94,14 @@ class Event(EventTuple):
 		:type saved: `list`
 		"""
 		_action = Event.Type.Action.value
-		return Event(
+		result = Event(
 			Event.Type(saved['type']),
 			convert_datetime(saved['timestamp']),
 			saved['agent'],
 			Action.load(saved['payload']) if saved['type'] == _action else saved['payload']
 		)
+		result.trace = saved.get('trace')
+		return result
 
 	def clone(self):
 		"""
@@ -0,0 +1,329 @@
+"""
+An Event Log is an append-only, write-ahead log of the Events that are acted in
+:class:`due.episode.LiveEpisode` objects. It makes live conversations durable at
+a constant cost per Event, instead of re-serializing whole Episodes at each
+checkpoint.
+
+Each Event is appended to the log file as one JSON line, and flushed to the
+operating system immediately; `fsync` calls are batched, and issued every
+`sync_every` Events or `sync_interval` seconds, whichever comes first. A
+background thread syncs records that are left pending by a log that went
+idle, so each record reaches the disk within about `sync_interval` seconds. From time
+to time, the log is **compacted**: the current content of the tracked Episodes
+is written to a snapshot file, and the log is truncated.
+
+After a crash, :meth:`EventLog.recover` rebuilds the LiveEpisodes from the last
+snapshot and the Events that were logged after it:
+
+.. code-block:: python
+
+	from due.eventlog import EventLog
+	from due.episode import LiveEpisode
+
+	log = EventLog('/var/lib/due/events.log')
+	episode = LiveEpisode(human, agent, event_log=log)
+	...
+
+	# After a restart
+	log = EventLog('/var/lib/due/events.log')
+	live_episodes = log.recover({human.id: human, agent.id: agent})
+
+Episodes stay in the log until they are explicitly released with
+:meth:`EventLog.forget` (eg. once they have been saved or learned).
+
+API
+===
+"""
+import os
+import json
+import time
+import logging
+import threading
+
+from due.util.time import json_default
+
+SNAPSHOT_SUFFIX = '.snapshot'
+
+DEFAULT_SYNC_EVERY = 100
+DEFAULT_SYNC_INTERVAL = 1.0
+
+class EventLog(object):
+	"""
+	A write-ahead log of the Events acted in a set of LiveEpisodes.
+
+	:param path: path of the log file. The snapshot is stored next to it, with a `.snapshot` suffix
+	:type path: `str`
+	:param sync_every: issue a `fsync` at least once every this many records
+	:type sync_every: `int`
+	:param sync_interval: issue a `fsync` at least once every this many seconds, if there are unsynced records
+	:type sync_interval: `float`
+	:param compact_every: if set, compact the log automatically every this many records
+	:type compact_every: `int`
+	"""
+
+	def __init__(self, path, sync_every=DEFAULT_SYNC_EVERY, sync_interval=DEFAULT_SYNC_INTERVAL, compact_every=None):
+		self._logger = logging.getLogger(__name__ + ".EventLog")
+		self.path = path
+		self.snapshot_path = path + SNAPSHOT_SUFFIX
+		self.sync_every = sync_every
+		self.sync_interval = sync_interval
+		self.compact_every = compact_every
+
+		self._lock = threading.RLock()
+		self._episodes = {}
+		self._unsynced = 0
+		self._last_sync = time.monotonic()
+		self._since_compaction = 0
+		self._file = open(path, 'a')
+		self._seq = self._last_seq()
+		self._closed = threading.Event()
+		self._sync_thread = threading.Thread(target=self._run_sync, name='due-eventlog-sync', daemon=True)
+		self._sync_thread.start()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+	def track(self, episode):
+		"""
+		Start logging a new LiveEpisode. This is called by the
+		:class:`due.episode.LiveEpisode` constructor when an Event Log is given.
+
+		:param episode: a new LiveEpisode
+		:type episode: :class:`due.episode.LiveEpisode`
+		"""
+		with self._lock:
+			self._episodes[episode.id] = episode
+			self._append({'op': 'start', 'episode': _saved_header(episode)})
+
+	def log_event(self, episode, event):
+		"""
+		Append an Event that was acted in a tracked Episode.
+
+		:param episode: the Episode where the Event was acted
+		:type episode: :class:`due.episode.LiveEpisode`
+		:param event: the Event
+		:type event: :class:`due.event.Event`
+		:return: the sequence number of the log record
+		:rtype: `int`
+		"""
+		with self._lock:
+			return self._append({'op': 'event', 'episode': episode.id, 'event': event.save()})
+
+	def log_trace(self, episode, event_seq, trace):
+		"""
+		Append the tracing breakdown of an Event that was already logged (see
+		:mod:`due.util.tracing`): the breakdown is only known once the Event
+		has been processed. When the Episode is recovered, the breakdown is
+		set as the `trace` of its Event. Breakdowns of Events that were
+		compacted before their breakdown was logged are lost.
+
+		:param episode: the Episode where the Event was acted
+		:type episode: :class:`due.episode.LiveEpisode`
+		:param event_seq: the sequence number returned by :meth:`log_event`
+		:type event_seq: `int`
+		:param trace: the breakdown
+		:type trace: `dict`
+		"""
+		with self._lock:
+			if episode.id in self._episodes:
+				self._append({'op': 'trace', 'episode': episode.id, 'event': event_seq, 'trace': trace})
+
+	def forget(self, episode):
+		"""
+		Stop tracking an Episode. Its content will be dropped from the log at
+		the next compaction.
+
+		:param episode: a tracked Episode
+		:type episode: :class:`due.episode.LiveEpisode`
+		"""
+		with self._lock:
+			if self._episodes.pop(episode.id, None) is not None:
+				self._append({'op': 'forget', 'episode': episode.id})
+			episode.event_log = None
+
+	def sync(self):
+		"""
+		Flush the log and `fsync` it to disk.
+		"""
+		with self._lock:
+			self._file.flush()
+			os.fsync(self._file.fileno())
+			self._unsynced = 0
+			self._last_sync = time.monotonic()
+
+	def compact(self):
+		"""
+		Write the current content of the tracked Episodes to the snapshot file
+		and truncate the log. The snapshot is replaced atomically, and it
+		records the sequence number of the last log record it includes, so a
+		crash in the middle of a compaction never duplicates or loses Events.
+		"""
+		with self._lock:
+			self.sync()
+			tmp_path = self.snapshot_path + '.tmp'
+			with open(tmp_path, 'w') as f:
+				f.write(json.dumps({'seq': self._seq}) + '\n')
+				for episode in self._episodes.values():
+					f.write(json.dumps(episode.save(), default=json_default) + '\n')
+				f.flush()
+				os.fsync(f.fileno())
+			os.replace(tmp_path, self.snapshot_path)
+
+			self._file.close()
+			self._file = open(self.path, 'w')
+			self._since_compaction = 0
+			self._logger.info("Compacted event log %s (%s episodes)", self.path, len(self._episodes))
+
+	def recover(self, agents):
+		"""
+		Rebuild the LiveEpisodes that were tracked by the log before the
+		process stopped, replaying the logged Events over the last snapshot.
+		Recovered Episodes are tracked again by this log, which is then
+		compacted.
+
+		:param agents: the Agents taking part in the recovered Episodes, by ID
+		:type agents: `dict` of :class:`due.agent.Agent`
+		:return: the recovered LiveEpisodes
+		:rtype: `list` of :class:`due.episode.LiveEpisode`
+		"""
+		from due.episode import Episode, LiveEpisode
+
+		with self._lock:
+			saved_episodes, self._seq = self._replay()
+			result = []
+			for saved in saved_episodes.values():
+				episode = Episode.load(saved)
+				live_episode = LiveEpisode(agents[episode.starter_id], agents[episode.invited_id])
+				live_episode.id = episode.id
+				live_episode.timestamp = episode.timestamp
+				live_episode.events.extend(episode.events)
+				live_episode.event_log = self
+				self._episodes[live_episode.id] = live_episode
+				result.append(live_episode)
+
+			self.compact()
+			return result
+
+	def close(self):
+		"""
+		Stop the background sync, then sync and close the log file.
+		"""
+		self._closed.set()
+		if self._sync_thread is not threading.current_thread():
+			self._sync_thread.join()
+		with self._lock:
+			if self._file.closed:
+				return
+			self.sync()
+			self._file.close()
+
+	def _append(self, record):
+		self._seq += 1
+		seq = record['seq'] = self._seq
+		self._file.write(json.dumps(record, default=json_default) + '\n')
+		self._file.flush()
+		self._unsynced += 1
+		self._since_compaction += 1
+
+		if self.compact_every and self._since_compaction >= self.compact_every:
+			self.compact()
+		elif self._unsynced >= self.sync_every or time.monotonic() - self._last_sync >= self.sync_interval:
+			self.sync()
+		return seq
+
+	def _run_sync(self):
+		"""Sync the records that were appended to an idle log."""
+		while not self._closed.wait(self.sync_interval):
+			with self._lock:
+				if self._file.closed or not self._unsynced:
+					continue
+				if time.monotonic() - self._last_sync < self.sync_interval:
+					continue
+				try:
+					self.sync()
+				except OSError:
+					self._logger.exception("Could not sync event log %s", self.path)
+
+	def _last_seq(self):
+		"""
+		Return the sequence number of the last record in the log (or in the
+		snapshot, if the log is empty), so that new records are appended after
+		the existing ones.
+		"""
+		with open(self.path, 'r') as f:
+			lines = f.readlines()
+		if lines and not lines[-1].endswith('\n'):
+			# Terminate a record that was truncated by a crash
+			self._file.write('\n')
+			self._file.flush()
+
+		for line in reversed(lines):
+			try:
+				return json.loads(line)['seq']
+			except ValueError:
+				continue
+
+		if os.path.exists(self.snapshot_path):
+			with open(self.snapshot_path, 'r') as f:
+				return json.loads(f.readline())['seq']
+		return 0
+
+	def _replay(self):
+		"""
+		Return the saved Episodes that result from applying the log over the
+		snapshot, and the last sequence number that was found.
+		"""
+		saved_episodes = {}
+		events_by_seq = {}
+		seq = 0
+		if os.path.exists(self.snapshot_path):
+			with open(self.snapshot_path, 'r') as f:
+				seq = json.loads(f.readline())['seq']
+				for line in f:
+					saved = json.loads(line)
+					saved_episodes[saved['id']] = saved
+
+		self._file.flush()
+		with open(self.path, 'r') as f:
+			lines = f.readlines()
+
+		for i, line in enumerate(lines):
+			try:
+				record = json.loads(line)
+			except ValueError:
+				self._logger.warning("Ignoring truncated record %s in event log %s", i, self.path)
+				continue
+
+			if record['seq'] <= seq:
+				continue
+			seq = record['seq']
+			if record['op'] == 'start':
+				saved_episodes[record['episode']['id']] = record['episode']
+			elif record['op'] == 'event':
+				saved_episodes[record['episode']]['events'].append(record['event'])
+				events_by_seq[seq] = record['event']
+			elif record['op'] == 'trace':
+				if record['event'] in events_by_seq:
+					events_by_seq[record['event']]['trace'] = record['trace']
+			elif record['op'] == 'forget':
+				saved_episodes.pop(record['episode'], None)
+
+		return saved_episodes, seq
+
+#
+# Helpers
+#
+
+def _saved_header(episode):
+	"""Save the Episode metadata (the Events are logged one by one)."""
+	return {
+		'id': episode.id,
+		'timestamp': episode.timestamp,
+		'starter_agent': str(episode.starter_id),
+		'invited_agents': [str(i) for i in episode.invited_ids],
+		'events': [],
+		'format': 'standard'
+	}
@@ -0,0 +1,273 @@
+"""
+Run the :class:`due.action.Action` objects that Agents issue in Episodes. By
+default, an Agent runs its Actions synchronously, in the thread that is acting
+the Episode's Events: a slow Action blocks the conversation until it
+completes. Agents with an :class:`ActionExecutor` submit their Actions to a
+pool of workers instead, and go on with the conversation:
+
+.. code-block:: python
+
+	from due.execution import ActionExecutor
+
+	agent.action_executor = ActionExecutor(max_workers=4, timeout=30)
+
+Actions run either in **threads**, or in **subprocesses**. Subprocesses
+isolate the Agent from crashing Actions, and Actions that exceed their
+timeout are killed; on the other hand, Actions are run on a copy of their
+object, so changes to its state are not seen by the Agent (the return value
+of :meth:`due.action.Action.run` is sent back, though). Threads can't be
+killed: an Action that times out is reported as such, but keeps running, and
+keeps occupying one of the `max_workers` slots until it completes.
+
+The outcome of each Action (see :class:`ActionOutcome`) is recorded in the
+`outcome` attribute of its :class:`due.event.Event`, once the Action is done,
+and logged by the executor (failures and timeouts at warning level). Note that
+outcomes are not persisted: in particular, an Action that runs on an executor
+completes after its Event was added to the Episode, and written to its
+:class:`due.eventlog.EventLog`, so the log never sees its outcome. Agents
+that need a durable record of the outcome should act a further Event once the
+Future returned by :meth:`due.agent.Agent.run_action` is done.
+
+Agents without an executor run their Actions inline, and exceptions raised by
+:meth:`due.action.Action.run` propagate to the caller of
+:meth:`due.agent.Agent.do`, as they would for any other code.
+
+API
+===
+"""
+import time
+import logging
+import threading
+import multiprocessing
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+DEFAULT_MAX_WORKERS = 4
+
+MODE_THREAD = 'thread'
+MODE_PROCESS = 'process'
+
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+STATUS_TIMEOUT = 'timeout'
+
+ActionOutcome = namedtuple('ActionOutcome', ['status', 'result', 'error', 'started', 'duration'])
+ActionOutcome.__doc__ = """
+The outcome of an Action that was run.
+
+:param status: 'done', 'failed' (the Action raised an exception) or 'timeout'
+:type status: `str`
+:param result: the value returned by :meth:`due.action.Action.run`
+:param error: a description of the error, if the Action failed
+:type error: `str`
+:param started: when the Action started
+:type started: `datetime`
+:param duration: how long the Action ran, in seconds
+:type duration: `float`
+"""
+
+class ActionExecutor(object):
+	"""
+	Run Actions on a pool of workers, with a timeout, and a cap on the number
+	of Actions that run at the same time. The same executor can be shared by
+	many Agents and Episodes: the cap is global to all of them.
+
+	:param max_workers: maximum number of Actions that run at the same time
+	:type max_workers: `int`
+	:param timeout: default timeout of each Action, in seconds. If `None`, Actions can run forever
+	:type timeout: `float`
+	:param mode: 'thread' or 'process'
+	:type mode: `str`
+	"""
+
+	def __init__(self, max_workers=DEFAULT_MAX_WORKERS, timeout=None, mode=MODE_THREAD):
+		if mode not in (MODE_THREAD, MODE_PROCESS):
+			raise ValueError("Unknown execution mode: '%s'" % mode)
+		if max_workers < 1:
+			raise ValueError("Maximum number of workers must be positive")
+		self._logger = logging.getLogger(__name__ + ".ActionExecutor")
+		self.max_workers = max_workers
+		self.timeout = timeout
+		self.mode = mode
+		self._supervisors = ThreadPoolExecutor(max_workers, thread_name_prefix='due-action')
+		self._slots = threading.BoundedSemaphore(max_workers)
+		self._lock = threading.Lock()
+		self._counts = {'submitted': 0, 'running': 0, STATUS_DONE: 0, STATUS_FAILED: 0, STATUS_TIMEOUT: 0}
+
+	def submit(self, event, timeout=None):
+		"""
+		Schedule the Action of the given Event. Its outcome will be stored in
+		the Event's `outcome` attribute.
+
+		:param event: an Action Event
+		:type event: :class:`due.event.Event`
+		:param timeout: the timeout of this Action, if different from the default one
+		:type timeout: `float`
+		:return: the Future of the Action's outcome
+		:rtype: :class:`concurrent.futures.Future`
+		"""
+		with self._lock:
+			self._counts['submitted'] += 1
+		return self._supervisors.submit(self._run_event, event, timeout)
+
+	def run(self, action, timeout=None):
+		"""
+		Run an Action in the pool, and wait for its outcome.
+
+		:param action: an Action
+		:type action: :class:`due.action.Action`
+		:param timeout: the timeout of this Action, if different from the default one
+		:type timeout: `float`
+		:return: the Action's outcome
+		:rtype: :class:`ActionOutcome`
+		"""
+		with self._lock:
+			self._counts['submitted'] += 1
+		return self._supervisors.submit(self._run, action, timeout).result()
+
+	def stats(self):
+		"""
+		Return the Action counts:
+
+		* `submitted`: number of Actions that were submitted
+		* `running`: number of Actions that are running (including timed out threads)
+		* `done`, `failed`, `timeout`: number of completed Actions, by status
+
+		:return: Action counts
+		:rtype: `dict`
+		"""
+		with self._lock:
+			return dict(self._counts)
+
+	def shutdown(self, wait=True):
+		"""
+		Stop accepting Actions.
+
+		:param wait: if `True`, wait until the submitted Actions are completed (or timed out)
+		:type wait: `bool`
+		"""
+		self._supervisors.shutdown(wait=wait)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.shutdown()
+
+	def _run_event(self, event, timeout):
+		outcome = self._run(event.payload, timeout)
+		event.outcome = outcome
+		return outcome
+
+	def _run(self, action, timeout):
+		timeout = timeout if timeout is not None else self.timeout
+		self._slots.acquire()
+		with self._lock:
+			self._counts['running'] += 1
+		if self.mode == MODE_THREAD:
+			outcome = self._run_thread(action, timeout)
+		else:
+			outcome = self._run_process(action, timeout)
+
+		with self._lock:
+			self._counts[outcome.status] += 1
+		if outcome.status == STATUS_DONE:
+			self._logger.debug("Action %s completed in %.3fs", action, outcome.duration)
+		else:
+			self._logger.warning("Action %s %s after %.3fs: %s", action, outcome.status, outcome.duration, outcome.error)
+		return outcome
+
+	def _run_thread(self, action, timeout):
+		"""
+		Run the Action in a thread of its own, so that it can be abandoned on
+		timeout. Its slot is released when the thread completes.
+		"""
+		outcomes = []
+		started = datetime.now()
+		def target():
+			try:
+				outcomes.append(run_action(action, started))
+			finally:
+				self._release()
+
+		thread = threading.Thread(target=target, name='due-action-run', daemon=True)
+		try:
+			thread.start()
+		except BaseException:
+			self._release()
+			raise
+		thread.join(timeout)
+		if thread.is_alive():
+			return _timeout_outcome(started, timeout)
+		return outcomes[0]
+
+	def _run_process(self, action, timeout):
+		started = datetime.now()
+		try:
+			parent_conn, child_conn = multiprocessing.Pipe(duplex=False)
+			process = multiprocessing.Process(target=_run_action_process, args=(action, started, child_conn), daemon=True)
+			process.start()
+			child_conn.close()
+			with parent_conn:
+				if parent_conn.poll(timeout):
+					try:
+						outcome = parent_conn.recv()
+					except EOFError:
+						process.join()
+						outcome = ActionOutcome(STATUS_FAILED, None, 'Action process exited with code %s' % process.exitcode, started, _elapsed(started))
+				else:
+					process.kill()
+					outcome = _timeout_outcome(started, timeout)
+			process.join()
+			return outcome
+		finally:
+			self._release()
+
+	def _release(self):
+		with self._lock:
+			self._counts['running'] -= 1
+		self._slots.release()
+
+def run_action(action, started=None, reraise=False):
+	"""
+	Run an Action in the current thread, and return its outcome. Exceptions
+	raised by the Action are caught, and reported in the outcome, unless
+	`reraise` is set.
+
+	:param action: an Action
+	:type action: :class:`due.action.Action`
+	:param started: the start time to report (defaults to now)
+	:type started: `datetime`
+	:param reraise: if `True`, exceptions raised by the Action propagate to the caller
+	:type reraise: `bool`
+	:return: the Action's outcome
+	:rtype: :class:`ActionOutcome`
+	"""
+	started = started if started is not None else datetime.now()
+	start = time.perf_counter()
+	try:
+		result = action.run()
+	except Exception as e:
+		if reraise:
+			raise
+		return ActionOutcome(STATUS_FAILED, None, repr(e), started, time.perf_counter() - start)
+	return ActionOutcome(STATUS_DONE, result, None, started, time.perf_counter() - start)
+
+#
+# Helpers
+#
+
+def _run_action_process(action, started, conn):
+	outcome = run_action(action, started)
+	try:
+		conn.send(outcome)
+	except Exception as e:
+		conn.send(outcome._replace(status=STATUS_FAILED, result=None, error='Unpicklable result: %r' % e))
+	conn.close()
+
+def _timeout_outcome(started, timeout):
+	return ActionOutcome(STATUS_TIMEOUT, None, 'Action timed out after %ss' % timeout, started, _elapsed(started))
+
+def _elapsed(started):
+	return (datetime.now() - started).total_seconds()
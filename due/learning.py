@@ -0,0 +1,193 @@
+"""
+Learn Episodes in the background, while an Agent keeps serving. Agents that
+learn from their live conversations (eg. when an Episode is left) would
+otherwise block the serving thread until their model is updated.
+
+A :class:`BackgroundLearner` receives finished Episodes through a queue, and
+passes them to a learning function in a worker thread. Episodes that arrive
+in a burst are **coalesced** into a single call, so that the model is
+updated once rather than once per Episode:
+
+.. code-block:: python
+
+	from due.learning import BackgroundLearner
+
+	learner = BackgroundLearner(agent.learn_episodes)
+	learner.submit(episode)
+	...
+	learner.stop()  # Learn the queued Episodes, and stop the worker
+
+The learning function is expected to publish its changes atomically, so that
+the Agent keeps answering from its previous state until learning is done (see
+:class:`due.models.tfidf.TfIdfAgent`).
+
+API
+===
+"""
+import time
+import queue
+import logging
+import threading
+
+from due.util import metrics
+
+DEFAULT_COALESCE_DELAY = 0.1
+
+_STOP = object()
+
+_QUEUE_DEPTH = metrics.REGISTRY.gauge('due_learning_queue_depth', "Episodes waiting to be learned in the background")
+_LEARNED = metrics.REGISTRY.counter('due_learned_episodes_total', "Episodes learned in the background")
+_LEARNING_ERRORS = metrics.REGISTRY.counter('due_learning_errors_total', "Episodes whose background learning failed")
+_BATCH_DURATION = metrics.REGISTRY.histogram('due_learning_batch_seconds', "Duration of background learning batches", buckets=(.01, .05, .1, .5, 1., 5., 10., 30., 60., 300.))
+
+class BackgroundLearner(object):
+	"""
+	Run a learning function on the Episodes submitted to a queue, in a worker
+	thread. Once an Episode is received, the worker waits `coalesce_delay`
+	seconds for more Episodes, and learns all of them at once.
+
+	The worker is a daemon thread: Episodes that are still queued when the
+	process exits are lost, unless :meth:`stop` is called.
+
+	:param learn_f: a function learning a list of Episodes (eg. :meth:`due.agent.Agent.learn_episodes`)
+	:type learn_f: `callable`
+	:param coalesce_delay: how long to wait for more Episodes before learning, in seconds
+	:type coalesce_delay: `float`
+	:param max_batch_size: maximum number of Episodes learned at once. If `None`, there is no limit
+	:type max_batch_size: `int`
+	:param name: the name of the worker thread
+	:type name: `str`
+	"""
+
+	def __init__(self, learn_f, coalesce_delay=DEFAULT_COALESCE_DELAY, max_batch_size=None, name='due-learner'):
+		self._logger = logging.getLogger(__name__ + ".BackgroundLearner")
+		self.learn_f = learn_f
+		self.coalesce_delay = coalesce_delay
+		self.max_batch_size = max_batch_size
+		self._queue = queue.Queue()
+		self._done = threading.Condition()
+		self._stopped = False
+
+		self.submitted = 0
+		self.learned = 0
+		self.batches = 0
+		self.errors = 0
+		self.last_duration = None
+
+		self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+		self._thread.start()
+
+	@property
+	def pending(self):
+		"""
+		The number of submitted Episodes that were not learned yet
+		"""
+		with self._done:
+			return self.submitted - self.learned - self.errors
+
+	def submit(self, episode):
+		"""
+		Queue an Episode for learning.
+
+		:param episode: an Episode
+		:type episode: :class:`due.episode.Episode`
+		"""
+		with self._done:
+			if self._stopped:
+				raise RuntimeError("Cannot submit Episodes to a stopped learner")
+			self.submitted += 1
+		_QUEUE_DEPTH.inc()
+		self._queue.put(episode)
+
+	def flush(self, timeout=None):
+		"""
+		Wait until all the submitted Episodes are learned.
+
+		:param timeout: maximum time to wait, in seconds
+		:type timeout: `float`
+		:return: `True` if there are no pending Episodes
+		:rtype: `bool`
+		"""
+		with self._done:
+			return self._done.wait_for(lambda: self.submitted == self.learned + self.errors, timeout)
+
+	def stop(self, wait=True):
+		"""
+		Stop the worker, after it has learned the queued Episodes.
+
+		:param wait: if `True`, wait until the worker has stopped
+		:type wait: `bool`
+		"""
+		with self._done:
+			if self._stopped:
+				return
+			self._stopped = True
+		self._queue.put(_STOP)
+		if wait:
+			self._thread.join()
+
+	def stats(self):
+		"""
+		Return learning statistics:
+
+		* `submitted`, `learned`: number of Episodes that were submitted, and learned
+		* `pending`: number of Episodes waiting to be learned
+		* `errors`: number of Episodes whose learning failed
+		* `batches`: number of calls to the learning function
+		* `last_duration`: duration of the last call, in seconds
+
+		:return: learning statistics
+		:rtype: `dict`
+		"""
+		with self._done:
+			return {
+				'submitted': self.submitted,
+				'learned': self.learned,
+				'pending': self.submitted - self.learned - self.errors,
+				'errors': self.errors,
+				'batches': self.batches,
+				'last_duration': self.last_duration,
+			}
+
+	def _run(self):
+		stopping = False
+		while not stopping:
+			episode = self._queue.get()
+			if episode is _STOP:
+				break
+			batch = [episode]
+			deadline = time.monotonic() + self.coalesce_delay
+			while self.max_batch_size is None or len(batch) < self.max_batch_size:
+				try:
+					episode = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+				except queue.Empty:
+					break
+				if episode is _STOP:
+					stopping = True
+					break
+				batch.append(episode)
+			self._learn(batch)
+
+	def _learn(self, batch):
+		start = time.perf_counter()
+		try:
+			self.learn_f(batch)
+		except Exception:
+			self._logger.exception("Learning failed on a batch of %s Episodes", len(batch))
+			failed = True
+		else:
+			failed = False
+		duration = time.perf_counter() - start
+		self._logger.debug("Learned %s Episodes in %.3fs", len(batch), duration)
+		_QUEUE_DEPTH.dec(len(batch))
+		_BATCH_DURATION.observe(duration)
+		(_LEARNING_ERRORS if failed else _LEARNED).inc(len(batch))
+
+		with self._done:
+			if failed:
+				self.errors += len(batch)
+			else:
+				self.learned += len(batch)
+			self.batches += 1
+			self.last_duration = duration
+			self._done.notify_all()
@@ -0,0 +1,267 @@
+"""
+A load-testing harness for served Agents. It simulates many human users, who
+start conversations with the target Agent at random times, and replay the
+utterances of Episodes taken from a corpus.
+
+Users arrive as a **Poisson process** with the given `arrival_rate` (users per
+second). Each user picks a random Episode from the corpus, and sends the
+utterances of the Episode's starter one at a time: a new utterance is sent
+once the previous one was answered, after an exponentially distributed
+`think_time`. The latency of each utterance (from the moment it's sent to the
+moment the Agent's answer is received) is recorded.
+
+Targets can be Agents served in the same process (:class:`EpisodeTarget`), or
+a local HTTP server (:class:`HttpTarget`), such as :mod:`due.serve.http` or
+:mod:`due.serve.prefork`:
+
+.. code-block:: python
+
+	from due import loadtest
+	from due.corpora import cornell
+
+	target = loadtest.EpisodeTarget(agent, max_workers=8)
+	report = loadtest.run(target, cornell.corpus(), n_users=1000, arrival_rate=50)
+	print(report)
+
+	report = loadtest.run(loadtest.HttpTarget(port=8080), cornell.corpus(), n_users=1000, arrival_rate=50)
+
+API
+===
+"""
+import json
+import time
+import random
+import asyncio
+import logging
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from due.event import Event
+from due.corpora.corpus import Corpus, ListCorpus
+from due.models.dummy import DummyAgent
+from due.serve.http import DEFAULT_HOST, DEFAULT_PORT
+from due.serve.protocol import read_response
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_WORKERS = 8
+
+LoadTestReport = namedtuple('LoadTestReport', ['users', 'requests', 'errors', 'duration', 'throughput', 'latency_p50', 'latency_p95', 'latency_p99'])
+LoadTestReport.__doc__ = """
+The result of a load test.
+
+:param users: number of simulated users
+:type users: `int`
+:param requests: number of utterances that were sent
+:type requests: `int`
+:param errors: number of utterances that failed
+:type errors: `int`
+:param duration: duration of the test, in seconds
+:type duration: `float`
+:param throughput: utterances answered per second
+:type throughput: `float`
+:param latency_p50: median latency of the answered utterances, in seconds
+:type latency_p50: `float`
+:param latency_p95: 95th percentile of the latency
+:type latency_p95: `float`
+:param latency_p99: 99th percentile of the latency
+:type latency_p99: `float`
+"""
+
+class EpisodeTarget(object):
+	"""
+	Run simulated conversations with an Agent in the current process. Each
+	user is a :class:`due.models.dummy.DummyAgent` that starts a
+	:class:`due.episode.LiveEpisode` with the Agent. As Agents are synchronous,
+	utterances are acted on a pool of `max_workers` threads.
+
+	:param agent: the target Agent
+	:type agent: :class:`due.agent.Agent`
+	:param max_workers: number of utterances that are processed in parallel
+	:type max_workers: `int`
+	:param leave: whether users leave their Episode at the end of the conversation
+	:type leave: `bool`
+	"""
+
+	def __init__(self, agent, max_workers=DEFAULT_MAX_WORKERS, leave=True):
+		self.agent = agent
+		self.leave = leave
+		self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix='due-loadtest')
+
+	async def open(self, user_id):
+		"""Start a session for a new user, and return it."""
+		human = DummyAgent(user_id)
+		return human, await self._run(human.start_episode, self.agent)
+
+	async def utterance(self, session, text):
+		"""Send an utterance in the given session, and return the answers."""
+		human, episode = session
+		def say():
+			n_events = len(episode.events)
+			human.say(text, episode)
+			return [e.payload for e in episode.events[n_events+1:] if e.type == Event.Type.Utterance]
+		return await self._run(say)
+
+	async def close(self, session):
+		"""Close the given session."""
+		human, episode = session
+		if self.leave:
+			await self._run(human.leave, episode)
+
+	def shutdown(self):
+		"""Release the worker threads."""
+		self._executor.shutdown(wait=True)
+
+	async def _run(self, f, *args):
+		return await asyncio.get_running_loop().run_in_executor(self._executor, f, *args)
+
+class HttpTarget(object):
+	"""
+	Run simulated conversations with an Agent served on HTTP (see
+	:mod:`due.serve.http`). Each user has its own keep-alive connection.
+
+	:param host: the server address
+	:type host: `str`
+	:param port: the server port
+	:type port: `int`
+	"""
+
+	def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT):
+		self.host = host
+		self.port = port
+
+	async def open(self, user_id):
+		"""Start a session for a new user, and return it."""
+		reader, writer = await asyncio.open_connection(self.host, self.port)
+		return user_id, reader, writer
+
+	async def utterance(self, session, text):
+		"""Send an utterance in the given session, and return the answers."""
+		user_id, _, _ = session
+		status, body = await self._request(session, '/sessions/%s/utterances' % user_id, {'text': text})
+		if status != 200:
+			raise RuntimeError("HTTP %s: %s" % (status, body.get('error')))
+		return body['answers']
+
+	async def close(self, session):
+		"""Close the given session."""
+		user_id, _, writer = session
+		try:
+			await self._request(session, '/sessions/%s/leave' % user_id, {})
+		finally:
+			writer.close()
+
+	def shutdown(self):
+		pass
+
+	async def _request(self, session, path, body):
+		_, reader, writer = session
+		data = json.dumps(body).encode('utf-8')
+		writer.write((
+			f"POST {path} HTTP/1.1\r\n"
+			f"Host: {self.host}\r\n"
+			f"Content-Type: application/json\r\n"
+			f"Content-Length: {len(data)}\r\n\r\n"
+		).encode('latin-1') + data)
+		await writer.drain()
+		status, _, response = await read_response(reader)
+		return status, response
+
+async def load_test(target, corpus, n_users, arrival_rate, think_time=0., max_utterances=None, seed=None):
+	"""
+	Run a load test on the given target, and return its report. This is the
+	coroutine version of :func:`run`: see there for an explanation of the
+	parameters.
+
+	:return: the load test report
+	:rtype: :class:`LoadTestReport`
+	"""
+	if not isinstance(corpus, Corpus):
+		corpus = ListCorpus(corpus)
+	if len(corpus) == 0:
+		raise ValueError("Cannot replay an empty corpus")
+
+	rng = random.Random(seed)
+	latencies = []
+	counts = {'requests': 0, 'errors': 0}
+
+	async def user(user_id, episode):
+		utterances = [e.payload for e in episode.events if e.type == Event.Type.Utterance and e.agent == episode.starter_id]
+		utterances = utterances[:max_utterances] if max_utterances else utterances
+		try:
+			session = await target.open(user_id)
+		except Exception:
+			logger.exception("User %s could not start a session", user_id)
+			counts['errors'] += 1
+			return
+
+		try:
+			for text in utterances:
+				if think_time:
+					await asyncio.sleep(rng.expovariate(1 / think_time))
+				counts['requests'] += 1
+				start = time.perf_counter()
+				try:
+					await target.utterance(session, text)
+				except Exception as e:
+					logger.debug("Utterance by %s failed: %s", user_id, e)
+					counts['errors'] += 1
+					continue
+				latencies.append(time.perf_counter() - start)
+		finally:
+			try:
+				await target.close(session)
+			except Exception as e:
+				logger.debug("User %s could not leave: %s", user_id, e)
+
+	start = time.perf_counter()
+	users = []
+	for i in range(n_users):
+		episode = corpus[rng.randrange(len(corpus))]
+		users.append(asyncio.ensure_future(user('loadtest-user-%s' % i, episode)))
+		if i < n_users - 1:
+			await asyncio.sleep(rng.expovariate(arrival_rate))
+	await asyncio.gather(*users)
+	duration = time.perf_counter() - start
+
+	p50, p95, p99 = np.percentile(latencies, [50, 95, 99]).tolist() if latencies else (0., 0., 0.)
+	result = LoadTestReport(
+		users=n_users,
+		requests=counts['requests'],
+		errors=counts['errors'],
+		duration=duration,
+		throughput=len(latencies) / duration if duration > 0 else 0.,
+		latency_p50=p50,
+		latency_p95=p95,
+		latency_p99=p99,
+	)
+	logger.info("Load test completed: %s", result)
+	return result
+
+def run(target, corpus, n_users, arrival_rate, think_time=0., max_utterances=None, seed=None):
+	"""
+	Run a load test on the given target.
+
+	:param target: the load test target
+	:type target: :class:`EpisodeTarget` or :class:`HttpTarget`
+	:param corpus: Episodes to replay
+	:type corpus: :class:`due.corpora.corpus.Corpus` or iterable of :class:`due.episode.Episode`
+	:param n_users: total number of simulated users
+	:type n_users: `int`
+	:param arrival_rate: average number of new users per second
+	:type arrival_rate: `float`
+	:param think_time: average time (in seconds) a user waits before sending the next utterance
+	:type think_time: `float`
+	:param max_utterances: if given, each user sends at most this many utterances
+	:type max_utterances: `int`
+	:param seed: seed of the random generator, to replay the same test
+	:type seed: `int`
+	:return: the load test report
+	:rtype: :class:`LoadTestReport`
+	"""
+	try:
+		return asyncio.run(load_test(target, corpus, n_users, arrival_rate, think_time, max_utterances, seed))
+	finally:
+		target.shutdown()
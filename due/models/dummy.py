@@ -3,15 +3,26 @@ import logging
 from due.agent import Agent
 from due.episode import LiveEpisode
 from due.event import Event
+from due.session import SessionStore
 
 class DummyAgent(Agent):
 	"""
 	A Dummy Agent is an Agent that simply logs new Episodes and Events,
 	expecting the interaction to be commanded externally.
+
+	The Episodes the Agent takes part in are tracked until they are left, or,
+	if `idle_timeout` is set, until they have been idle for that many seconds.
+
+	:param agent_id: an unique ID for the Agent
+	:type agent_id: `str`
+	:param idle_timeout: forget Episodes that were idle for this many seconds. If `None`, Episodes are never forgotten
+	:type idle_timeout: `float`
+	:param max_sessions: maximum number of active Episodes to track
+	:type max_sessions: `int`
 	"""
-	def __init__(self, agent_id=None):
+	def __init__(self, agent_id=None, idle_timeout=None, max_sessions=None):
 		super().__init__(agent_id)
-		self._active_episodes = {}
+		self._active_episodes = SessionStore(idle_timeout, max_sessions)
 		self._logger = logging.getLogger(__name__ + '.DummyAgent')
 
 	def save(self):
@@ -35,12 +46,15 @@ class DummyAgent(Agent):
 	def utterance_callback(self, episode):
 		"""See :meth:`due.agent.Agent.utterance_callback`"""
 		self._logger.debug("Utterance received.")
+		self._active_episodes.touch(episode.id)
 
 	def action_callback(self, episode):
 		"""See :meth:`due.agent.Agent.action_callback`"""
 		self._logger.debug("Action received.")
+		self._active_episodes.touch(episode.id)
 
 	def leave_callback(self, episode):
 		"""See :meth:`due.agent.Agent.leave_callback`"""
 		agent = episode.last_event(Event.Type.Leave).agent
 		self._logger.debug("Agent %s left the episode.", agent)
+		self._active_episodes.pop(episode.id)
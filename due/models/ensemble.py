@@ -0,0 +1,228 @@
+"""
+An ensemble of Agents that answer the same utterances in parallel, so that
+expensive models can be used when they are fast enough, without exceeding a
+fixed response time when they are not.
+
+Children are listed in order of **preference** (eg. a slow, accurate model
+first, then a tf-idf model, then a fast cached lookup). Each utterance is sent
+to all of them at once, and the ensemble answers with the most preferred
+answer it receives within the `deadline`. When the deadline passes without
+any answer, the ensemble falls back to the first child that answers.
+
+.. code-block:: python
+
+	from due.models.ensemble import EnsembleAgent
+
+	agent = EnsembleAgent([slow_agent, tfidf_agent, cache_agent], deadline=0.2)
+
+API
+===
+"""
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import numpy as np
+
+import due
+from due.agent import Agent
+from due.event import Event
+
+DEFAULT_DEADLINE = 0.5
+LATENCY_WINDOW = 1000
+
+class EnsembleAgent(Agent):
+	"""
+	An Agent that forwards Utterances to a list of child Agents in parallel,
+	and answers with the best answer that is available within a deadline.
+	All the other Events (new Episodes, Actions, Leave Events) and the Episodes
+	to learn are forwarded to all the children.
+
+	Children that miss the deadline keep running in the background: their
+	latency is still recorded, but their answer is discarded.
+
+	:param children: child Agents, from the most to the least preferred
+	:type children: `list` of :class:`due.agent.Agent`
+	:param deadline: how long to wait for answers, in seconds
+	:type deadline: `float`
+	:param max_workers: number of child callbacks that can run in parallel (defaults to 4 per child)
+	:type max_workers: `int`
+	:param agent_id: an unique ID for the Agent
+	:type agent_id: `str`
+	:param _data: This is used by :meth:`due.agent.Agent.load`
+	:type _data: `dict`
+	"""
+
+	def __init__(self, children=None, deadline=DEFAULT_DEADLINE, max_workers=None, agent_id=None, _data=None):
+		if _data:
+			children = [Agent.load(c) for c in _data['children']]
+			deadline = _data['deadline']
+			agent_id = _data['id']
+		if not children:
+			raise ValueError("An ensemble needs at least one child Agent")
+		super().__init__(agent_id)
+		self._logger = logging.getLogger(__name__ + ".EnsembleAgent")
+		self.children = list(children)
+		self.deadline = deadline
+		self._executor = ThreadPoolExecutor(max_workers or 4*len(self.children), thread_name_prefix='due-ensemble')
+		self._lock = threading.Lock()
+		self._requests = 0
+		self._fallbacks = 0
+		self._latencies = [deque(maxlen=LATENCY_WINDOW) for _ in self.children]
+		self._answers = [0] * len(self.children)
+		self._errors = [0] * len(self.children)
+		self._wins = [0] * len(self.children)
+
+	def utterance_callback(self, episode):
+		"""
+		Send the Utterance to all the children, and return the answer of the
+		most preferred child that answers within the deadline.
+		"""
+		start = time.perf_counter()
+		futures = [self._executor.submit(self._child_answer, i, episode, start) for i in range(len(self.children))]
+		winner, answer = self._best_answer(futures, start + self.deadline)
+		if winner is None and not all(f.done() for f in futures):
+			winner, answer = self._first_answer(futures)
+
+		with self._lock:
+			self._requests += 1
+			if winner is not None:
+				self._wins[winner] += 1
+		if winner is None:
+			return []
+		return [Event(e.type, e.timestamp, self.id, e.payload) for e in answer]
+
+	def stats(self):
+		"""
+		Return per-child statistics, in the order of the children:
+
+		* `agent`: the ID of the child
+		* `answers`, `errors`: number of requests the child answered, or failed on
+		* `wins`, `win_rate`: number (and fraction) of requests in which the child's answer was chosen
+		* `latency_p50`, `latency_p95`, `latency_p99`: latency percentiles of the child (seconds), over the most recent requests
+
+		Along with the children's stats, `requests` counts the utterances
+		received by the ensemble, and `fallbacks` the ones in which no child
+		answered within the deadline.
+
+		:return: ensemble statistics
+		:rtype: `dict`
+		"""
+		with self._lock:
+			children = []
+			for i, child in enumerate(self.children):
+				latencies = np.array(self._latencies[i]) if self._latencies[i] else np.zeros(1)
+				p50, p95, p99 = np.percentile(latencies, [50, 95, 99]).tolist()
+				children.append({
+					'agent': child.id,
+					'answers': self._answers[i],
+					'errors': self._errors[i],
+					'wins': self._wins[i],
+					'win_rate': self._wins[i] / self._requests if self._requests else 0.,
+					'latency_p50': p50,
+					'latency_p95': p95,
+					'latency_p99': p99,
+				})
+			return {'requests': self._requests, 'fallbacks': self._fallbacks, 'children': children}
+
+	def shutdown(self, wait=True):
+		"""
+		Release the worker threads.
+
+		:param wait: if `True`, wait until the running child callbacks are done
+		:type wait: `bool`
+		"""
+		self._executor.shutdown(wait=wait)
+
+	def close(self):
+		"""
+		Release the worker threads, and close the children.
+		"""
+		self.shutdown()
+		for child in self.children:
+			child.close()
+
+	def _child_answer(self, i, episode, start):
+		try:
+			result = self.children[i].utterance_callback(episode) or []
+		except Exception:
+			self._logger.exception("Child agent %s failed", self.children[i].id)
+			with self._lock:
+				self._errors[i] += 1
+			return None
+		with self._lock:
+			self._latencies[i].append(time.perf_counter() - start)
+			self._answers[i] += 1
+		return result
+
+	def _best_answer(self, futures, deadline):
+		"""
+		Wait until the most preferred answer is known, or until the deadline.
+		Return the index of the best child that answered, and its answer.
+		"""
+		while True:
+			for i, f in enumerate(futures):
+				if not f.done():
+					break
+				if f.result():
+					return i, f.result()
+			else:
+				return None, None
+
+			remaining = deadline - time.perf_counter()
+			if remaining <= 0:
+				break
+			wait([f for f in futures if not f.done()], timeout=remaining, return_when=FIRST_COMPLETED)
+
+		for i, f in enumerate(futures):
+			if f.done() and f.result():
+				return i, f.result()
+		return None, None
+
+	def _first_answer(self, futures):
+		"""After the deadline, return the first child that answers."""
+		with self._lock:
+			self._fallbacks += 1
+		pending = set(futures)
+		while pending:
+			done, pending = wait(pending, return_when=FIRST_COMPLETED)
+			for f in done:
+				if f.result():
+					i = futures.index(f)
+					return i, f.result()
+		return None, None
+
+	def new_episode_callback(self, new_episode):
+		"""See :meth:`due.agent.Agent.new_episode_callback`"""
+		for child in self.children:
+			child.new_episode_callback(new_episode)
+
+	def action_callback(self, episode):
+		"""See :meth:`due.agent.Agent.action_callback`"""
+		for child in self.children:
+			child.action_callback(episode)
+
+	def leave_callback(self, episode):
+		"""See :meth:`due.agent.Agent.leave_callback`"""
+		for child in self.children:
+			child.leave_callback(episode)
+
+	def learn_episodes(self, episodes):
+		"""See :meth:`due.agent.Agent.learn_episodes`"""
+		episodes = list(episodes)
+		for child in self.children:
+			child.learn_episodes(episodes)
+
+	def save(self):
+		"""See :meth:`due.agent.Agent.save`"""
+		return {
+			'version': due.__version__,
+			'class': 'due.models.ensemble.EnsembleAgent',
+			'data': {
+				'id': self.id,
+				'deadline': self.deadline,
+				'children': [c.save() for c in self.children],
+			}
+		}
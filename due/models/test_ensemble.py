@@ -0,0 +1,99 @@
+import time
+import threading
+import unittest
+from datetime import datetime
+
+from due.agent import Agent
+from due.event import Event
+from due.models.dummy import DummyAgent
+from due.models.ensemble import EnsembleAgent
+from due.models.tfidf import TfIdfAgent
+
+class SlowAgent(DummyAgent):
+
+	def __init__(self, agent_id, answer, delay=0., wait_for=None):
+		super().__init__(agent_id)
+		self.answer = answer
+		self.delay = delay
+		self.wait_for = wait_for
+		self.started = threading.Event()
+
+	def utterance_callback(self, episode):
+		self.started.set()
+		if self.wait_for is not None:
+			self.wait_for.wait(10)
+		time.sleep(self.delay)
+		if self.answer is None:
+			return []
+		return [Event(Event.Type.Utterance, datetime.now(), self.id, self.answer)]
+
+class TestEnsembleAgent(unittest.TestCase):
+
+	def _ask(self, ensemble):
+		alice = DummyAgent('alice')
+		episode = alice.start_episode(DummyAgent('bob'))
+		alice.say('Hi!', episode)
+		start = time.perf_counter()
+		result = ensemble.utterance_callback(episode)
+		return result, time.perf_counter() - start
+
+	def test_preferred_answer(self):
+		fast = SlowAgent('fast', 'fast')
+		best = SlowAgent('best', 'best', wait_for=fast.started)
+		ensemble = EnsembleAgent([best, fast], deadline=10.)
+		result, _ = self._ask(ensemble)
+		self.assertEqual([e.payload for e in result], ['best'])
+		self.assertEqual(result[0].agent, ensemble.id)
+		self.assertEqual(ensemble.stats()['fallbacks'], 0)
+		ensemble.shutdown()
+
+	def test_deadline(self):
+		release = threading.Event()
+		slow = SlowAgent('slow', 'slow', wait_for=release)
+		ensemble = EnsembleAgent([slow, SlowAgent('fast', 'fast', 0.01)], deadline=0.1)
+		result, elapsed = self._ask(ensemble)
+		self.assertEqual([e.payload for e in result], ['fast'])
+		self.assertGreaterEqual(elapsed, 0.1)
+		release.set()
+		ensemble.shutdown()
+		stats = ensemble.stats()
+		self.assertEqual(stats['requests'], 1)
+		self.assertEqual(stats['fallbacks'], 0)
+		self.assertEqual([c['wins'] for c in stats['children']], [0, 1])
+		self.assertEqual([c['answers'] for c in stats['children']], [1, 1])
+		self.assertGreaterEqual(stats['children'][0]['latency_p50'], ensemble.deadline)
+
+	def test_fallback(self):
+		release = threading.Event()
+		ensemble = EnsembleAgent([SlowAgent('slow', 'slow', wait_for=release), SlowAgent('slower', 'slower', 0.2), SlowAgent('empty', None)], deadline=0.05)
+		result, _ = self._ask(ensemble)
+		self.assertEqual([e.payload for e in result], ['slower'])
+		stats = ensemble.stats()
+		self.assertEqual(stats['fallbacks'], 1)
+		self.assertEqual([c['win_rate'] for c in stats['children']], [0., 1., 0.])
+		release.set()
+		ensemble.shutdown()
+
+	def test_no_answer(self):
+		ensemble = EnsembleAgent([SlowAgent('empty', None)])
+		result, _ = self._ask(ensemble)
+		self.assertEqual(result, [])
+		with self.assertRaises(ValueError):
+			EnsembleAgent([])
+
+	def test_save_load(self):
+		alice = DummyAgent('alice')
+		bob = DummyAgent('bob')
+		episode = alice.start_episode(bob)
+		alice.say('Hi!', episode)
+		bob.say('Hello', episode)
+		ensemble = EnsembleAgent([TfIdfAgent(), TfIdfAgent()], deadline=0.3)
+		ensemble.learn_episodes([episode])
+
+		loaded = Agent.load(ensemble.save())
+		self.assertIsInstance(loaded, EnsembleAgent)
+		self.assertEqual(loaded.id, ensemble.id)
+		self.assertEqual(loaded.deadline, 0.3)
+		self.assertEqual(len(loaded.children), 2)
+		result, _ = self._ask(loaded)
+		self.assertEqual([e.payload for e in result], ['Hello'])
@@ -1,12 +1,17 @@
 import unittest
+import threading
 from datetime import datetime
 import tempfile
 import os
+from unittest import mock
+
+import scipy.sparse
 
 from due.agent import Agent
 from due.episode import Episode
 from due.event import Event
 from due.persistence import serialize, deserialize
+from due.models import tfidf
 from due.models.tfidf import TfIdfAgent
 from due.models.dummy import DummyAgent
 
@@ -54,6 +59,174 @@ class TestTfIdfAgent(unittest.TestCase):
 		self.assertEqual(len(answer_events), 1)
 		self.assertEqual(answer_events[0].payload, 'Hello')
 		
+	def test_session_eviction(self):
+		cb = TfIdfAgent(parameters={'max_sessions': 1})
+		sample_episode, alice, bob = _sample_episode()
+		cb.learn_episodes([sample_episode])
+
+		e1 = alice.start_episode(cb)
+		alice.say("Hi!", e1)
+		e2 = alice.start_episode(cb)
+		self.assertEqual(cb._active_episodes.keys(), [e2.id])
+		self.assertTrue(cb._eviction_learner.flush(timeout=10))
+		self.assertIs(cb._past_episodes[-1], e1)
+
+		alice.leave(e2)
+		self.assertEqual(len(cb._active_episodes), 0)
+		cb.close()
+
+	def test_eviction_then_leave(self):
+		cb = TfIdfAgent(parameters={'max_sessions': 1})
+		sample_episode, alice, bob = _sample_episode()
+		cb.learn_episodes([sample_episode])
+
+		e1 = alice.start_episode(cb)
+		alice.say("Nice weather today", e1)
+		alice.start_episode(cb)
+		self.assertTrue(cb._eviction_learner.flush(timeout=10))
+		n_utterances = len(cb._normalized_past_utterances)
+
+		alice.leave(e1)
+		self.assertEqual([e.id for e in cb._past_episodes].count(e1.id), 1)
+		self.assertEqual(len(cb._normalized_past_utterances), n_utterances)
+		cb.close()
+
+	def test_eviction_then_resume_then_leave(self):
+		cb = TfIdfAgent(parameters={'max_sessions': 1})
+		sample_episode, alice, bob = _sample_episode()
+		cb.learn_episodes([sample_episode])
+
+		e1 = alice.start_episode(cb)
+		alice.say("Nice weather today", e1)
+		alice.start_episode(cb)
+		self.assertTrue(cb._eviction_learner.flush(timeout=10))
+		n_utterances = len(cb._normalized_past_utterances)
+
+		alice.say("Nice weather today", e1)
+		alice.leave(e1)
+		self.assertTrue(cb._eviction_learner.flush(timeout=10))
+		self.assertEqual([e.id for e in cb._past_episodes].count(e1.id), 1)
+		self.assertEqual(len(cb._normalized_past_utterances), n_utterances)
+		cb.close()
+
+	def test_learn_agent_started_episode(self):
+		cb = TfIdfAgent()
+		sample_episode, alice, bob = _sample_episode()
+		cb.learn_episodes([sample_episode])
+
+		episode = cb.start_episode(alice)
+		cb.say("Nice weather today", episode)
+		alice.say("Indeed", episode)
+		alice.leave(episode)
+		self.assertEqual([e.id for e in cb._past_episodes].count(episode.id), 1)
+		self.assertIn(["indeed"], list(cb._normalized_past_utterances))
+
+	def test_background_learning(self):
+		cb = TfIdfAgent(parameters={'background_learning': True})
+		sample_episode, alice, bob = _sample_episode()
+		cb.learn_episodes([sample_episode])
+		index = cb._vectorized_past_utterances
+
+		e1 = alice.start_episode(bob)
+		alice.say("Nice weather today", e1)
+		bob.say("Indeed", e1)
+		alice.leave(e1)
+		cb.leave_callback(e1)
+		self.assertIs(cb._vectorized_past_utterances, index)
+
+		self.assertTrue(cb.learner.flush(timeout=10))
+		self.assertIs(cb._past_episodes[-1], e1)
+		self.assertEqual(cb._vectorized_past_utterances.shape[0], len(cb._past_utterances_metadata))
+		self.assertEqual(cb.learner.stats()['learned'], 1)
+
+		e2 = alice.start_episode(bob)
+		alice.say("Nice weather today", e2)
+		self.assertEqual(cb.utterance_callback(e2)[0].payload, 'Indeed')
+		cb.close()
+
+	def test_concurrent_learn_predict(self):
+		cb = TfIdfAgent()
+		sample_episode, alice, bob = _sample_episode()
+		cb.learn_episodes([sample_episode])
+		errors = []
+
+		def predict():
+			e = alice.start_episode(bob)
+			alice.say("Hi!", e)
+			for _ in range(50):
+				try:
+					index = cb._index
+					self.assertEqual(index.vectorized_past_utterances.shape[0], len(index.past_utterances_metadata))
+					self.assertEqual(cb.utterance_callback(e)[0].payload, 'Hello')
+				except Exception as ex:
+					errors.append(ex)
+
+		threads = [threading.Thread(target=predict) for _ in range(4)]
+		for t in threads:
+			t.start()
+		for i in range(10):
+			cb.learn_episodes(_get_train_episodes())
+		for t in threads:
+			t.join()
+		self.assertEqual(errors, [])
+		with self.assertRaises(ValueError):
+			cb._vectorized_past_utterances.data[0] = 0
+
+	def test_learn_stream(self):
+		expected = TfIdfAgent()
+		expected.learn_episodes(_get_train_episodes() + [_sample_episode()[0]])
+
+		agent = TfIdfAgent()
+		agent.learn_episodes(_get_train_episodes()[:1])
+		result = agent.learn_stream(iter(_get_train_episodes()[1:] + [_sample_episode()[0]]), chunk_size=1)
+		self.assertEqual(result, 2)
+		self.assertEqual(agent._normalized_past_utterances, expected._normalized_past_utterances)
+		self.assertEqual(agent._index.answers, expected._index.answers)
+		self.assertEqual(len(agent._past_episodes), 3)
+
+		def similarities(a):
+			m = a._vectorized_past_utterances
+			return (m @ m.T).toarray()
+		self.assertLess(abs(similarities(agent) - similarities(expected)).max(), 1e-12)
+		sentence = agent._process_utterance('aaa bbb ccc mario')
+		self.assertLess(abs(
+			(agent._vectorizer.transform([sentence]) @ agent._vectorized_past_utterances.T) -
+			(expected._vectorizer.transform([sentence]) @ expected._vectorized_past_utterances.T)
+		).max(), 1e-12)
+
+	def test_learn_stream_linear_cost(self):
+		# The work done for each chunk must not depend on what was learned before
+		episodes = [_sample_episode()[0] for _ in range(40)]
+		stacked_rows = []
+		original_vstack = scipy.sparse.vstack
+		def vstack(blocks, **kwargs):
+			stacked_rows.append(sum(b.shape[0] for b in blocks))
+			return original_vstack(blocks, **kwargs)
+
+		for publish_every, publications in [(None, 1), (10, 4), (15, 3)]:
+			stacked_rows.clear()
+			agent = TfIdfAgent()
+			with mock.patch.object(tfidf.scipy.sparse, 'vstack', side_effect=vstack), mock.patch.object(agent, '_publish', wraps=agent._publish) as publish:
+				agent.learn_stream(episodes, chunk_size=1, publish_every=publish_every)
+			self.assertEqual(publish.call_count, publications)
+			self.assertEqual(len(stacked_rows), publications)
+			self.assertEqual(len(agent._normalized_past_utterances), 40 * 5)
+
+		with self.assertRaises(ValueError):
+			TfIdfAgent().learn_stream(episodes, publish_every=0)
+
+	def test_learn_stream_not_retained(self):
+		agent = TfIdfAgent()
+		agent.learn_stream(_get_train_episodes(), chunk_size=1, retain_episodes=False)
+		self.assertEqual(len(agent._past_episodes), 0)
+		self.assertEqual(agent.utterance_callback(_get_test_episode())[0].payload, 'bbb')
+
+		loaded_agent = Agent.load(agent.save())
+		self.assertEqual(loaded_agent.utterance_callback(_get_test_episode())[0].payload, 'bbb')
+		loaded_agent.learn_episodes([_sample_episode()[0]])
+		self.assertEqual(len(loaded_agent._past_episodes), 1)
+		self.assertEqual(loaded_agent.utterance_callback(_get_test_episode())[0].payload, 'bbb')
+
 	def test_agent_load(self):
 		sample_episode, alice, bob = _sample_episode()
 		cb = TfIdfAgent()
@@ -2,26 +2,52 @@
 Baseline sentence matching model based on If-Idf vector similarity.
 """
 import logging
+import threading
 from datetime import datetime
-from collections import namedtuple
+from collections import namedtuple, Counter
 
 import numpy as np
+import scipy.sparse
 from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.preprocessing import normalize
 from sklearn.metrics.pairwise import cosine_similarity
 from tqdm import tqdm
 
 import due
-from due.agent import Agent
+from due.agent import Agent, DEFAULT_LEARN_CHUNK_SIZE, _chunks
 from due.event import Event
 from due.episode import Episode, extract_utterances
+from due.learning import BackgroundLearner
 from due.nlp.preprocessing import normalize_sentence
+from due.pipeline import build_tfidf_index
+from due.session import SessionStore
+from due.util import tracing, metrics
 
 DEFAULT_PARAMETERS = {
 	'lemmatize_tokens': False,
+	'session_idle_timeout': None,
+	'max_sessions': None,
+	'background_learning': False,
 }
 
 _UtteranceMetadata = namedtuple('_UtteranceMetadata', ['episode', 'index'])
 
+_TfIdfIndex = namedtuple('_TfIdfIndex', ['vectorizer', 'vectorized_past_utterances', 'normalized_past_utterances', 'past_utterances_metadata', 'answers', 'past_episodes'])
+_TfIdfIndex.__doc__ = """
+An immutable snapshot of what a :class:`TfIdfAgent` has learned. Learning
+builds a new snapshot, and replaces the agent's reference to the old one: as
+the swap of a reference is atomic, predictions always read a consistent
+index without locking, and keep using the one they started with until they
+are done.
+
+Per each utterance, `answers` holds the utterance that came right after it.
+`past_utterances_metadata` is `None` for the utterances of Episodes that
+were learned without being retained (see :meth:`TfIdfAgent.learn_stream`).
+"""
+
+_INDEX_UTTERANCES = metrics.REGISTRY.gauge('due_tfidf_index_utterances', "Utterances in the index of a TfIdfAgent", ['agent'])
+_INDEX_TERMS = metrics.REGISTRY.gauge('due_tfidf_index_terms', "Terms in the vocabulary of a TfIdfAgent", ['agent'])
+
 class TfIdfAgent(Agent):
 	"""
 	This is a baseline :class:`Agent` that just matches the incoming utterance
@@ -31,9 +57,23 @@ class TfIdfAgent(Agent):
 	Utterance similarity is modeled as the plain **cosine distance** of the
 	**tf-idf** sentence vectors.
 
-	The only parameter that can be currently passed to the model is
-	`lemmatize_tokens` (defaults to `False`), which adds lemmatization to
-	learned utterances.
+	The parameters that can be currently passed to the model are:
+
+	* `lemmatize_tokens` (defaults to `False`), which adds lemmatization to
+	  learned utterances
+	* `session_idle_timeout` and `max_sessions` (both default to `None`, that
+	  is, no eviction), which limit the Episodes the agent keeps track of.
+	  Episodes that are evicted because they were idle for too long (or
+	  because there are too many of them) are learned, just like the ones that
+	  are left. Evicted Episodes are always learned in the background, as
+	  eviction happens in the thread serving some other Episode. An evicted
+	  Episode is not learned again when it is left: utterances that are added
+	  to it after its eviction are not learned.
+	* `background_learning` (defaults to `False`), which learns left and
+	  evicted Episodes in a :class:`due.learning.BackgroundLearner`, instead
+	  of the thread that is serving the Episode. Bursts of Episodes are learned
+	  at once, and the agent keeps answering from its previous index until
+	  the new one is ready.
 
 	:param parameters: A dictionary of parameters.
 	:param parameters: `dict`
@@ -46,32 +86,195 @@ class TfIdfAgent(Agent):
 		self._logger = logging.getLogger(__name__ + ".TfIdfAgent")
 		super().__init__(id)
 		self.parameters = {**DEFAULT_PARAMETERS, **parameters} if not _data else {**_data['parameters'], **parameters}
-		self._active_episodes = {}
-		self._vectorizer = TfidfVectorizer(tokenizer=_dummy_function, preprocessor=_dummy_function)
-
-		self._past_episodes = []
-		self._normalized_past_utterances = [] # Sequence of all the utterances in the episodes
-		self._vectorized_past_utterances = []
-		self._past_utterances_metadata = []   # Per each utterance, remember source episode and position
+		session_parameters = {**DEFAULT_PARAMETERS, **self.parameters}
+		self._active_episodes = SessionStore(
+			session_parameters['session_idle_timeout'],
+			session_parameters['max_sessions'],
+			on_evict=lambda episode_id, episode, reason: self._learn_evicted_episode(episode)
+		)
+		self.learner = BackgroundLearner(self.learn_episodes) if session_parameters['background_learning'] else None
+		self._eviction_learner = None
+		self._evicted_episode_ids = set()
+		self._learn_lock = threading.RLock()
+		self._index = _TfIdfIndex(_new_vectorizer(), [], (), (), (), ())
 
 		if _data:
 			self.parameters = _data['parameters']
-			self._past_episodes = [Episode.load(e) for e in _data['past_episodes']]
-			if self._past_episodes:
-				self._normalized_past_utterances = _data['normalized_past_utterances']
-				self._past_utterances_metadata = self._load_past_utterances_metadata(_data['past_utterances_metadata'], self._past_episodes)
-				self._vectorized_past_utterances = self._vectorizer.fit_transform(self._normalized_past_utterances)
+			past_episodes = [Episode.load(e) for e in _data['past_episodes']]
+			if _data['normalized_past_utterances']:
+				vectorizer = _new_vectorizer()
+				normalized_past_utterances = _data['normalized_past_utterances']
+				past_utterances_metadata = self._load_past_utterances_metadata(_data['past_utterances_metadata'], past_episodes)
+				answers = _data.get('answers') or [self._answer(m) for m in past_utterances_metadata]
+				vectorized_past_utterances = vectorizer.fit_transform(normalized_past_utterances)
+				self._publish(vectorizer, vectorized_past_utterances, normalized_past_utterances, past_utterances_metadata, answers, past_episodes)
+			else:
+				self._index = self._index._replace(past_episodes=tuple(past_episodes))
+
+	@property
+	def _vectorizer(self):
+		return self._index.vectorizer
+
+	@property
+	def _vectorized_past_utterances(self):
+		return self._index.vectorized_past_utterances
+
+	@property
+	def _normalized_past_utterances(self):
+		"""Sequence of all the utterances in the episodes"""
+		return self._index.normalized_past_utterances
+
+	@property
+	def _past_utterances_metadata(self):
+		"""Per each utterance, remember source episode and position"""
+		return self._index.past_utterances_metadata
+
+	@property
+	def _past_episodes(self):
+		return self._index.past_episodes
 
 	def learn_episodes(self, episodes):
-		"""See :meth:`due.agent.Agent.learn_episodes`"""
-		for e in tqdm(episodes):
-			self._past_episodes.append(e)
-			for i, u in enumerate(extract_utterances(e)):
-				if u:
-					self._normalized_past_utterances.append(self._process_utterance(u))
-					self._past_utterances_metadata.append(_UtteranceMetadata(e, i))
-		self._vectorized_past_utterances = self._vectorizer.fit_transform(self._normalized_past_utterances)
+		"""
+		See :meth:`due.agent.Agent.learn_episodes`. The new index is built
+		aside, and published atomically when it's ready: in the meantime,
+		the agent answers from its previous index.
+		"""
+		with self._learn_lock:
+			index = self._index
+			past_episodes = list(index.past_episodes)
+			normalized_past_utterances = list(index.normalized_past_utterances)
+			past_utterances_metadata = list(index.past_utterances_metadata)
+			answers = list(index.answers)
+			for e in tqdm(episodes):
+				past_episodes.append(e)
+				for i, u in enumerate(extract_utterances(e)):
+					if u:
+						normalized_past_utterances.append(self._process_utterance(u))
+						past_utterances_metadata.append(_UtteranceMetadata(e, i))
+						answers.append(self._answer(past_utterances_metadata[-1]))
+			vectorizer = _new_vectorizer()
+			vectorized_past_utterances = vectorizer.fit_transform(normalized_past_utterances)
+			self._publish(vectorizer, vectorized_past_utterances, normalized_past_utterances, past_utterances_metadata, answers, past_episodes)
+
+	def learn_stream(self, episodes, chunk_size=DEFAULT_LEARN_CHUNK_SIZE, retain_episodes=True, publish_every=None):
+		"""
+		See :meth:`due.agent.Agent.learn_stream`. The index is built
+		incrementally: each chunk is normalized and counted once, and its term
+		counts are stacked with the ones of the previous chunks only when the
+		index is published. Utterances that were learned before this call are
+		counted once more, at the beginning.
+
+		By default, the new index is published once, at the end of the stream.
+		If `publish_every` is given, it's also published every `publish_every`
+		chunks, so that the agent can answer from what it learned so far.
+		As each publication weights the whole index again with the updated
+		idf, its cost grows with the number of learned utterances.
+
+		If `retain_episodes` is `False`, the agent only keeps the normalized
+		utterances and their answers, rather than the whole Episodes. Note
+		that the Episodes that are not retained can't be saved with the agent.
+
+		:param episodes: an iterable of Episodes
+		:type episodes: iterable of :class:`due.episode.Episode`
+		:param chunk_size: number of Episodes learned at once
+		:type chunk_size: `int`
+		:param retain_episodes: whether to keep the learned Episodes in memory
+		:type retain_episodes: `bool`
+		:param publish_every: publish the index every this many chunks (if `None`, only at the end)
+		:type publish_every: `int`
+		:return: the number of learned Episodes
+		:rtype: `int`
+		"""
+		if publish_every is not None and publish_every < 1:
+			raise ValueError("publish_every must be positive")
+		result = 0
+		with self._learn_lock:
+			index = self._index
+			past_episodes = list(index.past_episodes)
+			normalized_past_utterances = list(index.normalized_past_utterances)
+			past_utterances_metadata = list(index.past_utterances_metadata)
+			answers = list(index.answers)
+			vocabulary = dict(getattr(index.vectorizer, 'vocabulary_', {}))
+			count_blocks = [_term_counts(normalized_past_utterances, vocabulary)]
+			published = True
+
+			for n, chunk in enumerate(_chunks(episodes, chunk_size), 1):
+				new_utterances = []
+				for e in chunk:
+					if retain_episodes:
+						past_episodes.append(e)
+					for i, u in enumerate(extract_utterances(e)):
+						if u:
+							new_utterances.append(self._process_utterance(u))
+							answers.append(self._answer(_UtteranceMetadata(e, i)))
+							past_utterances_metadata.append(_UtteranceMetadata(e, i) if retain_episodes else None)
+				normalized_past_utterances.extend(new_utterances)
+				count_blocks.append(_term_counts(new_utterances, vocabulary))
+				result += len(chunk)
+				published = False
+				self._logger.info("Learned %s Episodes (%s utterances)", result, len(normalized_past_utterances))
+
+				if publish_every is not None and n % publish_every == 0:
+					count_blocks = [_stack_counts(count_blocks, len(vocabulary))]
+					self._publish_counts(count_blocks[0], vocabulary, normalized_past_utterances, past_utterances_metadata, answers, past_episodes)
+					published = True
+
+			if not published:
+				counts = _stack_counts(count_blocks, len(vocabulary))
+				self._publish_counts(counts, vocabulary, normalized_past_utterances, past_utterances_metadata, answers, past_episodes)
+		return result
+
+	def _publish_counts(self, counts, vocabulary, normalized_past_utterances, past_utterances_metadata, answers, past_episodes):
+		if not normalized_past_utterances:
+			self._index = self._index._replace(past_episodes=tuple(past_episodes))
+			return
+		document_frequencies = np.bincount(counts.indices, minlength=len(vocabulary))
+		vectorizer, vectorized_past_utterances = _tfidf_index(counts, document_frequencies, vocabulary)
+		self._publish(vectorizer, vectorized_past_utterances, normalized_past_utterances, past_utterances_metadata, answers, past_episodes)
 
+	def learn_ingestion(self, ingestion):
+		"""
+		Learn the Episodes of a corpus that was processed by the ingestion
+		pipeline (see :mod:`due.pipeline`). This is equivalent to
+		:meth:`learn_episodes`, but the utterances are already normalized, and
+		the tf-idf index is built from the merged document frequencies.
+
+		Utterances must have been normalized with the same `lemmatize_tokens`
+		parameter as the agent's.
+
+		:param ingestion: an ingested corpus
+		:type ingestion: :class:`due.pipeline.Ingestion`
+		"""
+		with self._learn_lock:
+			index = self._index
+			first_new_episode = len(index.past_episodes)
+			past_episodes = list(index.past_episodes) + list(ingestion.episodes)
+			normalized_past_utterances = list(index.normalized_past_utterances) + list(ingestion.normalized_utterances)
+			new_metadata = [
+				_UtteranceMetadata(past_episodes[first_new_episode + e], i)
+				for e, i in ingestion.utterances_metadata
+			]
+			past_utterances_metadata = list(index.past_utterances_metadata) + new_metadata
+			answers = list(index.answers) + [self._answer(m) for m in new_metadata]
+			vectorizer = _new_vectorizer()
+			if not index.normalized_past_utterances:
+				vectorized_past_utterances = build_tfidf_index(vectorizer, ingestion)
+			else:
+				vectorized_past_utterances = vectorizer.fit_transform(normalized_past_utterances)
+			self._publish(vectorizer, vectorized_past_utterances, normalized_past_utterances, past_utterances_metadata, answers, past_episodes)
+
+	def _publish(self, vectorizer, vectorized_past_utterances, normalized_past_utterances, past_utterances_metadata, answers, past_episodes):
+		"""Replace the current index with a new snapshot."""
+		self._index = _TfIdfIndex(
+			vectorizer,
+			_freeze(vectorized_past_utterances),
+			tuple(normalized_past_utterances),
+			tuple(past_utterances_metadata),
+			tuple(answers),
+			tuple(past_episodes)
+		)
+		_INDEX_UTTERANCES.labels(agent=self.id).set(len(normalized_past_utterances))
+		_INDEX_TERMS.labels(agent=self.id).set(len(getattr(vectorizer, 'vocabulary_', ())))
 
 	def _process_utterance(self, utterance):
 		return normalize_sentence(
@@ -86,6 +289,7 @@ class TfIdfAgent(Agent):
 
 	def utterance_callback(self, episode):
 		"""See :meth:`due.agent.Agent.utterance_callback`"""
+		self._active_episodes.touch(episode.id)
 		last_utterance = episode.last_event(Event.Type.Utterance)
 		predicted_answer = self._predict(last_utterance.payload)
 		if predicted_answer:
@@ -93,12 +297,36 @@ class TfIdfAgent(Agent):
 		return []
 
 
+	def batch_utterance_callback(self, episodes):
+		"""
+		See :meth:`due.agent.Agent.batch_utterance_callback`. All the
+		utterances in the batch are vectorized and matched at once.
+		"""
+		for e in episodes:
+			self._active_episodes.touch(e.id)
+		sentences = [e.last_event(Event.Type.Utterance).payload for e in episodes]
+		now = datetime.now()
+		return [
+			[Event(Event.Type.Utterance, now, self.id, answer)] if answer else []
+			for answer in self._predict_batch(sentences)
+		]
+
 	def _predict(self, sentence):
-		sentence_v = self._vectorizer.transform([self._process_utterance(sentence)])
-		scores = cosine_similarity(self._vectorized_past_utterances, sentence_v)
-		max_utterance_meta = self._past_utterances_metadata[np.argmax(scores)]
-		matched_past_episode = max_utterance_meta.episode
-		matched_index_in_episode = max_utterance_meta.index
+		return self._predict_batch([sentence])[0]
+
+	def _predict_batch(self, sentences):
+		index = self._index
+		normalized_sentences = [self._process_utterance(s) for s in sentences]
+		with tracing.span('tfidf.transform'):
+			sentences_v = index.vectorizer.transform(normalized_sentences)
+		with tracing.span('tfidf.cosine_similarity'):
+			scores = cosine_similarity(index.vectorized_past_utterances, sentences_v)
+		return [index.answers[i] for i in np.argmax(scores, axis=0)]
+
+	@staticmethod
+	def _answer(utterance_meta):
+		matched_past_episode = utterance_meta.episode
+		matched_index_in_episode = utterance_meta.index
 		try:
 			return matched_past_episode.events[matched_index_in_episode+1].payload
 		except IndexError:
@@ -107,39 +335,122 @@ class TfIdfAgent(Agent):
 	def new_episode_callback(self, new_episode):
 		"""See :meth:`due.agent.Agent.new_episode_callback`"""
 		self._logger.debug("New episode callback received: %s", new_episode)
+		self._active_episodes[new_episode.id] = new_episode
 
 	def leave_callback(self, episode):
 		"""See :meth:`due.agent.Agent.leave_callback`"""
-		self.learn_episode(episode)
+		self._active_episodes.pop(episode.id)
+		with self._learn_lock:
+			if episode.id in self._evicted_episode_ids:
+				self._evicted_episode_ids.discard(episode.id)
+				return
+		self._learn_finished_episode(episode)
+
+	def _learn_finished_episode(self, episode):
+		if self.learner is not None:
+			self.learner.submit(episode)
+		else:
+			self.learn_episode(episode)
+
+	def close(self):
+		"""
+		Learn the Episodes that are queued for background learning, and stop
+		the learner threads.
+		"""
+		for learner in (self.learner, self._eviction_learner):
+			if learner is not None:
+				learner.stop()
+
+	def _learn_evicted_episode(self, episode):
+		with self._learn_lock:
+			self._evicted_episode_ids.add(episode.id)
+			learner = self.learner
+			if learner is None:
+				if self._eviction_learner is None:
+					self._eviction_learner = BackgroundLearner(self.learn_episodes, name='due-eviction-learner')
+				learner = self._eviction_learner
+		learner.submit(episode)
 
 	def save(self):
 		"""See :meth:`due.agent.Agent.save`"""
+		index = self._index
 		return {
 			'version': due.__version__,
 			'class': 'due.models.tfidf.TfIdfAgent',
 			'data': {
 				'parameters': self.parameters,
-				'past_episodes': [e.save() for e in self._past_episodes],
-				'normalized_past_utterances': self._normalized_past_utterances,
-				'past_utterances_metadata': self._save_past_utterances_metadata()
+				'past_episodes': [e.save() for e in index.past_episodes],
+				'normalized_past_utterances': list(index.normalized_past_utterances),
+				'past_utterances_metadata': self._save_past_utterances_metadata(index),
+				'answers': list(index.answers)
 			}
 		}
 
-	def _save_past_utterances_metadata(self):
+	def _save_past_utterances_metadata(self, index):
 		result = []
 		episode_index = 0
-		for pum in self._past_utterances_metadata:
-			episode_index = self._past_episode_index(pum.episode, start=episode_index)
+		for pum in index.past_utterances_metadata:
+			if pum is None:
+				result.append(None)
+				continue
+			episode_index = _past_episode_index(index.past_episodes, pum.episode, start=episode_index)
 			result.append([episode_index, pum.index])
 		return result
 
 	def _load_past_utterances_metadata(self, data, past_episodes):
-		return [_UtteranceMetadata(past_episodes[x[0]], x[1]) for x in data]
+		return [_UtteranceMetadata(past_episodes[x[0]], x[1]) if x is not None else None for x in data]
+
+def _past_episode_index(past_episodes, episode, start=0):
+	for i in range(start, len(past_episodes)):
+		if past_episodes[i] is episode:
+			return i
+
+def _new_vectorizer():
+	return TfidfVectorizer(tokenizer=_dummy_function, preprocessor=_dummy_function)
+
+def _term_counts(normalized_utterances, vocabulary):
+	"""
+	Return the matrix of the term counts of the given utterances. Terms that
+	are not in `vocabulary` are added to it.
+	"""
+	indptr = [0]
+	indices = []
+	data = []
+	for tokens in normalized_utterances:
+		row = Counter(vocabulary.setdefault(t, len(vocabulary)) for t in tokens)
+		indices.extend(row.keys())
+		data.extend(row.values())
+		indptr.append(len(indices))
+	return scipy.sparse.csr_matrix((data, indices, indptr), shape=(len(normalized_utterances), len(vocabulary)), dtype=np.float64)
+
+def _stack_counts(count_blocks, n_terms):
+	"""
+	Stack term count matrices that were built while the vocabulary grew, so
+	that they all have one column per term.
+	"""
+	for block in count_blocks:
+		block.resize((block.shape[0], n_terms))
+	return scipy.sparse.vstack(count_blocks, format='csr')
+
+def _tfidf_index(counts, document_frequencies, vocabulary):
+	"""
+	Weight a term count matrix with the idf of the given document
+	frequencies, and return it with a vectorizer that produces the same
+	vectors (see :func:`due.pipeline.build_tfidf_index`).
+	"""
+	vectorizer = _new_vectorizer()
+	smoothing = int(vectorizer.smooth_idf)
+	idf = np.log((counts.shape[0] + smoothing) / (document_frequencies + smoothing)) + 1
+	vectorizer.vocabulary_ = dict(vocabulary)
+	vectorizer.idf_ = idf
+	result = normalize(counts.multiply(idf).tocsr(), norm=vectorizer.norm)
+	return vectorizer, result
 
-	def _past_episode_index(self, episode, start=0):
-		for i in range(start, len(self._past_episodes)):
-			if self._past_episodes[i] is episode:
-				return i
+def _freeze(matrix):
+	"""Make the arrays of a sparse matrix read-only, as it's shared by concurrent readers."""
+	for a in (matrix.data, matrix.indices, matrix.indptr):
+		a.flags.writeable = False
+	return matrix
 
 def _dummy_function(x):
 	"""This is used to feed already processed data to TfidfVectorizer"""
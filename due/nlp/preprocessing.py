@@ -3,6 +3,8 @@ from functools import lru_cache
 
 import spacy
 
+from due.util import tracing
+
 def tokenize_sentence(sentence, language, lemmatize):
 	"""
 	Wraps around Spacy's tokenizer returning a list of string tokens for the
@@ -39,12 +41,13 @@ def normalize_sentence(sentence, return_tokens=False, language='en', lemmatize=F
 	:return: a normalized sentence
 	:rtype: `str` or (`list` of `str`)
 	"""
-	result = sentence.lower()
-	result = re.sub(r'\s+', ' ', result)
-	result = tokenize_sentence(result, language, lemmatize)
-	if not return_tokens:
-		result = ' '.join(result)
-	return result
+	with tracing.span('normalize_sentence'):
+		result = sentence.lower()
+		result = re.sub(r'\s+', ' ', result)
+		result = tokenize_sentence(result, language, lemmatize)
+		if not return_tokens:
+			result = ' '.join(result)
+		return result
 
 @lru_cache(8)
 def _load_spacy(language):
@@ -143,7 +143,7 @@ def get_embedding_matrix(vocabulary, embeddings_stream, embedding_dim, random=Fa
 
 	.. code-block:: python
 
-		with rm.open_resource_file('embeddings.glove6B', 'glove.6B.300d.txt') as f:
+		with rm.open_resource_file('embeddings.glove6B', 'glove.6B.300d.txt', extract=True) as f:
 		    embedding_matrix = get_embedding_matrix(vocabulary, f, 300)
 
 	The *Start Of String* (:data:`SOS`) token is represented as a vector of **ones**.
@@ -2,7 +2,11 @@
 This module defines the way saved entities (see `save` method of `Agent`,
 `Episode`, etc) are serialized to files.
 
-Currently, this is simply done with **YAML** or JSON.
+Currently, this is simply done with **YAML** or JSON. When available, the
+`libyaml` C bindings are used to load and dump YAML documents.
+
+Saved Episodes (and lists of saved Episodes) can also be stored in a compact
+**binary** format, which is described in :mod:`due.codec`.
 
 **Pickle** is also supported, even though it's not advisable to distribute `.pkl`
 files, because the format is inherently unsafe
@@ -11,11 +15,27 @@ files, because the format is inherently unsafe
 API
 ===
 """
+import os
 import json
 import pickle
 
 import yaml
-import magic
+
+from due import codec
+
+YAML_LOADER = getattr(yaml, 'CFullLoader', yaml.FullLoader)
+YAML_DUMPER = getattr(yaml, 'CDumper', yaml.Dumper)
+
+YAML_VERSION = (1, 1)
+YAML_MARKERS = (b'%YAML', b'---')
+PICKLE_MARKER = b'\x80'
+
+EXTENSION_FORMATS = {
+	'.yaml': 'yaml',
+	'.yml': 'yaml',
+	'.json': 'json',
+	'.dueb': 'binary',
+}
 
 def serialize(saved_thing, path, file_format='yaml', overwrite=True):
 	"""
@@ -28,12 +48,16 @@ def serialize(saved_thing, path, file_format='yaml', overwrite=True):
 	* `yaml` (default)
 	* `json`
 	* `pickle`
+	* `binary` (saved Episodes only, see :mod:`due.codec`)
+
+	YAML documents are written with an explicit `%YAML` directive, which
+	:func:`deserialize` uses to detect their format without parsing them.
 
 	:param saved_thing: the saved object
 	:type saved_thing: *anything serializable*
 	:param path: path of the output file
 	:type path: `str`
-	:param file_format: 'yaml', 'json' or 'pickle'
+	:param file_format: 'yaml', 'json', 'pickle' or 'binary'
 	:type file_format: `str`
 	:param overwrite: overwrite if existing
 	:type overwrite: `bool`
@@ -43,44 +67,108 @@ def serialize(saved_thing, path, file_format='yaml', overwrite=True):
 
 	if file_format == 'yaml':
 		with open(path, 'w') as f:
-			yaml.dump(saved_thing, f)
+			yaml.dump(saved_thing, f, Dumper=YAML_DUMPER, explicit_start=True, version=YAML_VERSION)
 	elif file_format == 'json':
 		with open(path, 'w') as f:
 			json.dump(saved_thing, f)
 	elif file_format == 'pickle':
 		with open(path, 'wb') as f:
 			return pickle.dump(saved_thing, f)
+	elif file_format == 'binary':
+		with open(path, 'wb') as f:
+			codec.dump(saved_thing, f)
 	else:
-		raise ValueError(f"Unsupported file format '{file_format}'. Supported types are 'yaml', 'json' or 'pickle'")
+		raise ValueError(f"Unsupported file format '{file_format}'. Supported types are 'yaml', 'json', 'pickle' or 'binary'")
 
-def deserialize(path, file_format='auto', allow_pickle=False):
+def deserialize(source, file_format='auto', allow_pickle=False):
 	"""
-	Deserialize an object reading from the given path.
+	Deserialize an object reading from the given source, which can be a path,
+	an open file object (text or binary) or a `bytes` object.
 
-	Supported formats are YAML, JSON and Pickle. Note that, as Pickle is not a
-	safe format for public distribution, its support must be explicitly enabled
-	with the `allow_pickle` flag. If you do not trust your sources, leave the
-	flag to `False` (see https://docs.python.org/3/library/pickle.html).
+	Supported formats are YAML, JSON, Pickle and the binary Episode format of
+	:mod:`due.codec`. Unless a specific `file_format` is given, the format is
+	detected from the file extension, or from the first bytes of its content.
+	JSON documents are parsed with the :mod:`json` module, YAML ones with the
+	`libyaml` C loader, when available.
 
-	:param path: the path where the object was serialized
-	:type path: `str`
-	:param file_format: if not 'auto', force a specific format (currently unsupported)
+	Note that, as Pickle is not a safe format for public distribution, its
+	support must be explicitly enabled with the `allow_pickle` flag. If you do
+	not trust your sources, leave the flag to `False` (see
+	https://docs.python.org/3/library/pickle.html).
+
+	:param source: the path where the object was serialized, a file object or a `bytes` object
+	:type source: `str`, file object or `bytes`
+	:param file_format: 'auto' (default), 'yaml', 'json', 'pickle' or 'binary'
 	:type file_format: `str`
 	:param allow_pickle: Allow reading Pickle binary files
 	:type allow_pickle: `bool`
 	:return: the deserialized object
 	:rtype: *many*
 	"""
-	if file_format != 'auto':
-		raise NotImplementedError()
+	data, name = _read_source(source)
 
-	detected_format = magic.Magic().from_file(path)
+	if file_format == 'auto':
+		file_format = _detect_format(data, name)
 
-	if detected_format == 'data':
+	if file_format == 'pickle':
 		if not allow_pickle:
 			raise ValueError("Binary file detected, but 'allow_pickle' is False. Aborting.")
-		with open(path, 'rb') as f:
-			return pickle.load(f)
+		return pickle.loads(data)
+	elif file_format == 'binary':
+		return codec.loads(data)
+	elif file_format == 'json':
+		try:
+			return json.loads(data)
+		except ValueError:
+			# YAML flow documents look like JSON, but may not be valid JSON
+			return yaml.load(data, Loader=YAML_LOADER)
+	elif file_format == 'yaml':
+		return yaml.load(data, Loader=YAML_LOADER)
 	else:
-		with open(path, 'r') as f:
-			return yaml.load(f, Loader=yaml.FullLoader)
+		raise ValueError(f"Unsupported file format '{file_format}'. Supported types are 'auto', 'yaml', 'json', 'pickle' or 'binary'")
+
+#
+# Helpers
+#
+
+def _read_source(source):
+	"""
+	Return the content of `source` as `bytes`, along with a file name (if any)
+	that can be used as a format hint.
+	"""
+	if isinstance(source, (bytes, bytearray, memoryview)):
+		return bytes(source), None
+
+	if hasattr(source, 'read'):
+		data = source.read()
+		if isinstance(data, str):
+			data = data.encode('utf-8')
+		return data, getattr(source, 'name', None)
+
+	with open(source, 'rb') as f:
+		return f.read(), os.fspath(source)
+
+def _detect_format(data, name=None):
+	"""
+	Guess the format of a serialized object by its file name extension, and by
+	sniffing the beginning of its content.
+	"""
+	if isinstance(name, str):
+		extension = os.path.splitext(name)[1].lower()
+		if extension in EXTENSION_FORMATS:
+			return EXTENSION_FORMATS[extension]
+
+	if data.startswith(codec.MAGIC):
+		return 'binary'
+	if data.startswith(PICKLE_MARKER):
+		return 'pickle'
+
+	header = data[:1024].lstrip(b'\xef\xbb\xbf \t\r\n')
+	if header.startswith(YAML_MARKERS):
+		return 'yaml'
+	if header.startswith((b'{', b'[')):
+		return 'json'
+	if b'\x00' in header:
+		return 'pickle'
+
+	return 'yaml'
@@ -0,0 +1,223 @@
+"""
+The ingestion pipeline turns a corpus into the training data of a
+:class:`due.models.tfidf.TfIdfAgent`, spreading the expensive stages over a pool
+of processes:
+
+1. **parse**: the corpus is split in contiguous chunks of Episodes, which are
+   loaded (and decoded, for archive-backed corpora) by the workers
+2. **normalize**: each worker extracts the utterances of its Episodes and
+   normalizes them (see :func:`due.nlp.preprocessing.normalize_sentence`),
+   counting the document frequency of each token
+3. **reduce**: the partial results are merged in corpus order, summing the
+   document frequencies
+4. **index**: the tf-idf index is built from the merged vocabulary and document
+   frequencies, without a further pass to fit the vectorizer
+
+.. code-block:: python
+
+	from due.corpora import cornell
+	from due.pipeline import ingest
+	from due.models.tfidf import TfIdfAgent
+
+	ingestion = ingest(cornell.corpus(), n_jobs=8)
+	agent = TfIdfAgent()
+	agent.learn_ingestion(ingestion)
+
+	for stage in ingestion.stages:
+		print(stage)
+
+The time spent in each stage, and its throughput in items per second, are
+logged and returned as part of the result. Parse and normalize times are
+summed over the workers (ie. they are CPU times, rather than wall clock times).
+
+API
+===
+"""
+import time
+import logging
+from itertools import islice
+from collections import Counter, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from due.episode import extract_utterances
+from due.corpora.corpus import Corpus, ListCorpus, ArchiveCorpus
+from due.nlp.preprocessing import normalize_sentence
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 500
+
+Ingestion = namedtuple('Ingestion', ['episodes', 'normalized_utterances', 'utterances_metadata', 'document_frequencies', 'stages'])
+Ingestion.__doc__ = """
+The result of :func:`ingest`.
+
+:param episodes: the ingested Episodes, in corpus order
+:type episodes: `list` of :class:`due.episode.Episode`
+:param normalized_utterances: the token lists of all the non-empty utterances in the corpus
+:type normalized_utterances: `list` of (`list` of `str`)
+:param utterances_metadata: per each normalized utterance, the index of its Episode in `episodes` and its position among the Episode's utterances
+:type utterances_metadata: `list` of (`int`, `int`)
+:param document_frequencies: number of utterances each token appears in
+:type document_frequencies: :class:`collections.Counter`
+:param stages: time and throughput of each stage of the pipeline
+:type stages: `list` of :class:`StageStats`
+"""
+
+StageStats = namedtuple('StageStats', ['name', 'items', 'seconds', 'throughput'])
+StageStats.__doc__ = """
+Statistics of a stage of the ingestion pipeline.
+
+:param name: the name of the stage
+:type name: `str`
+:param items: number of items (Episodes or utterances) processed by the stage
+:type items: `int`
+:param seconds: time spent in the stage
+:type seconds: `float`
+:param throughput: items processed per second
+:type throughput: `float`
+"""
+
+_ChunkResult = namedtuple('_ChunkResult', ['episodes', 'normalized_utterances', 'utterances_metadata', 'document_frequencies', 'parse_seconds', 'normalize_seconds'])
+
+def ingest(corpus, n_jobs=1, chunk_size=DEFAULT_CHUNK_SIZE, language='en', lemmatize=False):
+	"""
+	Run the ingestion pipeline on the given corpus.
+
+	Chunks are processed by a pool of `n_jobs` processes, and only a bounded
+	number of them is in flight at any time. With `n_jobs=1`, everything runs
+	in the current process.
+
+	:param corpus: a Corpus, or a sequence of Episodes
+	:type corpus: :class:`due.corpora.corpus.Corpus` or iterable of :class:`due.episode.Episode`
+	:param n_jobs: number of worker processes
+	:type n_jobs: `int`
+	:param chunk_size: number of Episodes in each chunk
+	:type chunk_size: `int`
+	:param language: the language of the utterances
+	:type language: `str`
+	:param lemmatize: whether utterances should be lemmatized
+	:type lemmatize: `bool`
+	:return: the ingested corpus
+	:rtype: :class:`Ingestion`
+	"""
+	if chunk_size < 1:
+		raise ValueError("Chunk size must be positive")
+	if not isinstance(corpus, Corpus):
+		corpus = ListCorpus(corpus)
+
+	chunks = (_chunk(corpus, start, start + chunk_size) for start in range(0, len(corpus), chunk_size))
+	parameters = (language, lemmatize)
+	if n_jobs <= 1:
+		results = (_process_chunk(c, *parameters) for c in chunks)
+		return _reduce(results)
+
+	with ProcessPoolExecutor(n_jobs) as executor:
+		return _reduce(_ordered_results(executor, chunks, parameters, 2*n_jobs))
+
+def build_tfidf_index(vectorizer, ingestion):
+	"""
+	Fit a :class:`sklearn.feature_extraction.text.TfidfVectorizer` on the
+	ingested utterances, and return their tf-idf matrix. The vectorizer's
+	vocabulary and idf weights are computed from the merged document
+	frequencies, so the utterances are only transformed once. The result is the
+	same as calling `vectorizer.fit_transform(ingestion.normalized_utterances)`.
+
+	The vectorizer must use the identity as its tokenizer and preprocessor (ie.
+	it must accept already normalized utterances).
+
+	:param vectorizer: a tf-idf vectorizer
+	:type vectorizer: :class:`sklearn.feature_extraction.text.TfidfVectorizer`
+	:param ingestion: the output of :func:`ingest`
+	:type ingestion: :class:`Ingestion`
+	:return: the tf-idf matrix of the ingested utterances
+	:rtype: :class:`scipy.sparse.csr_matrix`
+	"""
+	start = time.perf_counter()
+	terms = sorted(ingestion.document_frequencies)
+	n_documents = len(ingestion.normalized_utterances)
+	df = np.array([ingestion.document_frequencies[t] for t in terms], dtype=np.float64)
+	smoothing = int(vectorizer.smooth_idf)
+	vectorizer.vocabulary_ = {t: i for i, t in enumerate(terms)}
+	vectorizer.idf_ = np.log((n_documents + smoothing) / (df + smoothing)) + 1
+	result = vectorizer.transform(ingestion.normalized_utterances)
+
+	stage = _stage_stats('index', n_documents, time.perf_counter() - start)
+	ingestion.stages.append(stage)
+	_log_stage(stage)
+	return result
+
+#
+# Helpers
+#
+
+def _chunk(corpus, start, stop):
+	"""
+	Return what a worker needs to load the Episodes in the given range. Views
+	of archives are sent as they are (workers read their Episodes from disk);
+	Episodes of other corpora are sent to the worker.
+	"""
+	window = corpus.window(start, stop)
+	return window if isinstance(window.corpus, ArchiveCorpus) else list(window)
+
+def _ordered_results(executor, chunks, parameters, max_pending):
+	pending = [executor.submit(_process_chunk, c, *parameters) for c in islice(chunks, max_pending)]
+	while pending:
+		result = pending.pop(0).result()
+		next_chunk = next(chunks, None)
+		if next_chunk is not None:
+			pending.append(executor.submit(_process_chunk, next_chunk, *parameters))
+		yield result
+
+def _process_chunk(chunk, language, lemmatize):
+	start = time.perf_counter()
+	episodes = list(chunk)
+	parse_seconds = time.perf_counter() - start
+
+	start = time.perf_counter()
+	normalized_utterances = []
+	utterances_metadata = []
+	document_frequencies = Counter()
+	for episode_index, episode in enumerate(episodes):
+		for i, u in enumerate(extract_utterances(episode)):
+			if u:
+				tokens = normalize_sentence(u, return_tokens=True, language=language, lemmatize=lemmatize)
+				normalized_utterances.append(tokens)
+				utterances_metadata.append((episode_index, i))
+				document_frequencies.update(set(tokens))
+	normalize_seconds = time.perf_counter() - start
+
+	return _ChunkResult(episodes, normalized_utterances, utterances_metadata, document_frequencies, parse_seconds, normalize_seconds)
+
+def _reduce(results):
+	episodes = []
+	normalized_utterances = []
+	utterances_metadata = []
+	document_frequencies = Counter()
+	parse_seconds = normalize_seconds = reduce_seconds = 0.
+	for r in results:
+		start = time.perf_counter()
+		offset = len(episodes)
+		episodes.extend(r.episodes)
+		normalized_utterances.extend(r.normalized_utterances)
+		utterances_metadata.extend((offset + e, i) for e, i in r.utterances_metadata)
+		document_frequencies.update(r.document_frequencies)
+		reduce_seconds += time.perf_counter() - start
+		parse_seconds += r.parse_seconds
+		normalize_seconds += r.normalize_seconds
+
+	stages = [
+		_stage_stats('parse', len(episodes), parse_seconds),
+		_stage_stats('normalize', len(normalized_utterances), normalize_seconds),
+		_stage_stats('reduce', len(normalized_utterances), reduce_seconds),
+	]
+	for s in stages:
+		_log_stage(s)
+	return Ingestion(episodes, normalized_utterances, utterances_metadata, document_frequencies, stages)
+
+def _stage_stats(name, items, seconds):
+	return StageStats(name, items, seconds, items / seconds if seconds > 0 else float('inf'))
+
+def _log_stage(stage):
+	logger.info("Stage '%s': %s items in %.3fs (%.1f items/s)", stage.name, stage.items, stage.seconds, stage.throughput)
@@ -0,0 +1,160 @@
+"""
+Event retention for :class:`due.episode.LiveEpisode` objects. Long-lived
+Episodes (eg. bot-to-bot conversations, or support chats that stay open for
+days) can accumulate tens of thousands of Events: a retention policy bounds the
+number of Events that are kept in memory, and spills the older ones to a local
+file.
+
+.. code-block:: python
+
+	from due.episode import LiveEpisode
+	from due.retention import RetentionPolicy
+
+	episode = LiveEpisode(human, agent, retention=RetentionPolicy(window=1000))
+
+Spilled Events are still part of the Episode: they are read back from disk when
+the Episode is iterated (eg. when it's saved or learned), or when they are
+accessed by index.
+
+API
+===
+"""
+import json
+import os
+import tempfile
+import threading
+from array import array
+from collections import deque, namedtuple
+
+from due.event import Event
+
+RetentionPolicy = namedtuple('RetentionPolicy', ['window', 'spill_dir'], defaults=[None, None])
+RetentionPolicy.__doc__ = """
+A retention policy for the Events of a LiveEpisode.
+
+:param window: number of most recent Events to keep in memory. If `None` (default), all of them are kept
+:type window: `int`
+:param spill_dir: directory of the spill file. If `None`, the system default temporary directory is used
+:type spill_dir: `str`
+"""
+
+class RetainedEvents(object):
+	"""
+	A list-like, append-only sequence of Events that keeps at most `window`
+	Events in memory, and writes the older ones to a spill file (one JSON line
+	per Event). It also keeps a pointer to the last Event of each type, so that
+	:meth:`last` is O(1).
+
+	The spill file is anonymous, and it's deleted when the sequence is garbage
+	collected.
+
+	:param policy: the retention policy
+	:type policy: :class:`RetentionPolicy`
+	"""
+
+	def __init__(self, policy=None):
+		self.policy = policy if policy is not None else RetentionPolicy()
+		self._memory = deque()
+		self._last = {}
+		self._count = 0
+		self._spill = None
+		self._spill_offsets = array('Q')
+		self._spill_end = 0
+		self._lock = threading.Lock()
+
+	def append(self, event):
+		"""
+		Append an Event, spilling the oldest in-memory Event if the window is
+		full.
+
+		:param event: the new Event
+		:type event: :class:`due.event.Event`
+		"""
+		with self._lock:
+			self._memory.append(event)
+			self._last[event.type] = (self._count, event)
+			self._count += 1
+			window = self.policy.window
+			if window is not None and len(self._memory) > window:
+				self._spill_event(self._memory.popleft())
+
+	def extend(self, events):
+		"""
+		Append a sequence of Events.
+
+		:param events: the Events to append
+		:type events: iterable of :class:`due.event.Event`
+		"""
+		for e in events:
+			self.append(e)
+
+	def last(self, event_type=None):
+		"""
+		Return the last Event, optionally filtered by type, in constant time.
+
+		:param event_type: an event type, or a collection of types
+		:type event_type: :class:`Event.Type` or list of :class:`Event.Type`
+		:return: the last Event of the given type(s), or `None`
+		:rtype: :class:`due.event.Event`
+		"""
+		if event_type is None:
+			return self[-1] if self._count else None
+
+		event_type = event_type if not isinstance(event_type, Event.Type) else (event_type,)
+		candidates = [self._last[t] for t in event_type if t in self._last]
+		return max(candidates, key=lambda x: x[0])[1] if candidates else None
+
+	@property
+	def spilled(self):
+		"""
+		Number of Events that were spilled to disk
+		"""
+		return len(self._spill_offsets)
+
+	def __len__(self):
+		return self._count
+
+	def __iter__(self):
+		i = 0
+		while i < self._count:
+			yield self[i]
+			i += 1
+
+	def __getitem__(self, index):
+		if isinstance(index, slice):
+			return [self[i] for i in range(*index.indices(self._count))]
+
+		if index < 0:
+			index += self._count
+		if not 0 <= index < self._count:
+			raise IndexError("event index out of range")
+
+		with self._lock:
+			spilled = len(self._spill_offsets)
+			if index >= spilled:
+				return self._memory[index - spilled]
+			return self._read_spilled(index)
+
+	def __eq__(self, other):
+		try:
+			return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+		except TypeError:
+			return NotImplemented
+
+	def __repr__(self):
+		return f"<RetainedEvents: {self._count} events, {self.spilled} spilled>"
+
+	def _spill_event(self, event):
+		if self._spill is None:
+			self._spill = tempfile.TemporaryFile(dir=self.policy.spill_dir)
+		data = (json.dumps(event.save()) + '\n').encode('utf-8')
+		self._spill.write(data)
+		self._spill_offsets.append(self._spill_end)
+		self._spill_end += len(data)
+
+	def _read_spilled(self, index):
+		self._spill.flush()
+		start = self._spill_offsets[index]
+		end = self._spill_offsets[index + 1] if index + 1 < len(self._spill_offsets) else self._spill_end
+		data = os.pread(self._spill.fileno(), end - start, start)
+		return Event.load(json.loads(data))
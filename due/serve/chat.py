@@ -0,0 +1,189 @@
+"""
+Serve a Due :class:`due.agent.Agent` to many users at once over a chat
+channel. This module is channel-agnostic: channel modules (eg.
+:mod:`due.serve.xmpp`) feed incoming messages to a :class:`ChatServer`,
+together with a function that sends a reply back to the user.
+
+Each user gets their own :class:`due.episode.LiveEpisode`, which is closed
+when the user leaves, or when it has been idle for too long (see
+:class:`due.session.SessionStore`). Messages are
+processed on a pool of worker threads: conversations with different users run
+in parallel, while the messages of each user are processed one at a time, in
+the order they were received.
+
+.. code-block:: python
+
+	from due.serve.chat import ChatServer
+
+	server = ChatServer(agent)
+	server.receive('alice@example.com', 'Hi!', reply_f=print)
+
+API
+===
+"""
+import time
+import logging
+from datetime import datetime
+
+from due.agent import Agent
+from due.episode import LiveEpisode
+from due.event import Event
+from due.models.dummy import DummyAgent
+from due.session import SessionStore, DEFAULT_IDLE_TIMEOUT
+from due.util import metrics
+from due.util.concurrency import KeyedExecutor
+
+DEFAULT_MAX_WORKERS = 8
+
+COMMAND_PREFIX = ',,,'
+LEAVE_COMMAND = ',,,leave'
+
+ACTIVE_EPISODES = metrics.REGISTRY.gauge('due_active_episodes', "Open LiveEpisodes of the served Agent", ['channel'])
+REPLY_LATENCY = metrics.REGISTRY.histogram('due_reply_latency_seconds', "Time from an incoming utterance to the Agent's replies", ['channel'])
+
+class ChatServer(Agent):
+	"""
+	Act as a proxy of an Agent in the LiveEpisodes of many chat users. The
+	users are modeled as :class:`due.models.dummy.DummyAgent` objects, whose ID
+	is the user ID on the channel (eg. a Jabber ID).
+
+	:param agent: the served Agent
+	:type agent: :class:`due.agent.Agent`
+	:param max_workers: maximum number of messages that are processed in parallel
+	:type max_workers: `int`
+	:param idle_timeout: close the Episodes of users that have been idle for this many seconds
+	:type idle_timeout: `float`
+	:param max_sessions: maximum number of open Episodes. When full, the least recently active one is closed
+	:type max_sessions: `int`
+	"""
+
+	channel = 'chat'
+
+	def __init__(self, agent, max_workers=DEFAULT_MAX_WORKERS, idle_timeout=DEFAULT_IDLE_TIMEOUT, max_sessions=None):
+		Agent.__init__(self, agent.id)
+		self._logger = logging.getLogger(__name__ + ".ChatServer")
+		self._agent = agent
+		self.action_executor = agent.action_executor
+		self._live_episodes = SessionStore(idle_timeout, max_sessions, on_evict=self._evict_episode)
+		ACTIVE_EPISODES.labels(channel=self.channel).set_function(self._live_episodes.__len__)
+		self._reply_latency = REPLY_LATENCY.labels(channel=self.channel)
+		self._reply_functions = {}
+		self._message_executor = KeyedExecutor(max_workers, thread_name_prefix='due-chat')
+
+	def receive(self, user_id, text, reply_f):
+		"""
+		Schedule an incoming message for processing. Messages from the same
+		user are processed in order. Replies to the message will be sent with
+		`reply_f`.
+
+		Messages starting with `,,,` are commands:
+
+		* `,,,leave`: closes the user's episode
+
+		:param user_id: the ID of the sender on the channel
+		:type user_id: `str`
+		:param text: the content of the message
+		:type text: `str`
+		:param reply_f: a function sending a text to the sender
+		:type reply_f: `callable`
+		:return: the Future of the message processing
+		:rtype: :class:`concurrent.futures.Future`
+		"""
+		return self._message_executor.submit(user_id, self._process_message, user_id, text, reply_f)
+
+	def live_episode(self, user_id):
+		"""
+		Return the current LiveEpisode of the given user, if any.
+
+		:param user_id: the ID of a user on the channel
+		:type user_id: `str`
+		:return: the user's LiveEpisode, or `None`
+		:rtype: :class:`due.episode.LiveEpisode`
+		"""
+		return self._live_episodes.get(user_id)
+
+	def stats(self):
+		"""
+		Return the session counts (see :meth:`due.session.SessionStore.stats`).
+
+		:return: session counts
+		:rtype: `dict`
+		"""
+		return self._live_episodes.stats()
+
+	def shutdown(self, wait=True):
+		"""
+		Stop processing messages.
+
+		:param wait: if `True`, wait until the pending messages are processed
+		:type wait: `bool`
+		"""
+		self._message_executor.shutdown(wait=wait)
+
+	def utterance_callback(self, episode):
+		"""See :meth:`due.agent.Agent.utterance_callback`"""
+		answers = self._agent.utterance_callback(episode)
+		self.act_events(answers, episode)
+
+	def act_events(self, events, episode):
+		"""
+		Act the given Events in the Episode, sending utterances to the user.
+		"""
+		for e in events:
+			if e.type == Event.Type.Action:
+				self.run_action(e)
+			elif e.type == Event.Type.Utterance:
+				self._logger.info("Sending reply to %s: %s", episode.starter_id, e)
+				self._reply_functions[episode.starter_id](e.payload)
+
+			episode.add_event(e)
+
+	def new_episode_callback(self, new_episode):
+		"""See :meth:`due.agent.Agent.new_episode_callback`"""
+		self._logger.info("New episode callback received: %s", new_episode)
+
+	def leave_callback(self, episode):
+		"""See :meth:`due.agent.Agent.leave_callback`"""
+		self._logger.info("Leave callback received: %s", episode)
+
+	def save(self):
+		raise NotImplementedError()
+
+	def learn_episodes(self, episodes):
+		raise NotImplementedError()
+
+	def action_callback(self, episode):
+		raise NotImplementedError()
+
+	def _process_message(self, user_id, text, reply_f):
+		self._reply_functions[user_id] = reply_f
+		if text.startswith(COMMAND_PREFIX):
+			self._handle_command(user_id, text, reply_f)
+			return
+
+		start = time.perf_counter()
+		live_episode = self._live_episodes.get(user_id)
+		if live_episode is None:
+			live_episode = LiveEpisode(DummyAgent(user_id), self)
+			self._live_episodes[user_id] = live_episode
+		live_episode.add_event(Event(Event.Type.Utterance, datetime.now(), user_id, text))
+		self._reply_latency.observe(time.perf_counter() - start)
+
+	def _handle_command(self, user_id, text, reply_f):
+		if text == LEAVE_COMMAND:
+			reply_f("[you left the episode]")
+			self._close_episode(user_id, self._live_episodes.pop(user_id))
+
+	def _evict_episode(self, user_id, live_episode, reason):
+		"""
+		Close an evicted Episode. This is queued after the pending messages of
+		the user, so that it never runs concurrently with them.
+		"""
+		self._logger.info("Closing %s episode of %s", reason, user_id)
+		self._message_executor.submit(user_id, self._close_episode, user_id, live_episode)
+
+	def _close_episode(self, user_id, live_episode):
+		if live_episode is not None:
+			live_episode.add_event(Event(Event.Type.Leave, datetime.now(), user_id, None))
+		if user_id not in self._live_episodes:
+			self._reply_functions.pop(user_id, None)
@@ -1,12 +1,15 @@
 """
 Serve a Due :class:`due.agent.Agent` through an interactive Command Line Interface (CLI)
 """
+import asyncio
+
 from prompt_toolkit.shortcuts import prompt
 from prompt_toolkit.styles import Style
 from prompt_toolkit import print_formatted_text, HTML
 
 from due.models.dummy import DummyAgent
 from due.episode import AsyncLiveEpisode
+from due.serve.reload import HotSwapAgent, AgentReloader, DEFAULT_WATCH_INTERVAL
 from due.util.capture_io import CaptureIO
 
 style = Style.from_dict({
@@ -34,16 +37,35 @@ class ConsoleLiveEpisode(AsyncLiveEpisode):
 
 		super().add_event(event)
 
-def serve(agent):
+def serve(agent, watch=None, watch_interval=DEFAULT_WATCH_INTERVAL):
 	"""
 	Serve an agent on a very basic terminal-based chat interface.
 
 	**NOTE** that Event handling is asynchronous. To prevent interferences with
 	user input, incoming logs are buffered and released at each conversation turn.
 
+	If `watch` is given, the agent is replaced whenever the saved agent at that
+	path changes (see :mod:`due.serve.reload`), without leaving the conversation.
+
 	:param agent: The Agent to serve
 	:type agent: :class:`due.Agent`
+	:param watch: the path of a saved Agent to reload
+	:type watch: `str`
+	:param watch_interval: how often to check the saved Agent, in seconds
+	:type watch_interval: `float`
 	"""
+	reloader = None
+	if watch is not None:
+		agent = HotSwapAgent(agent)
+		reloader = AgentReloader(agent, watch, watch_interval).start()
+	try:
+		asyncio.run(_serve(agent))
+	finally:
+		if reloader is not None:
+			reloader.stop()
+
+async def _serve(agent):
+	loop = asyncio.get_running_loop()
 	human = DummyAgent('human')
 
 	live_episode = human.start_episode(agent)
@@ -52,10 +74,12 @@ def serve(agent):
 
 	with CaptureIO(logging_only=True) as captured_logs:
 		while text != '!q':
+			await live_episode.join()
 			for line in captured_logs.flush():
 				print(line)
-			text = prompt(HTML(f'<human>{human.id} ></human> '), style=style)
+			text = await loop.run_in_executor(None, lambda: prompt(HTML(f'<human>{human.id} ></human> '), style=style))
 			human.say(text, live_episode)
+		await live_episode.join()
 
 	for line in captured_logs.flush():
 		print(line)
@@ -0,0 +1,407 @@
+"""
+Serve a Due :class:`due.agent.Agent` over a minimal HTTP/JSON interface, built
+on :mod:`asyncio`. This is meant to run on a local or internal network (eg.
+behind a reverse proxy), and it has no external dependencies.
+
+Each client session is identified by a session ID of the client's choice, and
+gets its own :class:`due.episode.LiveEpisode`, which is closed when the client
+leaves, or when it has been idle for too long (see
+:class:`due.session.SessionStore`). Utterances that arrive within a
+short time window, from different sessions, are collected in a **batch** and
+passed to the Agent in a single call to
+:meth:`due.agent.Agent.batch_utterance_callback`, which some Agents (eg.
+:class:`due.models.tfidf.TfIdfAgent`) implement with a single inference on the
+whole batch. Batches are closed when they reach `max_batch_size` utterances, or
+`max_wait` seconds after their first utterance.
+
+.. code-block:: python
+
+	from due.serve import http
+	http.serve(agent, port=8080, max_batch_size=64, max_wait=0.005)
+
+Endpoints:
+
+* `POST /sessions/<session_id>/utterances`: act an utterance in the session.
+  The request body is a JSON object like `{"text": "Hi!"}`; the response body
+  contains the agent's answers, like `{"answers": ["Hello"]}`
+* `POST /sessions/<session_id>/leave`: close the session
+* `GET /stats`: serving statistics (see :meth:`HttpServer.stats`)
+* `GET /metrics`: the metrics of the process, in the Prometheus text format
+  (see :mod:`due.util.metrics`)
+
+API
+===
+"""
+import json
+import time
+import asyncio
+import logging
+import contextlib
+from datetime import datetime
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from due.agent import Agent
+from due.episode import LiveEpisode
+from due.event import Event
+from due.models.dummy import DummyAgent
+from due.session import SessionStore, DEFAULT_IDLE_TIMEOUT
+from due.serve.chat import ACTIVE_EPISODES, REPLY_LATENCY
+from due.serve.protocol import read_request, write_response
+from due.util import metrics
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8080
+DEFAULT_MAX_BATCH_SIZE = 32
+DEFAULT_MAX_WAIT = 0.005
+LATENCY_SAMPLES = 10000
+DEFAULT_DRAIN_TIMEOUT = 10.
+
+_REQUESTS = metrics.REGISTRY.counter('due_http_requests_total', "HTTP requests served", ['status'])
+
+class MicroBatcher(object):
+	"""
+	Collect items submitted by concurrent coroutines in batches, and process
+	each batch with a single call to `batch_f`. The batch function runs on a
+	dedicated thread, so that the event loop keeps accepting requests in the
+	meantime; batches are processed one at a time, in order.
+
+	:param batch_f: a function taking a list of items, and returning a list of results of the same length
+	:type batch_f: `callable`
+	:param max_batch_size: maximum number of items in a batch
+	:type max_batch_size: `int`
+	:param max_wait: maximum time (in seconds) a batch waits for more items after its first one
+	:type max_wait: `float`
+	"""
+
+	def __init__(self, batch_f, max_batch_size=DEFAULT_MAX_BATCH_SIZE, max_wait=DEFAULT_MAX_WAIT):
+		if max_batch_size < 1:
+			raise ValueError("Batch size must be positive")
+		self.batch_f = batch_f
+		self.max_batch_size = max_batch_size
+		self.max_wait = max_wait
+		self.batches = 0
+		self.items = 0
+		self._pending = []
+		self._flush_handle = None
+		self._tasks = set()
+		self._executor = ThreadPoolExecutor(1, thread_name_prefix='due-batch')
+
+	async def submit(self, item):
+		"""
+		Add an item to the current batch, and wait for its result.
+
+		:param item: an item to process
+		:return: the result of the item
+		"""
+		loop = asyncio.get_running_loop()
+		future = loop.create_future()
+		self._pending.append((item, future))
+		if len(self._pending) >= self.max_batch_size:
+			self._flush()
+		elif self._flush_handle is None:
+			self._flush_handle = loop.call_later(self.max_wait, self._flush)
+		return await future
+
+	def close(self):
+		"""
+		Release the batch processing thread.
+		"""
+		self._executor.shutdown(wait=True)
+
+	def _flush(self):
+		if self._flush_handle is not None:
+			self._flush_handle.cancel()
+			self._flush_handle = None
+		batch, self._pending = self._pending, []
+		if batch:
+			task = asyncio.ensure_future(self._process(batch))
+			self._tasks.add(task)
+			task.add_done_callback(self._tasks.discard)
+
+	async def _process(self, batch):
+		items = [item for item, _ in batch]
+		self.batches += 1
+		self.items += len(items)
+		try:
+			results = await asyncio.get_running_loop().run_in_executor(self._executor, self.batch_f, items)
+		except Exception as e:
+			for _, future in batch:
+				if not future.done():
+					future.set_exception(e)
+			return
+
+		for (_, future), result in zip(batch, results):
+			if not future.done():
+				future.set_result(result)
+
+class HttpServer(Agent):
+	"""
+	Serve an Agent on HTTP. The server acts as a proxy of the Agent in the
+	LiveEpisodes of the client sessions, whose human participants are modeled
+	as :class:`due.models.dummy.DummyAgent` objects.
+
+	:param agent: the served Agent
+	:type agent: :class:`due.agent.Agent`
+	:param host: the address to listen on
+	:type host: `str`
+	:param port: the port to listen on (0 picks a free one)
+	:type port: `int`
+	:param max_batch_size: maximum number of utterances in an inference batch
+	:type max_batch_size: `int`
+	:param max_wait: maximum time (in seconds) an utterance waits for a batch to fill
+	:type max_wait: `float`
+	:param idle_timeout: close sessions that have been idle for this many seconds
+	:type idle_timeout: `float`
+	:param max_sessions: maximum number of open sessions. When full, the least recently active one that isn't serving a request is closed
+	:type max_sessions: `int`
+	"""
+
+	channel = 'http'
+
+	def __init__(self, agent, host=DEFAULT_HOST, port=DEFAULT_PORT, max_batch_size=DEFAULT_MAX_BATCH_SIZE, max_wait=DEFAULT_MAX_WAIT, idle_timeout=DEFAULT_IDLE_TIMEOUT, max_sessions=None):
+		Agent.__init__(self, agent.id)
+		self._logger = logging.getLogger(__name__ + ".HttpServer")
+		self._agent = agent
+		self.action_executor = agent.action_executor
+		self.host = host
+		self.port = port
+		self._batcher = MicroBatcher(self._agent.batch_utterance_callback, max_batch_size, max_wait)
+		self._live_episodes = SessionStore(idle_timeout, max_sessions, on_evict=self._evict_session, can_evict=self._is_session_idle)
+		ACTIVE_EPISODES.labels(channel=self.channel).set_function(self._live_episodes.__len__)
+		self._reply_latency = REPLY_LATENCY.labels(channel=self.channel)
+		self._session_locks = {}  # Session ID -> (lock, number of requests using it)
+		self._server = None
+
+		self._start_time = None
+		self._requests = 0
+		self._errors = 0
+		self._in_flight = 0
+		self._latencies = deque(maxlen=LATENCY_SAMPLES)
+
+	async def start(self):
+		"""
+		Start listening for connections. If the server was created with
+		`port=0`, the `port` attribute is updated with the actual port.
+		"""
+		self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+		self.port = self._server.sockets[0].getsockname()[1]
+		self._start_time = time.monotonic()
+		self._logger.info("Serving on http://%s:%s", self.host, self.port)
+
+	async def stop(self, timeout=DEFAULT_DRAIN_TIMEOUT):
+		"""
+		Stop listening, wait for the requests in progress to be served, and
+		release the inference thread.
+
+		:param timeout: maximum time (in seconds) to wait for the requests in progress
+		:type timeout: `float`
+		"""
+		if self._server is not None:
+			self._server.close()
+			await self._server.wait_closed()
+			self._server = None
+
+		deadline = time.monotonic() + timeout
+		while self._in_flight and time.monotonic() < deadline:
+			await asyncio.sleep(0.01)
+		if self._in_flight:
+			self._logger.warning("Stopping with %s requests in progress", self._in_flight)
+		self._batcher.close()
+
+	async def serve_forever(self):
+		"""
+		Start the server (if needed), and serve until cancelled.
+		"""
+		if self._server is None:
+			await self.start()
+		async with self._server:
+			await self._server.serve_forever()
+
+	async def utterance(self, session_id, text):
+		"""
+		Act an utterance in the given session, and return the Agent's answers.
+		Utterances of the same session are processed in order.
+
+		:param session_id: the ID of a client session
+		:type session_id: `str`
+		:param text: the utterance
+		:type text: `str`
+		:return: the Agent's answers
+		:rtype: `list` of `str`
+		"""
+		async with self._session_lock(session_id):
+			start = time.perf_counter()
+			live_episode = self._live_episodes.get(session_id)
+			if live_episode is None:
+				live_episode = LiveEpisode(DummyAgent(session_id), self)
+				self._live_episodes[session_id] = live_episode
+			live_episode.add_event(Event(Event.Type.Utterance, datetime.now(), session_id, text))
+
+			answers = await self._batcher.submit(live_episode)
+			self.act_events(answers, live_episode)
+			self._reply_latency.observe(time.perf_counter() - start)
+			return [e.payload for e in answers if e.type == Event.Type.Utterance]
+
+	async def leave(self, session_id):
+		"""
+		Close the given session.
+
+		:param session_id: the ID of a client session
+		:type session_id: `str`
+		:return: `True` if the session existed
+		:rtype: `bool`
+		"""
+		async with self._session_lock(session_id):
+			live_episode = self._live_episodes.pop(session_id)
+			if live_episode is None:
+				return False
+			live_episode.add_event(Event(Event.Type.Leave, datetime.now(), session_id, None))
+			return True
+
+	def stats(self):
+		"""
+		Return serving statistics:
+
+		* `requests`, `errors`: number of HTTP requests served, and failed
+		* `sessions`, `created`, `closed`, `evicted_idle`, `evicted_capacity`: session counts (see :meth:`due.session.SessionStore.stats`)
+		* `throughput`: requests per second, since the server started
+		* `latency_p50`, `latency_p95`, `latency_p99`: request latency percentiles (seconds), over the most recent requests
+		* `batches`, `mean_batch_size`: number of inference batches, and their average size
+
+		:return: serving statistics
+		:rtype: `dict`
+		"""
+		uptime = time.monotonic() - self._start_time if self._start_time is not None else 0
+		latencies = np.array(self._latencies) if self._latencies else np.zeros(1)
+		p50, p95, p99 = np.percentile(latencies, [50, 95, 99]).tolist()
+		return {
+			'requests': self._requests,
+			'errors': self._errors,
+			**self._live_episodes.stats(),
+			'throughput': self._requests / uptime if uptime > 0 else 0.,
+			'latency_p50': p50,
+			'latency_p95': p95,
+			'latency_p99': p99,
+			'batches': self._batcher.batches,
+			'mean_batch_size': self._batcher.items / self._batcher.batches if self._batcher.batches else 0.,
+		}
+
+	def utterance_callback(self, episode):
+		"""Utterances are answered in batches: see :meth:`utterance`."""
+		return []
+
+	def new_episode_callback(self, new_episode):
+		"""See :meth:`due.agent.Agent.new_episode_callback`"""
+		self._logger.debug("New episode callback received: %s", new_episode)
+
+	def leave_callback(self, episode):
+		"""See :meth:`due.agent.Agent.leave_callback`"""
+		self._logger.debug("Leave callback received: %s", episode)
+
+	def save(self):
+		raise NotImplementedError()
+
+	def learn_episodes(self, episodes):
+		raise NotImplementedError()
+
+	def action_callback(self, episode):
+		raise NotImplementedError()
+
+	def _evict_session(self, session_id, live_episode, reason):
+		self._logger.info("Closing %s session %s", reason, session_id)
+		live_episode.add_event(Event(Event.Type.Leave, datetime.now(), session_id, None))
+
+	def _is_session_idle(self, session_id, live_episode):
+		"""Sessions that are serving (or waiting to serve) a request are never evicted."""
+		return session_id not in self._session_locks
+
+	@contextlib.asynccontextmanager
+	async def _session_lock(self, session_id):
+		"""
+		Serialize the requests of a session. The lock is dropped once no
+		request is using it, so that a request never waits on a lock that
+		other requests don't see.
+		"""
+		lock, users = self._session_locks.get(session_id, (None, 0))
+		if lock is None:
+			lock = asyncio.Lock()
+		self._session_locks[session_id] = (lock, users + 1)
+		try:
+			async with lock:
+				yield
+		finally:
+			lock, users = self._session_locks[session_id]
+			if users == 1:
+				del self._session_locks[session_id]
+			else:
+				self._session_locks[session_id] = (lock, users - 1)
+
+	async def _handle_connection(self, reader, writer):
+		try:
+			while True:
+				request = await read_request(reader)
+				if request is None:
+					break
+				method, path, headers, body = request
+				start = time.monotonic()
+				self._in_flight += 1
+				try:
+					status, response = await self._dispatch(method, path, body)
+				finally:
+					self._in_flight -= 1
+				self._requests += 1
+				self._errors += status >= 400
+				_REQUESTS.labels(status=status).inc()
+				self._latencies.append(time.monotonic() - start)
+
+				keep_alive = headers.get('connection', '').lower() != 'close'
+				write_response(writer, status, response, keep_alive)
+				await writer.drain()
+				if not keep_alive:
+					break
+		except (ConnectionError, asyncio.IncompleteReadError):
+			pass
+		except ValueError as e:
+			self._logger.warning("Bad request: %s", e)
+			write_response(writer, 400, {'error': str(e)}, False)
+		finally:
+			writer.close()
+
+	async def _dispatch(self, method, path, body):
+		parts = path.strip('/').split('/')
+		try:
+			if method == 'GET' and parts == ['stats']:
+				return 200, self.stats()
+			if method == 'GET' and parts == ['metrics']:
+				return 200, metrics.REGISTRY.render()
+			if method == 'POST' and len(parts) == 3 and parts[0] == 'sessions':
+				if parts[2] == 'utterances':
+					text = json.loads(body)['text']
+					return 200, {'answers': await self.utterance(parts[1], text)}
+				if parts[2] == 'leave':
+					found = await self.leave(parts[1])
+					return (200, {}) if found else (404, {'error': 'Session not found'})
+		except (ValueError, KeyError, TypeError) as e:
+			return 400, {'error': 'Invalid request: %s' % e}
+		except Exception as e:
+			self._logger.exception("Error serving %s %s", method, path)
+			return 500, {'error': str(e)}
+		return 404, {'error': 'Not found'}
+
+def serve(agent, host=DEFAULT_HOST, port=DEFAULT_PORT, max_batch_size=DEFAULT_MAX_BATCH_SIZE, max_wait=DEFAULT_MAX_WAIT, idle_timeout=DEFAULT_IDLE_TIMEOUT, max_sessions=None):
+	"""
+	Serve an Agent on HTTP, until the process is interrupted. See
+	:class:`HttpServer` for an explanation of the parameters.
+
+	:param agent: The Agent to serve
+	:type agent: :class:`due.agent.Agent`
+	"""
+	metrics.set_default_labels(agent_class=type(agent).__name__, channel=HttpServer.channel)
+	server = HttpServer(agent, host, port, max_batch_size, max_wait, idle_timeout, max_sessions)
+	try:
+		asyncio.run(server.serve_forever())
+	except KeyboardInterrupt:
+		pass
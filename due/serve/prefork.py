@@ -0,0 +1,369 @@
+"""
+Serve a Due :class:`due.agent.Agent` on HTTP with many worker processes that
+share a single copy of the model.
+
+The Agent is loaded once, in the parent process. The parent then **forks** N
+workers, each running a :class:`due.serve.http.HttpServer` on a local port: as
+forked processes share their memory pages with the parent until they write to
+them (*copy-on-write*), the read-only parts of the model (eg. the tf-idf
+matrix of a :class:`due.models.tfidf.TfIdfAgent`) are stored in memory only
+once. Before forking, the parent calls :func:`gc.freeze`, so that the garbage
+collector of the workers doesn't touch (and copy) the pages of the objects
+that were loaded in the parent.
+
+The parent listens on the public port, and proxies each request to a worker.
+Requests of the same session always go to the same worker (**session
+affinity**), as the session's LiveEpisode lives in the worker's memory.
+
+.. code-block:: python
+
+	from due.serve import prefork
+	prefork.serve(agent, n_workers=8, port=8080)
+
+Workers that die are replaced. Sending `SIGHUP` to the parent restarts the
+workers **gracefully**, one at a time: a new worker is started before the old
+one is asked to stop, and the old one serves the requests in progress before
+exiting. Note that restarted workers lose their open sessions, whose next
+utterances will start new Episodes.
+
+`GET /metrics` on the parent collects the metrics of all the workers (see
+:mod:`due.util.metrics`), each labeled with the worker's `worker` PID.
+
+Agents that learn while serving (eg. a TfIdfAgent learning the Episodes that
+are left) write to their memory, so each worker will end up with its own copy
+of the pages that were changed.
+
+API
+===
+"""
+import os
+import gc
+import sys
+import zlib
+import select
+import signal
+import asyncio
+import logging
+from collections import namedtuple
+
+from due.serve.http import HttpServer, DEFAULT_HOST, DEFAULT_PORT
+from due.serve.protocol import read_request, read_response, write_response
+from due.util import metrics
+
+DEFAULT_WORKER_START_TIMEOUT = 30.
+WORKER_HOST = '127.0.0.1'
+MONITOR_INTERVAL = 1.
+
+_Worker = namedtuple('_Worker', ['pid', 'port'])
+
+class PreforkServer(object):
+	"""
+	A pre-forking HTTP server. See the module documentation for details.
+
+	:param agent: the served Agent
+	:type agent: :class:`due.agent.Agent`
+	:param n_workers: number of worker processes (defaults to the number of CPUs)
+	:type n_workers: `int`
+	:param host: the address to listen on
+	:type host: `str`
+	:param port: the port to listen on (0 picks a free one)
+	:type port: `int`
+	:param http_options: more keyword arguments for the workers' :class:`due.serve.http.HttpServer`
+	"""
+
+	def __init__(self, agent, n_workers=None, host=DEFAULT_HOST, port=DEFAULT_PORT, **http_options):
+		self._logger = logging.getLogger(__name__ + ".PreforkServer")
+		self._agent = agent
+		self.n_workers = n_workers if n_workers else os.cpu_count()
+		self.host = host
+		self.port = port
+		self._http_options = http_options
+		self._workers = []
+		self._connections = {}
+		self._server = None
+		self._monitor_task = None
+		self._restarting = False
+		self._round_robin = 0
+
+	@property
+	def worker_pids(self):
+		"""
+		The process IDs of the current workers
+		"""
+		return [w.pid for w in self._workers]
+
+	async def start(self):
+		"""
+		Fork the workers, and start listening on the public port. If the
+		server was created with `port=0`, the `port` attribute is updated with
+		the actual port.
+		"""
+		gc.collect()
+		gc.freeze()
+		loop = asyncio.get_running_loop()
+		try:
+			for i in range(self.n_workers):
+				self._workers.append(await loop.run_in_executor(None, self._spawn_worker))
+		except Exception:
+			await self.stop()
+			raise
+
+		self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+		self.port = self._server.sockets[0].getsockname()[1]
+		self._monitor_task = asyncio.ensure_future(self._monitor())
+		self._logger.info("Serving on http://%s:%s with %s workers", self.host, self.port, self.n_workers)
+
+	async def restart(self):
+		"""
+		Restart the workers gracefully, one at a time.
+		"""
+		if self._restarting:
+			return
+		self._restarting = True
+		try:
+			loop = asyncio.get_running_loop()
+			for i in range(len(self._workers)):
+				new_worker = await loop.run_in_executor(None, self._spawn_worker)
+				old_worker, self._workers[i] = self._workers[i], new_worker
+				await self._stop_worker(old_worker)
+			self._logger.info("Restarted %s workers", len(self._workers))
+		finally:
+			self._restarting = False
+
+	async def stop(self):
+		"""
+		Stop listening, and stop the workers gracefully.
+		"""
+		if self._monitor_task is not None:
+			self._monitor_task.cancel()
+			self._monitor_task = None
+		if self._server is not None:
+			self._server.close()
+			await self._server.wait_closed()
+			self._server = None
+		workers, self._workers = self._workers, []
+		await asyncio.gather(*[self._stop_worker(w) for w in workers])
+		gc.unfreeze()
+
+	async def serve_forever(self):
+		"""
+		Start the server, and serve until `SIGINT` or `SIGTERM` are received.
+		`SIGHUP` restarts the workers.
+		"""
+		loop = asyncio.get_running_loop()
+		stopped = loop.create_future()
+		loop.add_signal_handler(signal.SIGHUP, lambda: asyncio.ensure_future(self.restart()))
+		for s in (signal.SIGINT, signal.SIGTERM):
+			loop.add_signal_handler(s, lambda: stopped.done() or stopped.set_result(None))
+
+		await self.start()
+		try:
+			await stopped
+		finally:
+			await self.stop()
+
+	def worker_index(self, session_id):
+		"""
+		Return the index of the worker that serves the given session.
+
+		:param session_id: the ID of a client session
+		:type session_id: `str`
+		:return: a worker index
+		:rtype: `int`
+		"""
+		return zlib.crc32(session_id.encode('utf-8')) % len(self._workers)
+
+	#
+	# Workers
+	#
+
+	def _spawn_worker(self):
+		"""
+		Fork a worker, and wait until it's ready. This runs in a thread of
+		the executor, as the child process must not inherit the running event
+		loop.
+		"""
+		read_fd, write_fd = os.pipe()
+		pid = os.fork()
+		if pid == 0:
+			os.close(read_fd)
+			self._run_worker(write_fd)
+
+		os.close(write_fd)
+		with os.fdopen(read_fd, 'r') as f:
+			ready, _, _ = select.select([f], [], [], DEFAULT_WORKER_START_TIMEOUT)
+			line = f.readline() if ready else ''
+		if not line:
+			_kill(pid)
+			raise RuntimeError("Worker %s failed to start" % pid)
+
+		worker = _Worker(pid, int(line))
+		self._logger.info("Started worker %s on port %s", worker.pid, worker.port)
+		return worker
+
+	def _run_worker(self, write_fd):
+		"""Run a worker in the child process. This never returns."""
+		exit_code = 1
+		try:
+			if self._server is not None:
+				for s in self._server.sockets:
+					os.close(s.fileno())
+			for s in (signal.SIGHUP, signal.SIGINT, signal.SIGTERM):
+				signal.signal(s, signal.SIG_DFL)
+			asyncio.run(self._serve_worker(write_fd))
+			exit_code = 0
+		except BaseException:
+			self._logger.exception("Worker %s failed", os.getpid())
+		finally:
+			sys.stdout.flush()
+			sys.stderr.flush()
+			os._exit(exit_code)
+
+	async def _serve_worker(self, write_fd):
+		server = HttpServer(self._agent, WORKER_HOST, 0, **self._http_options)
+		metrics.set_default_labels(agent_class=type(self._agent).__name__, channel=HttpServer.channel, worker=os.getpid())
+		loop = asyncio.get_running_loop()
+		stopped = loop.create_future()
+		loop.add_signal_handler(signal.SIGTERM, lambda: stopped.done() or stopped.set_result(None))
+
+		await server.start()
+		with os.fdopen(write_fd, 'w') as f:
+			f.write('%s\n' % server.port)
+		await stopped
+		await server.stop()
+
+	async def _stop_worker(self, worker):
+		for reader, writer in self._connections.pop(worker.pid, []):
+			writer.close()
+		_kill(worker.pid, signal.SIGTERM)
+		while not _reap(worker.pid):
+			await asyncio.sleep(0.01)
+		self._logger.info("Stopped worker %s", worker.pid)
+
+	async def _monitor(self):
+		"""Replace the workers that died."""
+		loop = asyncio.get_running_loop()
+		while True:
+			await asyncio.sleep(MONITOR_INTERVAL)
+			if self._restarting:
+				continue
+			for i, worker in enumerate(list(self._workers)):
+				if _reap(worker.pid):
+					self._logger.warning("Worker %s died, replacing it", worker.pid)
+					self._connections.pop(worker.pid, None)
+					self._workers[i] = await loop.run_in_executor(None, self._spawn_worker)
+
+	#
+	# Proxy
+	#
+
+	async def _handle_connection(self, reader, writer):
+		try:
+			while True:
+				request = await read_request(reader)
+				if request is None:
+					break
+				method, path, headers, body = request
+				if method == 'GET' and path.strip('/') == 'stats':
+					status, response = 200, await self._stats()
+				elif method == 'GET' and path.strip('/') == 'metrics':
+					status, response = 200, await self._metrics()
+				else:
+					status, response = await self._forward(self._route(path), method, path, body)
+
+				keep_alive = headers.get('connection', '').lower() != 'close'
+				write_response(writer, status, response, keep_alive)
+				await writer.drain()
+				if not keep_alive:
+					break
+		except (ConnectionError, asyncio.IncompleteReadError):
+			pass
+		except ValueError as e:
+			write_response(writer, 400, {'error': str(e)}, False)
+		finally:
+			writer.close()
+
+	def _route(self, path):
+		parts = path.strip('/').split('/')
+		if len(parts) >= 2 and parts[0] == 'sessions':
+			return self._workers[self.worker_index(parts[1])]
+		self._round_robin = (self._round_robin + 1) % len(self._workers)
+		return self._workers[self._round_robin]
+
+	async def _forward(self, worker, method, path, body):
+		"""
+		Send a request to a worker over a pooled keep-alive connection, and
+		return its status and JSON response. A request that fails on a reused
+		connection (eg. one that the worker closed) is retried on a new one.
+		"""
+		pool = self._connections.setdefault(worker.pid, [])
+		request = (
+			f"{method} {path} HTTP/1.1\r\n"
+			f"Host: {WORKER_HOST}\r\n"
+			f"Content-Length: {len(body)}\r\n\r\n"
+		).encode('latin-1') + body
+
+		for attempt in range(2):
+			if pool and attempt == 0:
+				reader, writer = pool.pop()
+			else:
+				reader, writer = await asyncio.open_connection(WORKER_HOST, worker.port)
+			try:
+				writer.write(request)
+				await writer.drain()
+				status, keep_alive, response = await read_response(reader)
+			except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+				writer.close()
+				if attempt == 1:
+					return 502, {'error': 'Worker unavailable'}
+				continue
+
+			if keep_alive and self._connections.get(worker.pid) is pool:
+				pool.append((reader, writer))
+			else:
+				writer.close()
+			return status, response
+
+	async def _stats(self):
+		result = []
+		for worker in list(self._workers):
+			status, stats = await self._forward(worker, 'GET', '/stats', b'')
+			result.append({'pid': worker.pid, **stats} if status == 200 else {'pid': worker.pid, 'error': stats})
+		return {'workers': result}
+
+	async def _metrics(self):
+		texts = []
+		for worker in list(self._workers):
+			status, text = await self._forward(worker, 'GET', '/metrics', b'')
+			if status == 200:
+				texts.append(text)
+		return metrics.merge(texts)
+
+def serve(agent, n_workers=None, host=DEFAULT_HOST, port=DEFAULT_PORT, **http_options):
+	"""
+	Serve an Agent on HTTP with a pool of pre-forked workers, until the process
+	is interrupted. See :class:`PreforkServer` for an explanation of the
+	parameters.
+
+	:param agent: The Agent to serve
+	:type agent: :class:`due.agent.Agent`
+	"""
+	server = PreforkServer(agent, n_workers, host, port, **http_options)
+	asyncio.run(server.serve_forever())
+
+#
+# Helpers
+#
+
+def _kill(pid, sig=signal.SIGKILL):
+	try:
+		os.kill(pid, sig)
+	except ProcessLookupError:
+		pass
+
+def _reap(pid):
+	"""Return `True` if the given child process has exited."""
+	try:
+		return os.waitpid(pid, os.WNOHANG)[0] == pid
+	except ChildProcessError:
+		return True
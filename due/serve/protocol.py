@@ -0,0 +1,110 @@
+"""
+The HTTP/1.1 framing used by :mod:`due.serve.http`, :mod:`due.serve.prefork`
+and :mod:`due.loadtest`, on top of :mod:`asyncio` streams. This only covers
+what those modules need: requests and responses with a `Content-Length`,
+JSON bodies (or text bodies, for the metrics endpoints), and keep-alive
+connections.
+
+.. code-block:: python
+
+	from due.serve import protocol
+
+	method, path, headers, body = await protocol.read_request(reader)
+	protocol.write_response(writer, 200, {'answers': ['Hello']}, keep_alive=True)
+
+API
+===
+"""
+import json
+
+from due.util import metrics
+
+MAX_BODY_SIZE = 1024 * 1024
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 500: 'Internal Server Error'}
+
+async def read_request(reader):
+	"""
+	Read an HTTP/1.1 request.
+
+	:param reader: the stream of the connection
+	:type reader: :class:`asyncio.StreamReader`
+	:return: `(method, path, headers, body)`, or `None` if the connection was closed. Header names are lowercase
+	:rtype: `tuple`
+	"""
+	request_line = await reader.readline()
+	if not request_line.strip():
+		return None
+	try:
+		method, path, _ = request_line.decode('latin-1').split()
+	except ValueError:
+		raise ValueError("Malformed request line")
+
+	headers = await _read_headers(reader)
+
+	length = int(headers.get('content-length', 0))
+	if length > MAX_BODY_SIZE:
+		raise ValueError("Request body too large")
+	body = await reader.readexactly(length) if length else b''
+	return method, path, headers, body
+
+async def read_response(reader):
+	"""
+	Read an HTTP response.
+
+	:param reader: the stream of the connection
+	:type reader: :class:`asyncio.StreamReader`
+	:return: `(status, keep_alive, body)`, where `body` is the decoded JSON content (or the text, for text responses)
+	:rtype: `tuple`
+	"""
+	status_line = await reader.readline()
+	if not status_line:
+		raise ConnectionError("Connection closed by server")
+	status = int(status_line.split()[1])
+
+	headers = await _read_headers(reader)
+
+	body = await reader.readexactly(int(headers.get('content-length', 0)))
+	keep_alive = headers.get('connection', '').lower() != 'close'
+	if headers.get('content-type', '').startswith('text/plain'):
+		return status, keep_alive, body.decode('utf-8')
+	return status, keep_alive, json.loads(body) if body else {}
+
+def write_response(writer, status, body, keep_alive):
+	"""
+	Write an HTTP response. `str` bodies are sent as text (in the Prometheus
+	text format, see :mod:`due.util.metrics`), other bodies as JSON.
+
+	:param writer: the stream of the connection
+	:type writer: :class:`asyncio.StreamWriter`
+	:param status: the HTTP status code
+	:type status: `int`
+	:param body: the response body
+	:type body: `str` or a JSON-serializable object
+	:param keep_alive: whether the connection stays open after the response
+	:type keep_alive: `bool`
+	"""
+	if isinstance(body, str):
+		data, content_type = body.encode('utf-8'), metrics.CONTENT_TYPE
+	else:
+		data, content_type = json.dumps(body).encode('utf-8'), 'application/json'
+	head = (
+		f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+		f"Content-Type: {content_type}\r\n"
+		f"Content-Length: {len(data)}\r\n"
+		f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+	)
+	writer.write(head.encode('latin-1') + data)
+
+#
+# Helpers
+#
+
+async def _read_headers(reader):
+	headers = {}
+	while True:
+		line = await reader.readline()
+		if line in (b'\r\n', b'\n', b''):
+			return headers
+		name, _, value = line.decode('latin-1').partition(':')
+		headers[name.strip().lower()] = value.strip()
@@ -0,0 +1,332 @@
+"""
+Deploy a new version of a served Agent without restarting the server, and
+without dropping the open conversations.
+
+Serving channels serve a :class:`HotSwapAgent`, which is a proxy of the actual
+Agent. Calling :meth:`HotSwapAgent.swap` (or :meth:`HotSwapAgent.load`, from a
+saved Agent file) warms up the new Agent, and then switches to it with an
+atomic reference swap: the turns that are running when the swap happens are
+completed by the old Agent, and the following ones are answered by the new
+one. The old Agent is closed once its last turn is completed. LiveEpisodes are not touched, so they keep their history.
+
+An :class:`AgentReloader` watches a saved Agent file, and loads it in the
+background whenever it changes. This is what the `watch` parameter of
+:func:`due.serve.console.serve` and :func:`due.serve.xmpp.serve` does:
+
+.. code-block:: python
+
+	from due.serve.reload import HotSwapAgent, AgentReloader
+
+	agent = HotSwapAgent(Agent.load(deserialize('agent.yaml')))
+	reloader = AgentReloader(agent, 'agent.yaml').start()
+	...
+	reloader.stop()
+
+New files should be written atomically (eg. serialized to a temporary file,
+which is then renamed), so that the reloader never reads a partial file. A file
+that fails to load is logged, and retried when it changes again.
+
+API
+===
+"""
+import gc
+import os
+import time
+import logging
+import resource
+import threading
+import contextlib
+from datetime import datetime
+from collections import namedtuple
+
+from due.agent import Agent
+from due.episode import Episode
+from due.event import Event
+from due.persistence import deserialize
+from due.session import SessionStore, DEFAULT_IDLE_TIMEOUT
+
+DEFAULT_WATCH_INTERVAL = 2.
+DEFAULT_WARMUP_UTTERANCES = ('Hello', 'How are you?')
+WARMUP_AGENT_ID = 'due-warmup'
+
+SwapReport = namedtuple('SwapReport', ['source', 'load_time', 'warmup_time', 'memory_before', 'memory_after'])
+SwapReport.__doc__ = """
+A report of an Agent swap.
+
+:param source: the path the new Agent was loaded from, if any
+:type source: `str`
+:param load_time: time spent loading the new Agent, in seconds
+:type load_time: `float`
+:param warmup_time: time spent warming up the new Agent, in seconds
+:type warmup_time: `float`
+:param memory_before: resident memory of the process before the new Agent was loaded, in bytes
+:type memory_before: `int`
+:param memory_after: resident memory of the process after the old Agent was released, in bytes
+:type memory_after: `int`
+"""
+
+class HotSwapAgent(Agent):
+	"""
+	A proxy of an Agent, that can be replaced while the proxy is served. The
+	proxy has its own ID (by default, the one of the first Agent), which is the
+	ID other participants see in the Episodes.
+
+	The proxy keeps track of the open Episodes, and announces them to the new
+	Agent (see :meth:`due.agent.Agent.new_episode_callback`) before
+	switching to it, so that the new Agent knows about them. The old Agent is
+	closed (see :meth:`due.agent.Agent.close`) once it's replaced, and the
+	calls it was serving are completed: Episodes
+	it was still learning in the background are learned before it's released,
+	but they are not learned by the new Agent.
+
+	:param agent: the Agent to serve
+	:type agent: :class:`due.agent.Agent`
+	:param agent_id: the ID of the proxy
+	:type agent_id: `str`
+	:param idle_timeout: forget Episodes that were idle for this many seconds
+	:type idle_timeout: `float`
+	"""
+
+	def __init__(self, agent, agent_id=None, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+		super().__init__(agent_id if agent_id is not None else agent.id)
+		self._logger = logging.getLogger(__name__ + ".HotSwapAgent")
+		self._agent = agent
+		self._episodes = SessionStore(idle_timeout)
+		self._swap_lock = threading.Lock()
+		self._agent_released = threading.Condition(self._swap_lock)
+		self._in_flight = {}
+		self.swaps = 0
+		self.last_report = None
+
+	@property
+	def agent(self):
+		"""
+		The Agent that is currently served
+		"""
+		return self._agent
+
+	def swap(self, agent, warmup_utterances=DEFAULT_WARMUP_UTTERANCES):
+		"""
+		Warm up the given Agent, and start serving it instead of the current
+		one.
+
+		:param agent: the new Agent
+		:type agent: :class:`due.agent.Agent`
+		:param warmup_utterances: utterances the new Agent answers before being served
+		:type warmup_utterances: `list` of `str`
+		:return: the swap report (with no source, and a load time of 0)
+		:rtype: :class:`SwapReport`
+		"""
+		return self._swap(agent, None, 0., _rss(), warmup_utterances)
+
+	def load(self, path, warmup_utterances=DEFAULT_WARMUP_UTTERANCES, allow_pickle=False):
+		"""
+		Load an Agent that was saved to a file (see :mod:`due.persistence`),
+		and swap to it.
+
+		:param path: the path of the saved Agent
+		:type path: `str`
+		:param warmup_utterances: utterances the new Agent answers before being served
+		:type warmup_utterances: `list` of `str`
+		:param allow_pickle: allow reading Pickle files (see :func:`due.persistence.deserialize`)
+		:type allow_pickle: `bool`
+		:return: the swap report
+		:rtype: :class:`SwapReport`
+		"""
+		memory_before = _rss()
+		start = time.perf_counter()
+		agent = Agent.load(deserialize(path, allow_pickle=allow_pickle))
+		load_time = time.perf_counter() - start
+		return self._swap(agent, path, load_time, memory_before, warmup_utterances)
+
+	def _swap(self, agent, source, load_time, memory_before, warmup_utterances):
+		start = time.perf_counter()
+		_warm_up(agent, warmup_utterances)
+		warmup_time = time.perf_counter() - start
+
+		with self._swap_lock:
+			for episode in self._episodes.values():
+				agent.new_episode_callback(episode)
+			old_agent, self._agent = self._agent, agent
+			self.swaps += 1
+			self._agent_released.wait_for(lambda: id(old_agent) not in self._in_flight)
+		old_agent.close()
+		del old_agent
+		gc.collect()
+
+		report = SwapReport(source, load_time, warmup_time, memory_before, _rss())
+		self.last_report = report
+		self._logger.info("Swapped to agent %s: %s", agent, report)
+		return report
+
+	def new_episode_callback(self, new_episode):
+		"""See :meth:`due.agent.Agent.new_episode_callback`"""
+		with self._swap_lock:
+			self._episodes[new_episode.id] = new_episode
+			self._agent.new_episode_callback(new_episode)
+
+	def utterance_callback(self, episode):
+		"""See :meth:`due.agent.Agent.utterance_callback`"""
+		self._episodes.touch(episode.id)
+		with self._served_agent() as agent:
+			return self._relay(agent.utterance_callback(episode))
+
+	def batch_utterance_callback(self, episodes):
+		"""See :meth:`due.agent.Agent.batch_utterance_callback`"""
+		for e in episodes:
+			self._episodes.touch(e.id)
+		with self._served_agent() as agent:
+			return [self._relay(r) for r in agent.batch_utterance_callback(episodes)]
+
+	def action_callback(self, episode):
+		"""See :meth:`due.agent.Agent.action_callback`"""
+		self._episodes.touch(episode.id)
+		with self._served_agent() as agent:
+			return self._relay(agent.action_callback(episode))
+
+	def leave_callback(self, episode):
+		"""See :meth:`due.agent.Agent.leave_callback`"""
+		self._episodes.pop(episode.id)
+		with self._served_agent() as agent:
+			return self._relay(agent.leave_callback(episode))
+
+	def learn_episodes(self, episodes):
+		"""See :meth:`due.agent.Agent.learn_episodes`"""
+		with self._served_agent() as agent:
+			agent.learn_episodes(episodes)
+
+	def save(self):
+		"""Save the Agent that is currently served."""
+		with self._served_agent() as agent:
+			return agent.save()
+
+	def close(self):
+		"""Close the Agent that is currently served."""
+		self._agent.close()
+
+	@contextlib.contextmanager
+	def _served_agent(self):
+		"""
+		Yield the Agent that is currently served, counting the call as in
+		flight, so that a swap doesn't close the Agent until it returns.
+		"""
+		with self._swap_lock:
+			agent = self._agent
+			self._in_flight[id(agent)] = self._in_flight.get(id(agent), 0) + 1
+		try:
+			yield agent
+		finally:
+			with self._swap_lock:
+				self._in_flight[id(agent)] -= 1
+				if not self._in_flight[id(agent)]:
+					del self._in_flight[id(agent)]
+					self._agent_released.notify_all()
+
+	def _relay(self, events):
+		"""Issue the served Agent's response Events as the proxy."""
+		return [Event(e.type, e.timestamp, self.id, e.payload) for e in events or []]
+
+class AgentReloader(object):
+	"""
+	Watch a saved Agent file, and load it into a :class:`HotSwapAgent`
+	whenever it changes. The file is checked every `interval` seconds by a
+	background thread, which also loads and warms up the new Agent.
+
+	:param hot_swap_agent: the served proxy
+	:type hot_swap_agent: :class:`HotSwapAgent`
+	:param path: the path of the saved Agent
+	:type path: `str`
+	:param interval: how often to check the file, in seconds
+	:type interval: `float`
+	:param warmup_utterances: utterances new Agents answer before being served
+	:type warmup_utterances: `list` of `str`
+	:param allow_pickle: allow reading Pickle files (see :func:`due.persistence.deserialize`)
+	:type allow_pickle: `bool`
+	"""
+
+	def __init__(self, hot_swap_agent, path, interval=DEFAULT_WATCH_INTERVAL, warmup_utterances=DEFAULT_WARMUP_UTTERANCES, allow_pickle=False):
+		self._logger = logging.getLogger(__name__ + ".AgentReloader")
+		self.agent = hot_swap_agent
+		self.path = path
+		self.interval = interval
+		self.warmup_utterances = warmup_utterances
+		self.allow_pickle = allow_pickle
+		self.reloads = 0
+		self.errors = 0
+		self._signature = _file_signature(path)
+		self._stopped = threading.Event()
+		self._thread = None
+
+	def start(self):
+		"""
+		Start watching the file in a background thread.
+
+		:return: the reloader itself
+		:rtype: :class:`AgentReloader`
+		"""
+		self._stopped.clear()
+		self._thread = threading.Thread(target=self._run, name='due-reloader', daemon=True)
+		self._thread.start()
+		return self
+
+	def stop(self):
+		"""
+		Stop watching the file.
+		"""
+		self._stopped.set()
+		if self._thread is not None:
+			self._thread.join()
+			self._thread = None
+
+	def check(self):
+		"""
+		Load the file if it changed since it was last checked.
+
+		:return: the swap report, or `None` if the file didn't change (or it couldn't be loaded)
+		:rtype: :class:`SwapReport`
+		"""
+		signature = _file_signature(self.path)
+		if signature is None or signature == self._signature:
+			return None
+		self._signature = signature
+		try:
+			report = self.agent.load(self.path, self.warmup_utterances, self.allow_pickle)
+		except Exception:
+			self.errors += 1
+			self._logger.exception("Could not load agent from %s", self.path)
+			return None
+		self.reloads += 1
+		return report
+
+	def _run(self):
+		while not self._stopped.wait(self.interval):
+			self.check()
+
+#
+# Helpers
+#
+
+def _warm_up(agent, utterances):
+	"""
+	Answer some utterances in a throwaway Episode, so that lazily loaded
+	resources (eg. NLP models) are loaded before the Agent is served.
+	"""
+	episode = Episode(WARMUP_AGENT_ID, agent.id)
+	for text in utterances:
+		episode.events.append(Event(Event.Type.Utterance, datetime.now(), WARMUP_AGENT_ID, text))
+		agent.utterance_callback(episode)
+
+def _file_signature(path):
+	try:
+		stat = os.stat(path)
+	except FileNotFoundError:
+		return None
+	return stat.st_mtime_ns, stat.st_size
+
+def _rss():
+	"""The resident memory of the current process, in bytes."""
+	try:
+		with open('/proc/self/statm') as f:
+			return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+	except (OSError, ValueError):
+		return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
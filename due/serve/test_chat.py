@@ -0,0 +1,77 @@
+import unittest
+import threading
+from collections import defaultdict
+
+from due.event import Event
+from due.models.tfidf import TfIdfAgent
+from due.corpora import toy
+from due.serve.chat import *
+
+class FakeChannel(object):
+	"""A stand-in chat client, collecting the replies sent to each user"""
+
+	def __init__(self):
+		self.replies = defaultdict(list)
+		self.lock = threading.Lock()
+
+	def reply_f(self, user_id):
+		def reply(text):
+			with self.lock:
+				self.replies[user_id].append(text)
+		return reply
+
+class EchoAgent(TfIdfAgent):
+	"""Answer with the last utterance, to check that replies go to the right user"""
+
+	def utterance_callback(self, episode):
+		last = episode.last_event(Event.Type.Utterance)
+		return [Event(Event.Type.Utterance, last.timestamp, self.id, 'echo: ' + last.payload)]
+
+class TestChatServer(unittest.TestCase):
+
+	def test_concurrent_users(self):
+		server = ChatServer(EchoAgent(), max_workers=4)
+		channel = FakeChannel()
+		users = ['user%s@example.com' % i for i in range(5)]
+		for i in range(10):
+			for u in users:
+				server.receive(u, '%s %s' % (u, i), channel.reply_f(u))
+		server.shutdown()
+
+		for u in users:
+			self.assertEqual(channel.replies[u], ['echo: %s %s' % (u, i) for i in range(10)])
+			episode = server.live_episode(u)
+			self.assertEqual(episode.starter_id, u)
+			self.assertEqual(len(episode.events), 20)
+
+	def test_leave(self):
+		server = ChatServer(EchoAgent())
+		channel = FakeChannel()
+		server.receive('alice', 'hi', channel.reply_f('alice'))
+		server.receive('alice', ',,,leave', channel.reply_f('alice')).result()
+		self.assertIsNone(server.live_episode('alice'))
+		server.receive('alice', 'hi again', channel.reply_f('alice')).result()
+		server.shutdown()
+
+		self.assertEqual(channel.replies['alice'], ['echo: hi', '[you left the episode]', 'echo: hi again'])
+		self.assertEqual(len(server.live_episode('alice').events), 2)
+
+	def test_tfidf_agent(self):
+		agent = TfIdfAgent()
+		agent.learn_episodes(toy.episodes())
+		server = ChatServer(agent)
+		channel = FakeChannel()
+		server.receive('alice', 'Hi', channel.reply_f('alice')).result()
+		server.shutdown()
+		self.assertEqual(len(channel.replies['alice']), 1)
+
+	def test_eviction(self):
+		server = ChatServer(EchoAgent(), max_sessions=2)
+		channel = FakeChannel()
+		for u in ['alice', 'bob', 'carol']:
+			server.receive(u, 'hi', channel.reply_f(u)).result()
+		server.shutdown()
+
+		self.assertIsNone(server.live_episode('alice'))
+		self.assertEqual(server.stats()['evicted_capacity'], 1)
+		self.assertNotIn('alice', server._reply_functions)
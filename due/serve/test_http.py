@@ -0,0 +1,173 @@
+import unittest
+import json
+import asyncio
+import threading
+from datetime import datetime
+
+from due.corpora import toy
+from due.models.tfidf import TfIdfAgent
+from due.models.dummy import DummyAgent
+from due.event import Event
+from due.serve.chat import ChatServer
+from due.serve.http import *
+from due.util.metrics import REGISTRY
+
+def _agent():
+	agent = TfIdfAgent()
+	agent.learn_episodes(toy.episodes())
+	return agent
+
+async def _request(port, method, path, body=None):
+	reader, writer = await asyncio.open_connection('127.0.0.1', port)
+	data = json.dumps(body).encode('utf-8') if body is not None else b''
+	writer.write(f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\nContent-Length: {len(data)}\r\n\r\n".encode('latin-1') + data)
+	await writer.drain()
+	response = await reader.read()
+	writer.close()
+	head, _, body = response.partition(b'\r\n\r\n')
+	if b'Content-Type: text/plain' in head:
+		return int(head.split()[1]), body.decode('utf-8')
+	return int(head.split()[1]), json.loads(body)
+
+class BlockingAgent(DummyAgent):
+
+	def __init__(self):
+		super().__init__('blocking')
+		self.started = threading.Event()
+		self.release = threading.Event()
+
+	def batch_utterance_callback(self, episodes):
+		self.started.set()
+		self.release.wait(10)
+		return [[Event(Event.Type.Utterance, datetime.now(), self.id, 'Hello')] for _ in episodes]
+
+class TestMicroBatcher(unittest.TestCase):
+
+	def test_batches(self):
+		batches = []
+		def batch_f(items):
+			batches.append(items)
+			return [i * 2 for i in items]
+
+		async def run():
+			batcher = MicroBatcher(batch_f, max_batch_size=4, max_wait=0.01)
+			results = await asyncio.gather(*[batcher.submit(i) for i in range(10)])
+			batcher.close()
+			return results
+
+		self.assertEqual(asyncio.run(run()), [i * 2 for i in range(10)])
+		self.assertEqual([len(b) for b in batches], [4, 4, 2])
+
+	def test_error(self):
+		def batch_f(items):
+			raise RuntimeError("expected")
+
+		async def run():
+			batcher = MicroBatcher(batch_f)
+			try:
+				await batcher.submit(1)
+			finally:
+				batcher.close()
+
+		with self.assertRaises(RuntimeError):
+			asyncio.run(run())
+
+	def test_active_episodes_per_channel(self):
+		latency = REGISTRY.get('due_reply_latency_seconds').labels(channel='chat')
+		before = latency.count
+		chat_server = ChatServer(_agent())
+		http_server = HttpServer(_agent(), port=0)
+		chat_server.receive('alice', 'Hi', lambda text: None).result()
+		chat_server.shutdown()
+		self.assertEqual(REGISTRY.get('due_active_episodes').labels(channel='chat').value, 1)
+		self.assertEqual(REGISTRY.get('due_active_episodes').labels(channel='http').value, 0)
+		self.assertEqual(latency.count - before, 1)
+
+class TestHttpServer(unittest.TestCase):
+
+	def test_batch_utterance_callback(self):
+		agent = _agent()
+		alice, bob = DummyAgent('alice'), DummyAgent('bob')
+		episodes = []
+		for sentence in ['Hi', 'How are you?', 'Bye']:
+			e = alice.start_episode(bob)
+			alice.say(sentence, e)
+			episodes.append(e)
+
+		batch_answers = agent.batch_utterance_callback(episodes)
+		self.assertEqual(
+			[[a.payload for a in answers] for answers in batch_answers],
+			[[a.payload for a in agent.utterance_callback(e)] for e in episodes]
+		)
+
+	def test_serve(self):
+		async def run():
+			server = HttpServer(_agent(), port=0, max_batch_size=8, max_wait=0.05)
+			await server.start()
+			try:
+				results = await asyncio.gather(*[
+					_request(server.port, 'POST', '/sessions/s%s/utterances' % i, {'text': 'Hi'})
+					for i in range(5)
+				])
+				for status, body in results:
+					self.assertEqual(status, 200)
+					self.assertEqual(len(body['answers']), 1)
+
+				self.assertEqual(len(server._live_episodes['s0'].events), 2)
+				self.assertEqual((await _request(server.port, 'POST', '/sessions/s0/leave'))[0], 200)
+				self.assertEqual((await _request(server.port, 'POST', '/sessions/s0/leave'))[0], 404)
+				self.assertEqual((await _request(server.port, 'POST', '/sessions/s1/utterances', {'no_text': 1}))[0], 400)
+				self.assertEqual((await _request(server.port, 'GET', '/nothing'))[0], 404)
+
+				status, stats = await _request(server.port, 'GET', '/stats')
+				self.assertEqual(status, 200)
+				self.assertEqual(stats['sessions'], 4)
+				self.assertEqual(stats['requests'], 9)
+				self.assertEqual(stats['errors'], 3)
+				self.assertLess(stats['batches'], 5)
+			finally:
+				await server.stop()
+
+		asyncio.run(run())
+
+	def test_eviction_skips_busy_sessions(self):
+		async def run():
+			agent = BlockingAgent()
+			server = HttpServer(agent, port=0, max_wait=0.001, max_sessions=1)
+			s0 = asyncio.ensure_future(server.utterance('s0', 'Hi'))
+			while not agent.started.is_set():
+				await asyncio.sleep(0.001)
+			s1 = asyncio.ensure_future(server.utterance('s1', 'Hi'))
+			await asyncio.sleep(0.01)
+
+			episode = server._live_episodes.get('s0')
+			self.assertIsNotNone(episode)
+			self.assertNotIn(Event.Type.Leave, [e.type for e in episode.events])
+
+			agent.release.set()
+			self.assertEqual(await s0, ['Hello'])
+			self.assertEqual(await s1, ['Hello'])
+			self.assertEqual(server._session_locks, {})
+
+			await server.utterance('s2', 'Hi')
+			self.assertEqual(server._live_episodes.keys(), ['s2'])
+			self.assertEqual(episode.events[-1].type, Event.Type.Leave)
+			await server.stop()
+
+		asyncio.run(run())
+
+	def test_metrics(self):
+		async def run():
+			server = HttpServer(_agent(), port=0)
+			await server.start()
+			try:
+				await _request(server.port, 'POST', '/sessions/s0/utterances', {'text': 'Hi'})
+				status, text = await _request(server.port, 'GET', '/metrics')
+			finally:
+				await server.stop()
+			self.assertEqual(status, 200)
+			self.assertIn('# TYPE due_reply_latency_seconds histogram', text)
+			self.assertIn('due_active_episodes{channel="http"} 1.0', text)
+			self.assertIn('due_events_total{type="Utterance"}', text)
+
+		asyncio.run(run())
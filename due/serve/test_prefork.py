@@ -0,0 +1,70 @@
+import unittest
+import os
+import signal
+import asyncio
+
+from due.corpora import toy
+from due.models.tfidf import TfIdfAgent
+from due.serve.prefork import *
+from due.serve.test_http import _request
+
+class TestPreforkServer(unittest.TestCase):
+
+	def test_serve(self):
+		agent = TfIdfAgent()
+		agent.learn_episodes(toy.episodes())
+
+		async def utterances(port, n_sessions):
+			return await asyncio.gather(*[
+				_request(port, 'POST', '/sessions/s%s/utterances' % i, {'text': 'Hi'})
+				for i in range(n_sessions)
+			])
+
+		async def run():
+			server = PreforkServer(agent, n_workers=2, port=0, max_wait=0.001)
+			await server.start()
+			try:
+				pids = server.worker_pids
+				self.assertEqual(len(set(pids)), 2)
+				self.assertNotIn(os.getpid(), pids)
+
+				for _ in range(2):
+					results = await utterances(server.port, 6)
+					self.assertTrue(all(status == 200 and len(body['answers']) == 1 for status, body in results))
+
+				# Each session lives in a single worker
+				status, stats = await _request(server.port, 'GET', '/stats')
+				self.assertEqual(status, 200)
+				self.assertEqual(sorted(w['pid'] for w in stats['workers']), sorted(pids))
+				self.assertEqual(sum(w['sessions'] for w in stats['workers']), 6)
+				self.assertEqual(sum(w['requests'] for w in stats['workers']), 12)
+
+				status, text = await _request(server.port, 'GET', '/metrics')
+				self.assertEqual(status, 200)
+				self.assertEqual(text.count('# TYPE due_active_episodes gauge'), 1)
+				for pid in pids:
+					self.assertIn('worker="%s"' % pid, text)
+
+				await server.restart()
+				self.assertEqual(len(set(server.worker_pids) & set(pids)), 0)
+				results = await utterances(server.port, 3)
+				self.assertTrue(all(status == 200 for status, _ in results))
+
+				# Dead workers are replaced
+				dead_pid = server.worker_pids[0]
+				os.kill(dead_pid, signal.SIGKILL)
+				for _ in range(300):
+					await asyncio.sleep(0.01)
+					if dead_pid not in server.worker_pids:
+						break
+				self.assertNotIn(dead_pid, server.worker_pids)
+				self.assertEqual(len(server.worker_pids), 2)
+			finally:
+				pids = server.worker_pids
+				await server.stop()
+
+			for pid in pids:
+				with self.assertRaises(ProcessLookupError):
+					os.kill(pid, 0)
+
+		asyncio.run(run())
@@ -0,0 +1,42 @@
+import unittest
+import asyncio
+
+from due.serve.protocol import *
+
+class FakeWriter(object):
+
+	def __init__(self):
+		self.data = b''
+
+	def write(self, data):
+		self.data += data
+
+def _reader(data):
+	reader = asyncio.StreamReader()
+	reader.feed_data(data)
+	reader.feed_eof()
+	return reader
+
+class TestProtocol(unittest.TestCase):
+
+	def test_request(self):
+		async def run():
+			data = b'POST /sessions/s0/utterances HTTP/1.1\r\nContent-Length: 2\r\n\r\n{}'
+			self.assertEqual(await read_request(_reader(data)), ('POST', '/sessions/s0/utterances', {'content-length': '2'}, b'{}'))
+			self.assertIsNone(await read_request(_reader(b'')))
+			with self.assertRaises(ValueError):
+				await read_request(_reader(b'GET\r\n\r\n'))
+			with self.assertRaises(ValueError):
+				await read_request(_reader(b'POST / HTTP/1.1\r\nContent-Length: %d\r\n\r\n' % (MAX_BODY_SIZE + 1)))
+		asyncio.run(run())
+
+	def test_response(self):
+		async def run():
+			writer = FakeWriter()
+			write_response(writer, 200, {'answers': ['Hello']}, True)
+			self.assertEqual(await read_response(_reader(writer.data)), (200, True, {'answers': ['Hello']}))
+
+			writer = FakeWriter()
+			write_response(writer, 200, 'a_total 1.0\n', False)
+			self.assertEqual(await read_response(_reader(writer.data)), (200, False, 'a_total 1.0\n'))
+		asyncio.run(run())
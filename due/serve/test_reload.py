@@ -0,0 +1,162 @@
+import os
+import gc
+import time
+import weakref
+import tempfile
+import threading
+import unittest
+
+from due.agent import Agent
+from due.models.dummy import DummyAgent
+from due.models.tfidf import TfIdfAgent
+from due.persistence import serialize, deserialize
+from due.serve.chat import ChatServer
+from due.serve.reload import HotSwapAgent, AgentReloader
+from due.util.metrics import REGISTRY
+
+def _trained_agent(answer, agent_id='tfidf', parameters=None):
+	alice = DummyAgent('alice')
+	bob = DummyAgent('bob')
+	episode = alice.start_episode(bob)
+	alice.say('Hi!', episode)
+	bob.say(answer, episode)
+	result = TfIdfAgent(agent_id, parameters)
+	result.learn_episodes([episode])
+	return result
+
+class BlockingAgent(DummyAgent):
+
+	def __init__(self, agent_id=None):
+		super().__init__(agent_id)
+		self.started = threading.Event()
+		self.release = threading.Event()
+		self.closed = False
+
+	def utterance_callback(self, episode):
+		self.started.set()
+		self.release.wait(10)
+		if self.closed:
+			raise RuntimeError("Agent is closed")
+		return []
+
+	def close(self):
+		self.closed = True
+
+class TestHotSwapAgent(unittest.TestCase):
+
+	def test_swap_keeps_episodes(self):
+		agent = HotSwapAgent(_trained_agent('Hello'))
+		alice = DummyAgent('alice')
+		episode = alice.start_episode(agent)
+		alice.say('Hi!', episode)
+		self.assertEqual(episode.events[-1].payload, 'Hello')
+		self.assertEqual(episode.events[-1].agent, agent.id)
+
+		new_agent = _trained_agent('Howdy', agent_id='other')
+		report = agent.swap(new_agent)
+		self.assertIs(agent.agent, new_agent)
+		self.assertGreater(report.warmup_time, 0)
+		self.assertGreater(report.memory_after, 0)
+		self.assertIn(episode.id, new_agent._active_episodes)
+
+		alice.say('Hi!', episode)
+		self.assertEqual([e.payload for e in episode.events], ['Hi!', 'Hello', 'Hi!', 'Howdy'])
+		self.assertEqual(episode.events[-1].agent, agent.id)
+
+		alice.leave(episode)
+		self.assertNotIn(episode.id, new_agent._active_episodes)
+		self.assertIs(new_agent._past_episodes[-1], episode)
+
+	def test_old_agent_released(self):
+		old_agent = _trained_agent('Hello', parameters={'background_learning': True})
+		learner_thread = old_agent.learner._thread
+		learned = REGISTRY.get('due_learned_episodes_total').labels()
+		learned_before = learned.value
+		agent = HotSwapAgent(old_agent)
+		alice = DummyAgent('alice')
+		episode = alice.start_episode(agent)
+		alice.say('Hi!', episode)
+		alice.leave(episode)
+
+		old_agent_ref = weakref.ref(old_agent)
+		del old_agent
+		agent.swap(_trained_agent('Howdy'))
+		gc.collect()
+		self.assertIsNone(old_agent_ref())
+		self.assertFalse(learner_thread.is_alive())
+		self.assertEqual(learned.value - learned_before, 1)
+
+	def test_swap_waits_for_in_flight_calls(self):
+		old_agent = BlockingAgent('old')
+		agent = HotSwapAgent(old_agent)
+		episode = DummyAgent('alice').start_episode(agent)
+		results = []
+		turn = threading.Thread(target=lambda: results.append(agent.utterance_callback(episode)))
+		turn.start()
+		self.assertTrue(old_agent.started.wait(10))
+
+		swap = threading.Thread(target=agent.swap, args=(DummyAgent('new'), []))
+		swap.start()
+		deadline = time.monotonic() + 10
+		while agent.agent is old_agent and time.monotonic() < deadline:
+			time.sleep(0.01)
+		self.assertEqual(agent.agent.id, 'new')
+		self.assertTrue(swap.is_alive())
+		self.assertFalse(old_agent.closed)
+
+		old_agent.release.set()
+		turn.join()
+		swap.join()
+		self.assertEqual(results, [[]])
+		self.assertTrue(old_agent.closed)
+
+	def test_chat_server(self):
+		agent = HotSwapAgent(_trained_agent('Hello'))
+		server = ChatServer(agent)
+		replies = []
+		server.receive('alice', 'Hi!', replies.append).result()
+		agent.swap(_trained_agent('Howdy'))
+		server.receive('alice', 'Hi!', replies.append).result()
+		server.shutdown()
+		self.assertEqual(replies, ['Hello', 'Howdy'])
+		self.assertEqual(len(server.live_episode('alice').events), 4)
+
+class TestAgentReloader(unittest.TestCase):
+
+	def test_reload(self):
+		with tempfile.TemporaryDirectory() as temp_dir:
+			path = os.path.join(temp_dir, 'agent.yaml')
+			serialize(_trained_agent('Hello').save(), path)
+			agent = HotSwapAgent(Agent.load(deserialize(path)))
+			reloader = AgentReloader(agent, path, interval=0.05)
+			self.assertIsNone(reloader.check())
+
+			serialize(_trained_agent('Howdy').save(), path)
+			os.utime(path, ns=(time.time_ns(), time.time_ns() + 10**9))
+			report = reloader.check()
+			self.assertEqual(report.source, path)
+			self.assertGreater(report.load_time, 0)
+			self.assertEqual(reloader.reloads, 1)
+
+			alice = DummyAgent('alice')
+			episode = alice.start_episode(agent)
+			alice.say('Hi!', episode)
+			self.assertEqual(episode.events[-1].payload, 'Howdy')
+
+			with open(path, 'w') as f:
+				f.write('not an agent')
+			self.assertIsNone(reloader.check())
+			self.assertEqual(reloader.errors, 1)
+			self.assertEqual(agent.swaps, 1)
+
+	def test_background(self):
+		with tempfile.TemporaryDirectory() as temp_dir:
+			path = os.path.join(temp_dir, 'agent.yaml')
+			agent = HotSwapAgent(_trained_agent('Hello'))
+			reloader = AgentReloader(agent, path, interval=0.05).start()
+			serialize(_trained_agent('Howdy').save(), path)
+			deadline = time.time() + 10
+			while agent.swaps == 0 and time.time() < deadline:
+				time.sleep(0.05)
+			reloader.stop()
+			self.assertEqual(agent.swaps, 1)
@@ -5,10 +5,10 @@ authorized account.
 .. warning::
 
 	XMPP support is for testing purposes and is not production ready.
-	Particularly, the current implementation is obsolete, it cannot handle more
-	than one episode at the same time, and does not tell users apart (incoming
-	messages will be regarded as if they were sent by a fake account
-	`default@human.im`).
+
+Each sender (by bare Jabber ID) gets their own Episode, and messages are
+processed on a pool of worker threads (see :mod:`due.serve.chat`), so that many
+users can chat with the agent at the same time.
 
 This is how you serve a toy agent on XMPP
 
@@ -31,42 +31,34 @@ API
 """
 
 import logging
-import uuid
-from datetime import datetime
 
-from due.agent import Agent
-from due.models.tfidf import TfIdfAgent
-from due.models.dummy import DummyAgent
-from due.episode import LiveEpisode
-from due.event import Event
+from due.serve.chat import ChatServer, DEFAULT_MAX_WORKERS
+from due.serve.reload import HotSwapAgent, AgentReloader, DEFAULT_WATCH_INTERVAL
+from due.util import metrics
+from due.util.metrics import MetricsServer
 
 from sleekxmpp import ClientXMPP
-from sleekxmpp.exceptions import IqError, IqTimeout
-
 
-class DueBot(ClientXMPP, Agent):
 
-	DEFAULT_HUMAN_JID = "default@human.im"
+class DueBot(ClientXMPP, ChatServer):
+	"""
+	Expose an :class:`due.agent.Agent` on XMPP with the given credentials.
 
-	def __init__(self, agent, jid, password):
-		"""
-		Expose an :class:`due.agent.Agent` on XMPP with the given credentials.
-
-		:param agent: An Agent
-		:type agent: :class:`due.agent.Agent`
-		:param jid: A Jabber ID
-		:type jid: :class:`str`
-		:param password: The Jabber account password
-		:type password: :class:`str`
-		"""
-		ClientXMPP.__init__(self, jid, password)
-		Agent.__init__(self, agent.id)
+	:param agent: An Agent
+	:type agent: :class:`due.agent.Agent`
+	:param jid: A Jabber ID
+	:type jid: :class:`str`
+	:param password: The Jabber account password
+	:type password: :class:`str`
+	:param max_workers: maximum number of messages that are processed in parallel
+	:type max_workers: `int`
+	"""
 
-		self._agent = agent
+	channel = 'xmpp'
 
-		self._humans = {}
-		self._live_episode = None
-		self._last_message = None
+	def __init__(self, agent, jid, password, max_workers=DEFAULT_MAX_WORKERS):
+		ClientXMPP.__init__(self, jid, password)
+		ChatServer.__init__(self, agent, max_workers)
 		self._logger = logging.getLogger(__name__ + ".DueBot")
 
 		self.add_event_handler("session_start", self.session_start)
@@ -77,96 +69,52 @@ class DueBot(ClientXMPP, Agent):
 		self.get_roster()
 
 	def message(self, msg):
-		if msg['type'] in ('chat', 'normal'):
-			human_agent = self._fetch_or_create_human_agent(DueBot.DEFAULT_HUMAN_JID)
-			self._last_message = msg
-			if self._handle_command_message(msg):
-				return
-			if self._live_episode is None:
-				self._live_episode = LiveEpisode(human_agent, self)
-				# self._live_episode = LiveEpisode(human_agent, self._agent)
-			utterance = Event(Event.Type.Utterance, datetime.now(), str(human_agent.id), msg['body'])
-			self._live_episode.add_event(utterance)
-
-	def utterance_callback(self, episode):
-		"""See :meth:`due.agent.Agent.utterance_callback`"""
-		self._logger.info("Received utterance")
-		answers = self._agent.utterance_callback(episode)
-		self.act_events(answers, episode)
-
-	def act_events(self, events, episode):
-		for e in events:
-			if e.type == Event.Type.Action:
-				e.payload.run()
-			elif e.type == Event.Type.Utterance:
-				if self._last_message is None:
-					self._logger.warning("Could not send message '%s' because \
-						no last message is set. This is not supposed to happen.", e.payload)
-					return
-				self._logger.info("Sending reply on chat: %s", e)
-				self._last_message.reply(e.payload).send()
-
-			episode.add_event(e)
-
-	def say(self, sentence, episode):
 		"""
-		Deprecated!
+		Handle an incoming XMPP message. This runs on the XMPP event thread,
+		so the message is only queued for processing (see
+		:meth:`due.serve.chat.ChatServer.receive`).
 		"""
-		self._logger.warn('deprecated use of DueBot.say(). Please use DueBot.act_events() instead.')
-		if self._last_message is None:
-			self._logger.warning("Could not send message '%s' because \
-				no last message is set. This is not supposed to happen.", sentence)
-			return
-		self._last_message.reply(sentence).send()
-		episode.add_utterance(self._agent, sentence)
-
-	def _fetch_or_create_human_agent(self, jid):
-		if jid not in self._humans:
-			self._humans[jid] = DummyAgent(jid)
-		return self._humans[jid]
-
-	def _handle_command_message(self, msg):
-		"""
-		Command messages are:
-
-			* `,,,leave`: closes the episode
-		"""
-		if msg['body'][0:3] != ',,,': return False
-		if msg['body'] == ',,,leave':
-			msg.reply("[you left the episode]").send()
-			human_agent = self._fetch_or_create_human_agent(DueBot.DEFAULT_HUMAN_JID)
-			leave_event = Event(Event.Type.Leave, datetime.now(), str(human_agent.id), None)
-			self._live_episode.add_event(leave_event)
-			self._live_episode = None
-			self._last_message = None
-		return True
-
-	def save(self):
-		raise NotImplementedError()
-
-	def learn_episodes(self, episodes):
-		raise NotImplementedError()
-
-	def new_episode_callback(self, new_episode):
-		self._logger.info("New episode callback received: %s", new_episode)
-
-	def action_callback(self, episode):
-		raise NotImplementedError()
-
-	def leave_callback(self, episode):
-		self._logger.info("Leave callback received: %s", episode)
+		if msg['type'] in ('chat', 'normal'):
+			sender = str(msg['from'].bare)
+			self.receive(sender, msg['body'], lambda text: msg.reply(text).send())
 
-def serve(agent, jid, password):
+def serve(agent, jid, password, max_workers=DEFAULT_MAX_WORKERS, watch=None, watch_interval=DEFAULT_WATCH_INTERVAL, metrics_port=None):
 	"""
 	Expose an :class:`due.agent.Agent` on XMPP with the given credentials.
 
+	If `watch` is given, the agent is replaced whenever the saved agent at that
+	path changes (see :mod:`due.serve.reload`). Open conversations are kept.
+
+	If `metrics_port` is given, serving metrics are exposed on
+	`http://127.0.0.1:<metrics_port>/metrics` (see :mod:`due.util.metrics`).
+
 	:param agent: An Agent
 	:type agent: :class:`due.agent.Agent`
 	:param jid: A Jabber ID
 	:type jid: :class:`str`
 	:param password: The Jabber account password
 	:type password: :class:`str`
+	:param max_workers: maximum number of messages that are processed in parallel
+	:type max_workers: `int`
+	:param watch: the path of a saved Agent to reload
+	:type watch: `str`
+	:param watch_interval: how often to check the saved Agent, in seconds
+	:type watch_interval: `float`
+	:param metrics_port: the local port of the metrics endpoint
+	:type metrics_port: `int`
 	"""
-	bot = DueBot(agent, jid, password)
+	metrics.set_default_labels(agent_class=type(agent).__name__, channel=DueBot.channel)
+	reloader = None
+	if watch is not None:
+		agent = HotSwapAgent(agent)
+		reloader = AgentReloader(agent, watch, watch_interval).start()
+	metrics_server = MetricsServer(port=metrics_port).start() if metrics_port is not None else None
+	bot = DueBot(agent, jid, password, max_workers)
 	bot.connect()
-	bot.process(block=True)
+	try:
+		bot.process(block=True)
+	finally:
+		if reloader is not None:
+			reloader.stop()
+		if metrics_server is not None:
+			metrics_server.stop()
@@ -0,0 +1,256 @@
+"""
+A Session Store is a registry of the active sessions (typically, LiveEpisodes)
+of an Agent or a serving channel. Sessions that have been idle for too long,
+or that exceed the maximum number of sessions, are **evicted**, so that a
+long-running server doesn't accumulate finished or abandoned conversations:
+
+.. code-block:: python
+
+	from due.session import SessionStore
+
+	def on_evict(episode_id, episode, reason):
+		agent.learn_episode(episode)
+
+	sessions = SessionStore(idle_timeout=600, max_sessions=10000, on_evict=on_evict)
+	sessions[episode.id] = episode
+	...
+	episode = sessions.get(episode_id) # This also marks the session as active
+
+Expired sessions are evicted lazily, whenever the store is accessed (or
+explicitly, with :meth:`SessionStore.evict_expired`), at an amortized constant
+cost per access.
+
+API
+===
+"""
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+DEFAULT_IDLE_TIMEOUT = 1800.
+
+EVICTED_IDLE = 'idle'
+EVICTED_CAPACITY = 'capacity'
+
+_MISSING = object()
+
+class SessionStore(object):
+	"""
+	A thread-safe mapping of session keys to sessions, with idle-timeout and
+	maximum-size eviction. Sessions are kept in least-recently-used order: each
+	access moves a session to the end of the queue, and sessions are evicted
+	from the front.
+
+	:param idle_timeout: evict sessions that weren't accessed for this many seconds. If `None`, sessions never expire
+	:type idle_timeout: `float`
+	:param max_sessions: maximum number of sessions. When full, the least recently used session is evicted
+	:type max_sessions: `int`
+	:param on_evict: a function `f(key, session, reason)` that is called on each evicted session. `reason` is 'idle' or 'capacity'
+	:type on_evict: `callable`
+	:param clock: a function returning the current time in seconds (defaults to :func:`time.monotonic`)
+	:type clock: `callable`
+	:param can_evict: a function `f(key, session)` returning `False` for sessions that can't be evicted now (eg. because a request is using them). These are skipped, and the store may temporarily exceed `max_sessions`
+	:type can_evict: `callable`
+	"""
+
+	def __init__(self, idle_timeout=None, max_sessions=None, on_evict=None, clock=time.monotonic, can_evict=None):
+		if max_sessions is not None and max_sessions < 1:
+			raise ValueError("Maximum number of sessions must be positive")
+		self._logger = logging.getLogger(__name__ + ".SessionStore")
+		self.idle_timeout = idle_timeout
+		self.max_sessions = max_sessions
+		self.on_evict = on_evict
+		self.can_evict = can_evict
+		self._clock = clock
+		self._sessions = OrderedDict()
+		self._lock = threading.RLock()
+
+		self.created = 0
+		self.closed = 0
+		self.evicted_idle = 0
+		self.evicted_capacity = 0
+
+	def __len__(self):
+		with self._lock:
+			return len(self._sessions)
+
+	def __contains__(self, key):
+		with self._lock:
+			return key in self._sessions
+
+	def __getitem__(self, key):
+		result = self.get(key, _MISSING)
+		if result is _MISSING:
+			raise KeyError(key)
+		return result
+
+	def __setitem__(self, key, session):
+		self.put(key, session)
+
+	def __delitem__(self, key):
+		if self.pop(key, _MISSING) is _MISSING:
+			raise KeyError(key)
+
+	def __iter__(self):
+		return iter(self.keys())
+
+	def get(self, key, default=None):
+		"""
+		Return the session with the given key, and mark it as active.
+
+		:param key: a session key
+		:param default: the value to return if the session is not found
+		:return: the session, or `default`
+		"""
+		evicted = []
+		with self._lock:
+			self._expire(evicted)
+			if key in self._sessions:
+				self._sessions.move_to_end(key)
+				session, _ = self._sessions[key]
+				self._sessions[key] = (session, self._clock())
+				result = session
+			else:
+				result = default
+		self._notify(evicted)
+		return result
+
+	def put(self, key, session):
+		"""
+		Add (or replace) a session, evicting the least recently used one if
+		the store is full.
+
+		:param key: a session key
+		:param session: the session
+		"""
+		evicted = []
+		with self._lock:
+			self._expire(evicted)
+			if key in self._sessions:
+				self._sessions.move_to_end(key)
+			else:
+				self.created += 1
+			self._sessions[key] = (session, self._clock())
+			excess = len(self._sessions) - self.max_sessions if self.max_sessions is not None else 0
+			if excess > 0:
+				victims = []
+				for old_key, (old_session, _) in self._sessions.items():
+					if len(victims) == excess:
+						break
+					if old_key != key and self._can_evict(old_key, old_session):
+						victims.append(old_key)
+				for old_key in victims:
+					old_session, _ = self._sessions.pop(old_key)
+					self.evicted_capacity += 1
+					evicted.append((old_key, old_session, EVICTED_CAPACITY))
+		self._notify(evicted)
+
+	def touch(self, key):
+		"""
+		Mark a session as active, if it exists.
+
+		:param key: a session key
+		:return: `True` if the session exists
+		:rtype: `bool`
+		"""
+		return self.get(key, _MISSING) is not _MISSING
+
+	def pop(self, key, default=None):
+		"""
+		Remove a session that was closed (eg. because the user left), without
+		calling the eviction hook.
+
+		:param key: a session key
+		:param default: the value to return if the session is not found
+		:return: the removed session, or `default`
+		"""
+		with self._lock:
+			if key not in self._sessions:
+				return default
+			session, _ = self._sessions.pop(key)
+			self.closed += 1
+			return session
+
+	def keys(self):
+		"""
+		:return: the keys of the current sessions, from least to most recently used
+		:rtype: `list`
+		"""
+		with self._lock:
+			return list(self._sessions)
+
+	def values(self):
+		"""
+		:return: the current sessions, from least to most recently used
+		:rtype: `list`
+		"""
+		with self._lock:
+			return [session for session, _ in self._sessions.values()]
+
+	def evict_expired(self):
+		"""
+		Evict all the sessions that have been idle for longer than
+		`idle_timeout`.
+
+		:return: number of evicted sessions
+		:rtype: `int`
+		"""
+		evicted = []
+		with self._lock:
+			self._expire(evicted)
+		self._notify(evicted)
+		return len(evicted)
+
+	def stats(self):
+		"""
+		Return the session counts:
+
+		* `sessions`: number of current sessions
+		* `created`: number of sessions that were added
+		* `closed`: number of sessions that were removed with :meth:`pop`
+		* `evicted_idle`, `evicted_capacity`: number of evicted sessions, by reason
+
+		:return: session counts
+		:rtype: `dict`
+		"""
+		with self._lock:
+			return {
+				'sessions': len(self._sessions),
+				'created': self.created,
+				'closed': self.closed,
+				'evicted_idle': self.evicted_idle,
+				'evicted_capacity': self.evicted_capacity,
+			}
+
+	def __repr__(self):
+		return f"<SessionStore: {len(self)} sessions>"
+
+	def _expire(self, evicted):
+		if self.idle_timeout is None:
+			return
+		deadline = self._clock() - self.idle_timeout
+		expired = []
+		for key, (session, last_access) in self._sessions.items():
+			if last_access > deadline:
+				break
+			if self._can_evict(key, session):
+				expired.append(key)
+		for key in expired:
+			session, _ = self._sessions.pop(key)
+			self.evicted_idle += 1
+			evicted.append((key, session, EVICTED_IDLE))
+
+	def _can_evict(self, key, session):
+		return self.can_evict is None or self.can_evict(key, session)
+
+	def _notify(self, evicted):
+		"""Run the eviction hook outside of the lock, so it can use the store."""
+		for key, session, reason in evicted:
+			self._logger.debug("Evicting session %s (%s)", key, reason)
+			if self.on_evict is None:
+				continue
+			try:
+				self.on_evict(key, session, reason)
+			except Exception:
+				self._logger.exception("Eviction hook failed on session %s", key)
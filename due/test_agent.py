@@ -86,3 +86,15 @@ class TestAgent(unittest.TestCase):
 		loaded_alice = DummyAgent.load(deserialize(test_path))
 		self.assertEqual(self.alice.id, loaded_alice.id)
 
+
+	def test_learn_stream(self):
+		chunks = []
+		class ChunkAgent(DummyAgent):
+			def learn_episodes(self, episodes):
+				chunks.append(len(episodes))
+		agent = ChunkAgent('Carol')
+		result = agent.learn_stream((self.sample_episode for _ in range(7)), chunk_size=3)
+		self.assertEqual(result, 7)
+		self.assertEqual(chunks, [3, 3, 1])
+		with self.assertRaises(ValueError):
+			agent.learn_stream([self.sample_episode], chunk_size=0)
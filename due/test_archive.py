@@ -0,0 +1,92 @@
+import unittest
+import tempfile
+import os
+from datetime import datetime, timedelta
+
+from due.archive import EpisodeArchive
+from due.action import RecordedAction
+from due.episode import Episode
+from due.event import Event
+
+T_0 = datetime(2019, 12, 28, 12, 0, 0)
+
+def _sample_episode(start, n_events=3):
+	result = Episode('alice', 'bob')
+	result.timestamp = start
+	result.events = [
+		Event(Event.Type.Utterance, start + timedelta(seconds=i), 'alice' if i % 2 == 0 else 'bob', f'utterance {i}')
+		for i in range(n_events)
+	]
+	return result
+
+class TestEpisodeArchive(unittest.TestCase):
+
+	def test_add_get(self):
+		episodes = [_sample_episode(T_0 + timedelta(days=i)) for i in range(5)]
+		episodes[2].events.append(Event(Event.Type.Action, T_0 + timedelta(days=2, hours=1), 'bob', RecordedAction()))
+		episodes[2].events.append(Event(Event.Type.Leave, T_0 + timedelta(days=2, hours=2), 'bob', None))
+
+		with tempfile.TemporaryDirectory() as tmp_dir:
+			path = os.path.join(tmp_dir, 'episodes.duea')
+			with EpisodeArchive(path, mode='w') as archive:
+				archive.add_episodes(episodes)
+				self.assertEqual(archive.get(episodes[1].id), episodes[1])
+
+			with EpisodeArchive(path) as archive:
+				self.assertEqual(len(archive), 5)
+				self.assertEqual(archive.ids(), [e.id for e in episodes])
+				self.assertIn(episodes[3].id, archive)
+				self.assertNotIn('not-an-id', archive)
+				self.assertEqual(archive.get(episodes[2].id), episodes[2])
+				self.assertEqual(archive.get_at(4), episodes[4])
+				self.assertEqual(list(archive), episodes)
+				with self.assertRaises(KeyError):
+					archive.get('not-an-id')
+				with self.assertRaises(ValueError):
+					archive.add(_sample_episode(T_0))
+
+	def test_append(self):
+		episodes = [_sample_episode(T_0 + timedelta(days=i)) for i in range(4)]
+
+		with tempfile.TemporaryDirectory() as tmp_dir:
+			path = os.path.join(tmp_dir, 'episodes.duea')
+			with EpisodeArchive(path, mode='a') as archive:
+				archive.add_episodes(episodes[:2])
+
+			with EpisodeArchive(path, mode='a') as archive:
+				archive.add_episodes(episodes[2:])
+				with self.assertRaises(ValueError):
+					archive.add(episodes[0])
+
+			with EpisodeArchive(path) as archive:
+				self.assertEqual(list(archive), episodes)
+
+	def test_scan(self):
+		episodes = [_sample_episode(T_0 + timedelta(hours=i), n_events=10) for i in (3, 0, 2, 1)]
+
+		with tempfile.TemporaryDirectory() as tmp_dir:
+			path = os.path.join(tmp_dir, 'episodes.duea')
+			with EpisodeArchive(path, mode='w') as archive:
+				archive.add_episodes(episodes)
+
+			with EpisodeArchive(path) as archive:
+				scanned = list(archive.scan())
+				self.assertEqual(scanned, [episodes[i] for i in (1, 3, 2, 0)])
+
+				scanned = list(archive.scan(T_0 + timedelta(hours=1, seconds=5), T_0 + timedelta(hours=2)))
+				self.assertEqual(scanned, [episodes[3], episodes[2]])
+
+				scanned = list(archive.scan(start=T_0 + timedelta(seconds=5), end=T_0 + timedelta(seconds=5)))
+				self.assertEqual(scanned, [episodes[1]])
+
+				scanned = list(archive.scan(start=T_0 + timedelta(hours=4)))
+				self.assertEqual(scanned, [])
+
+	def test_empty(self):
+		with tempfile.TemporaryDirectory() as tmp_dir:
+			path = os.path.join(tmp_dir, 'episodes.duea')
+			EpisodeArchive(path, mode='w').close()
+
+			with EpisodeArchive(path) as archive:
+				self.assertEqual(len(archive), 0)
+				self.assertEqual(list(archive.scan()), [])
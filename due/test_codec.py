@@ -0,0 +1,86 @@
+import unittest
+import tempfile
+import os
+from io import BytesIO
+from datetime import datetime, timedelta
+
+from due.codec import *
+from due.persistence import serialize, deserialize
+from due.action import RecordedAction
+from due.episode import Episode
+from due.event import Event
+
+T_0 = datetime(2019, 12, 28, 12, 0, 0)
+
+def _sample_episode(start=T_0):
+	result = Episode('alice', 'bob')
+	result.timestamp = start
+	result.events = [
+		Event(Event.Type.Utterance, start + timedelta(seconds=1), 'alice', 'Hi!'),
+		Event(Event.Type.Utterance, start + timedelta(seconds=3, microseconds=12), 'bob', 'Hello, ça va? 🙂'),
+		Event(Event.Type.Action, start + timedelta(seconds=2), 'bob', RecordedAction()),
+		Event(Event.Type.Utterance, start + timedelta(seconds=4), 'alice', ''),
+		Event(Event.Type.Leave, start + timedelta(days=2), 'alice', None),
+	]
+	return result
+
+class TestCodec(unittest.TestCase):
+
+	def test_single(self):
+		episode = _sample_episode()
+		data = dumps(episode.save())
+		self.assertTrue(data.startswith(MAGIC))
+		self.assertEqual(Episode.load(loads(data)), episode)
+
+	def test_stream(self):
+		episodes = [_sample_episode(T_0 + timedelta(hours=i)) for i in range(10)]
+		f = BytesIO()
+		with EpisodeEncoder(f) as encoder:
+			for e in episodes:
+				encoder.write(e.save())
+
+		f.seek(0)
+		decoder = EpisodeDecoder(f)
+		self.assertFalse(decoder.single)
+		self.assertEqual([Episode.load(e) for e in decoder], episodes)
+
+	def test_string_table(self):
+		episodes = [_sample_episode(T_0 + timedelta(hours=i)) for i in range(10)]
+		one = len(dumps([episodes[0].save()]))
+		ten = len(dumps([e.save() for e in episodes]))
+		self.assertLess(ten - one, 9 * one)
+
+	def test_compact_input(self):
+		episode = Episode('alice', 'bob')
+		episode.timestamp = T_0
+		episode.events = [
+			Event(Event.Type.Utterance, T_0, 'alice', 'aaa'),
+			Event(Event.Type.Utterance, T_0, 'bob', 'bbb'),
+		]
+		saved = loads(dumps(episode.save(output_format='compact')))
+		self.assertEqual(Episode.load(saved), episode)
+
+	def test_single_overflow(self):
+		with self.assertRaises(ValueError):
+			with EpisodeEncoder(BytesIO(), single=True) as encoder:
+				encoder.write(_sample_episode().save())
+				encoder.write(_sample_episode().save())
+
+	def test_invalid(self):
+		with self.assertRaises(ValueError):
+			loads(b'not a binary stream')
+
+		data = dumps([_sample_episode().save()])
+		with self.assertRaises(ValueError):
+			loads(data[:-5])
+
+	def test_persistence(self):
+		episodes = [_sample_episode(T_0 + timedelta(hours=i)) for i in range(3)]
+		with tempfile.TemporaryDirectory() as tmp_dir:
+			path = os.path.join(tmp_dir, 'corpus.data')
+			serialize([e.save() for e in episodes], path, file_format='binary')
+			self.assertEqual([Episode.load(e) for e in deserialize(path)], episodes)
+
+			path = os.path.join(tmp_dir, 'episode.dueb')
+			serialize(episodes[0].save(), path, file_format='binary')
+			self.assertEqual(Episode.load(deserialize(path)), episodes[0])
@@ -1,12 +1,17 @@
 import unittest
 import tempfile
 import os
+import time
+import asyncio
+import threading
 
 from due.persistence import serialize, deserialize
+from due.agent import AsyncAgent
 from due.models.dummy import DummyAgent
 from due.event import Event
 from due.action import RecordedAction
 from due.episode import *
+from due.retention import RetentionPolicy
 
 from datetime import datetime
 
@@ -25,6 +30,56 @@ class RecordCallbackAgent(DummyAgent):
 	def leave_callback(self, episode):
 		self.recorded_leave += 1
 
+class EchoAgent(DummyAgent):
+
+	def __init__(self, id=None, delay=0.):
+		super().__init__(id)
+		self.delay = delay
+		self.running = 0
+		self.max_running = 0
+		self._lock = threading.Lock()
+
+	def utterance_callback(self, episode):
+		with self._lock:
+			self.running += 1
+			self.max_running = max(self.running, self.max_running)
+		try:
+			time.sleep(self.delay)
+		finally:
+			with self._lock:
+				self.running -= 1
+		text = episode.last_event(Event.Type.Utterance).payload
+		return [Event(Event.Type.Utterance, datetime.now(), self.id, text.upper())]
+
+class AsyncEchoAgent(AsyncAgent):
+
+	def __init__(self, id=None, delay=0.):
+		super().__init__(id)
+		self.delay = delay
+		self.running = 0
+		self.max_running = 0
+
+	def save(self):
+		return {}
+	def learn_episodes(self, episodes):
+		pass
+	def new_episode_callback(self, new_episode):
+		pass
+
+	async def utterance_callback(self, episode):
+		self.running += 1
+		self.max_running = max(self.running, self.max_running)
+		try:
+			await asyncio.sleep(self.delay)
+		finally:
+			self.running -= 1
+		text = episode.last_event(Event.Type.Utterance).payload
+		return [Event(Event.Type.Utterance, datetime.now(), self.id, text.upper())]
+	async def action_callback(self, episode):
+		pass
+	async def leave_callback(self, episode):
+		pass
+
 class TestEpisode(unittest.TestCase):
 
 	def test_add_event(self):
@@ -95,6 +150,27 @@ class TestEpisode(unittest.TestCase):
 		self.assertEqual(episode.last_event(Event.Type.Utterance), utterance2)
 		self.assertEqual(episode.last_event(Event.Type.Action), action1)
 
+	def test_retention(self):
+		alice = DummyAgent('Alice')
+		bob = RecordCallbackAgent('Bob')
+		episode = LiveEpisode(alice, bob, retention=RetentionPolicy(window=3))
+
+		for i in range(10):
+			alice.say(f"utterance {i}", episode)
+		alice.leave(episode)
+
+		self.assertEqual(len(episode.events), 11)
+		self.assertEqual(episode.events.spilled, 8)
+		self.assertEqual(bob.recorded_utterances, 10)
+		self.assertEqual(episode.last_event(Event.Type.Utterance).payload, "utterance 9")
+		self.assertEqual(extract_utterances(episode), [f"utterance {i}" for i in range(10)])
+
+		loaded_e = Episode.load(episode.save())
+		self.assertEqual(loaded_e, episode)
+
+		self.assertIs(type(LiveEpisode(alice, bob).events), list)
+		self.assertIs(type(LiveEpisode(alice, bob, retention=RetentionPolicy()).events), list)
+
 	def test_empty_episode_save_load(self):
 		alice = DummyAgent('Alice')
 		bob = DummyAgent('Bob')
@@ -150,6 +226,18 @@ class TestEpisode(unittest.TestCase):
 		assert Episode.load(saved_episode) == episode
 		assert Episode.load(saved_episode) == Episode.load(saved_episode_compact)
 
+	def test_multiple_invited_save_load(self):
+		episode = Episode('a', 'b')
+		episode.invited_ids = ['b', 'c']
+		episode.events = [
+			Event(Event.Type.Utterance, datetime(2019, 12, 28), 'a', 'aaa'),
+			Event(Event.Type.Utterance, datetime(2019, 12, 28), 'c', 'ccc'),
+		]
+		loaded_e = Episode.load(episode.save())
+		self.assertEqual(loaded_e.invited_id, 'b')
+		self.assertEqual(loaded_e.invited_ids, ['b', 'c'])
+		self.assertEqual(loaded_e, episode)
+
 	def test_equals_true(self):
 		e1 = Episode('a', 'b')
 		e1.events = [
@@ -211,6 +299,94 @@ class TestEpisode(unittest.TestCase):
 
 		assert e1 != e2
 
+class TestAsyncLiveEpisode(unittest.TestCase):
+
+	def test_sync_agent(self):
+		async def run():
+			alice = DummyAgent('Alice')
+			episode = AsyncLiveEpisode(alice, EchoAgent('Bob'))
+			alice.say('hello', episode)
+			self.assertEqual(episode.pending, 1)
+			await episode.join()
+			return episode
+		episode = asyncio.run(run())
+		self.assertEqual([e.payload for e in episode.events], ['hello', 'HELLO'])
+		self.assertEqual(episode.pending, 0)
+
+	def test_sync_agents_run_concurrently(self):
+		bob = EchoAgent('Bob', delay=0.2)
+		async def run():
+			episodes = [AsyncLiveEpisode(DummyAgent('Alice%s' % i), bob) for i in range(10)]
+			for e in episodes:
+				e.starter.say('hello', e)
+			await asyncio.gather(*[e.join() for e in episodes])
+			return episodes
+		episodes = asyncio.run(run())
+		self.assertGreater(bob.max_running, 1)
+		self.assertTrue(all(len(e.events) == 2 for e in episodes))
+
+	def test_async_agent(self):
+		bob = AsyncEchoAgent('Bob', delay=0.2)
+		async def run():
+			episodes = [AsyncLiveEpisode(DummyAgent('Alice%s' % i), bob) for i in range(100)]
+			for e in episodes:
+				e.starter.say('hello', e)
+			await asyncio.gather(*[e.join() for e in episodes])
+			return episodes
+		episodes = asyncio.run(run())
+		self.assertEqual(bob.max_running, 100)
+		self.assertTrue(all([e.payload for e in episode.events] == ['hello', 'HELLO'] for episode in episodes))
+
+	def test_async_agent_start_episode(self):
+		async def run():
+			alice = AsyncEchoAgent('Alice')
+			episode = alice.start_episode(DummyAgent('Bob'))
+			self.assertIsInstance(episode, AsyncLiveEpisode)
+			episode.add_event(Event(Event.Type.Utterance, datetime.now(), 'Bob', 'hi'))
+			await episode.join()
+			return episode
+		episode = asyncio.run(run())
+		self.assertEqual([e.payload for e in episode.events], ['hi', 'HI'])
+
+	def test_async_agent_in_sync_episode(self):
+		alice = DummyAgent('Alice')
+		episode = LiveEpisode(alice, AsyncEchoAgent('Bob'))
+		alice.say('hello', episode)
+		self.assertEqual([e.payload for e in episode.events], ['hello', 'HELLO'])
+
+	def test_cancel(self):
+		async def run():
+			alice = DummyAgent('Alice')
+			episode = AsyncLiveEpisode(alice, AsyncEchoAgent('Bob', delay=10))
+			alice.say('hello', episode)
+			await asyncio.sleep(0)
+			self.assertEqual(episode.cancel(), 1)
+			await episode.join()
+			return episode
+		episode = asyncio.run(run())
+		self.assertEqual([e.payload for e in episode.events], ['hello'])
+		self.assertEqual(episode.pending, 0)
+
+	def test_no_running_loop(self):
+		alice = DummyAgent('Alice')
+		episode = AsyncLiveEpisode(alice, EchoAgent('Bob'))
+		with self.assertRaises(RuntimeError):
+			alice.say('hello', episode)
+
+	def test_process_pool(self):
+		bob = EchoAgent('Bob')
+		async def run(pool):
+			alice = DummyAgent('Alice')
+			episode = AsyncLiveEpisode(alice, bob, executor=pool)
+			alice.say('hello', episode)
+			await episode.join()
+			return episode
+		with AgentProcessPool([bob, DummyAgent('Alice')], max_workers=2) as pool:
+			episode = asyncio.run(run(pool))
+			with self.assertRaises(ValueError):
+				pool.event_callback(DummyAgent('Carol'), episode.events[0], episode)
+		self.assertEqual([e.payload for e in episode.events], ['hello', 'HELLO'])
+
 class TestExtractUtterances(unittest.TestCase):
 
 	def test_utterances_only(self):
@@ -66,6 +66,14 @@ class TestEvent(unittest.TestCase):
 		self.assertEqual(loaded_e[2], a.id)
 		self.assertEqual(loaded_e[3], 'hello there')
 
+	def test_event_save_trace(self):
+		e = Event(Event.Type.Utterance, datetime.now(), 'Alice', "hello there")
+		self.assertNotIn('trace', e.save())
+		e.trace = {'tfidf.transform': 0.001}
+		loaded_e = Event.load(e.save())
+		self.assertEqual(loaded_e, e)
+		self.assertEqual(loaded_e.trace, {'tfidf.transform': 0.001})
+
 	def test_event_save_action(self):
 		"""Save and load an Action event that contains an object payload"""
 		a = RecordedAction()
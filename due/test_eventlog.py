@@ -0,0 +1,117 @@
+import unittest
+import tempfile
+import os
+import time
+from datetime import datetime
+
+from due.eventlog import EventLog
+from due.episode import LiveEpisode
+from due.models.dummy import DummyAgent
+from due.action import RecordedAction
+from due.event import Event
+from due.util import tracing
+
+class TestEventLog(unittest.TestCase):
+
+	def setUp(self):
+		self.alice = DummyAgent('Alice')
+		self.bob = DummyAgent('Bob')
+		self.agents = {'Alice': self.alice, 'Bob': self.bob}
+
+	def _talk(self, episode):
+		self.alice.say("Hi!", episode)
+		self.bob.say("Hello", episode)
+		self.alice.act_events([Event(Event.Type.Action, datetime.now(), self.alice.id, RecordedAction())], episode)
+
+	def test_sync_idle_log(self):
+		with tempfile.TemporaryDirectory() as temp_dir:
+			with EventLog(os.path.join(temp_dir, 'events.log'), sync_every=1000, sync_interval=0.01) as log:
+				episode = LiveEpisode(self.alice, self.bob, event_log=log)
+				self.alice.say("Hi!", episode)
+				deadline = time.monotonic() + 10
+				while log._unsynced and time.monotonic() < deadline:
+					time.sleep(0.01)
+				self.assertEqual(log._unsynced, 0)
+			self.assertFalse(log._sync_thread.is_alive())
+
+	def test_recover(self):
+		with tempfile.TemporaryDirectory() as tmp_dir:
+			path = os.path.join(tmp_dir, 'events.log')
+			log = EventLog(path)
+			e1 = LiveEpisode(self.alice, self.bob, event_log=log)
+			e2 = LiveEpisode(self.bob, self.alice, event_log=log)
+			self._talk(e1)
+			self._talk(e2)
+			self.bob.leave(e2)
+
+			# Simulate a crash: the log is never closed
+			recovered = EventLog(path).recover(self.agents)
+			recovered = {e.id: e for e in recovered}
+			self.assertEqual(set(recovered), {e1.id, e2.id})
+			self.assertEqual(recovered[e1.id], e1)
+			self.assertEqual(recovered[e2.id], e2)
+			self.assertIs(recovered[e1.id].starter, self.alice)
+			self.assertIs(recovered[e2.id].starter, self.bob)
+
+	def test_recover_after_compaction(self):
+		with tempfile.TemporaryDirectory() as tmp_dir:
+			path = os.path.join(tmp_dir, 'events.log')
+			log = EventLog(path, compact_every=4)
+			e1 = LiveEpisode(self.alice, self.bob, event_log=log)
+			self._talk(e1)
+			self._talk(e1)
+			self.assertTrue(os.path.exists(log.snapshot_path))
+
+			recovered_log = EventLog(path)
+			recovered = recovered_log.recover(self.agents)
+			self.assertEqual(recovered, [e1])
+
+			# Recovered episodes keep logging
+			self.alice.say("Still there?", recovered[0])
+			recovered_log.close()
+			self.assertEqual(EventLog(path).recover(self.agents), recovered)
+
+	def test_recover_traces(self):
+		with tempfile.TemporaryDirectory() as tmp_dir:
+			path = os.path.join(tmp_dir, 'events.log')
+			log = EventLog(path)
+			e1 = LiveEpisode(self.alice, self.bob, event_log=log)
+			tracing.enable()
+			try:
+				self._talk(e1)
+			finally:
+				tracing.disable()
+
+			recovered = EventLog(path).recover(self.agents)[0]
+			self.assertEqual([e.trace for e in recovered.events], [e.trace for e in e1.events])
+			self.assertTrue(all('episode.notify' in e.trace for e in recovered.events))
+
+	def test_forget(self):
+		with tempfile.TemporaryDirectory() as tmp_dir:
+			path = os.path.join(tmp_dir, 'events.log')
+			log = EventLog(path)
+			e1 = LiveEpisode(self.alice, self.bob, event_log=log)
+			e2 = LiveEpisode(self.alice, self.bob, event_log=log)
+			self._talk(e1)
+			log.forget(e1)
+			self._talk(e1)
+			self._talk(e2)
+			log.close()
+
+			self.assertEqual(EventLog(path).recover(self.agents), [e2])
+
+	def test_truncated_record(self):
+		with tempfile.TemporaryDirectory() as tmp_dir:
+			path = os.path.join(tmp_dir, 'events.log')
+			log = EventLog(path)
+			e1 = LiveEpisode(self.alice, self.bob, event_log=log)
+			self._talk(e1)
+			log.close()
+			with open(path, 'a') as f:
+				f.write('{"op": "event", "epis')
+
+			log = EventLog(path)
+			e2 = LiveEpisode(self.alice, self.bob, event_log=log)
+			self._talk(e2)
+			recovered = EventLog(path).recover(self.agents)
+			self.assertEqual(recovered, [e1, e2])
@@ -0,0 +1,139 @@
+import time
+import threading
+import unittest
+from datetime import datetime
+
+from due.action import Action, RecordedAction
+from due.event import Event
+from due.execution import *
+from due.models.dummy import DummyAgent
+
+class SleepAction(Action):
+
+	running = 0
+	max_running = 0
+	lock = threading.Lock()
+
+	def __init__(self, seconds=0.):
+		self.seconds = seconds
+
+	def run(self):
+		with SleepAction.lock:
+			SleepAction.running += 1
+			SleepAction.max_running = max(SleepAction.running, SleepAction.max_running)
+		try:
+			time.sleep(self.seconds)
+		finally:
+			with SleepAction.lock:
+				SleepAction.running -= 1
+		return self.seconds
+
+class BlockingAction(Action):
+
+	def __init__(self):
+		self.started = threading.Event()
+		self.release = threading.Event()
+
+	def run(self):
+		self.started.set()
+		self.release.wait(10)
+		return True
+
+class FailingAction(Action):
+
+	def run(self):
+		raise RuntimeError('Boom')
+
+class TestActionExecutor(unittest.TestCase):
+
+	def test_run_thread(self):
+		with ActionExecutor() as executor:
+			outcome = executor.run(SleepAction(0.01))
+		self.assertEqual(outcome.status, STATUS_DONE)
+		self.assertEqual(outcome.result, 0.01)
+		self.assertIsNone(outcome.error)
+		self.assertGreaterEqual(outcome.duration, 0.01)
+		self.assertEqual(executor.stats(), {'submitted': 1, 'running': 0, 'done': 1, 'failed': 0, 'timeout': 0})
+
+	def test_run_failed(self):
+		with ActionExecutor() as executor:
+			outcome = executor.run(FailingAction())
+		self.assertEqual(outcome.status, STATUS_FAILED)
+		self.assertIn('Boom', outcome.error)
+
+	def test_timeout_thread(self):
+		executor = ActionExecutor(max_workers=1, timeout=0.05)
+		action = BlockingAction()
+		outcome = executor.run(action)
+		self.assertEqual(outcome.status, STATUS_TIMEOUT)
+		self.assertGreaterEqual(outcome.duration, 0.05)
+		self.assertEqual(executor.stats()['running'], 1)
+		action.release.set()
+		executor.shutdown()
+		deadline = time.monotonic() + 10
+		while executor.stats()['running'] and time.monotonic() < deadline:
+			time.sleep(0.01)
+		self.assertEqual(executor.stats()['running'], 0)
+
+	def test_run_process(self):
+		with ActionExecutor(mode=MODE_PROCESS) as executor:
+			outcome = executor.run(SleepAction(0.01))
+			self.assertEqual(outcome.status, STATUS_DONE)
+			self.assertEqual(outcome.result, 0.01)
+
+			outcome = executor.run(FailingAction())
+			self.assertEqual(outcome.status, STATUS_FAILED)
+
+	def test_timeout_process(self):
+		with ActionExecutor(mode=MODE_PROCESS, timeout=0.1) as executor:
+			start = time.perf_counter()
+			outcome = executor.run(SleepAction(10))
+			self.assertLess(time.perf_counter() - start, 5)
+			self.assertEqual(outcome.status, STATUS_TIMEOUT)
+			self.assertEqual(executor.stats()['running'], 0)
+
+	def test_concurrency_cap(self):
+		SleepAction.max_running = 0
+		with ActionExecutor(max_workers=2) as executor:
+			futures = [executor.submit(Event(Event.Type.Action, datetime.now(), 'a', SleepAction(0.05))) for _ in range(6)]
+			outcomes = [f.result() for f in futures]
+		self.assertTrue(all(o.status == STATUS_DONE for o in outcomes))
+		self.assertEqual(SleepAction.max_running, 2)
+
+	def test_invalid(self):
+		with self.assertRaises(ValueError):
+			ActionExecutor(mode='fiber')
+		with self.assertRaises(ValueError):
+			ActionExecutor(max_workers=0)
+
+class TestAgentActions(unittest.TestCase):
+
+	def test_do_sync(self):
+		alice = DummyAgent('Alice')
+		episode = alice.start_episode(DummyAgent('Bob'))
+		action = RecordedAction()
+		alice.do(action, episode)
+		self.assertTrue(action.done)
+		self.assertEqual(episode.events[0].outcome.status, STATUS_DONE)
+		self.assertEqual(episode.events[0].outcome.result, True)
+
+	def test_do_sync_failure(self):
+		alice = DummyAgent('Alice')
+		episode = alice.start_episode(DummyAgent('Bob'))
+		with self.assertRaises(RuntimeError):
+			alice.do(FailingAction(), episode)
+		self.assertEqual(episode.events, [])
+
+	def test_do_background(self):
+		alice = DummyAgent('Alice')
+		alice.action_executor = ActionExecutor()
+		episode = alice.start_episode(DummyAgent('Bob'))
+		action = BlockingAction()
+		alice.do(action, episode)
+		alice.say('Still here', episode)
+		self.assertEqual(len(episode.events), 2)
+		self.assertIsNone(episode.events[0].outcome)
+
+		action.release.set()
+		alice.action_executor.shutdown()
+		self.assertEqual(episode.events[0].outcome.status, STATUS_DONE)
@@ -0,0 +1,54 @@
+import threading
+import unittest
+
+from due.learning import BackgroundLearner
+
+class TestBackgroundLearner(unittest.TestCase):
+
+	def test_coalesce(self):
+		batches = []
+		learner = BackgroundLearner(batches.append, coalesce_delay=0.2)
+		for i in range(5):
+			learner.submit(i)
+		self.assertTrue(learner.flush(timeout=5))
+		self.assertEqual(batches, [[0, 1, 2, 3, 4]])
+		self.assertEqual(learner.pending, 0)
+		learner.stop()
+
+	def test_max_batch_size(self):
+		batches = []
+		learner = BackgroundLearner(batches.append, coalesce_delay=0.2, max_batch_size=2)
+		for i in range(5):
+			learner.submit(i)
+		learner.stop()
+		self.assertEqual(batches, [[0, 1], [2, 3], [4]])
+		self.assertEqual(learner.stats()['batches'], 3)
+
+	def test_does_not_block(self):
+		started = threading.Event()
+		release = threading.Event()
+		def slow_learn(episodes):
+			started.set()
+			release.wait(10)
+		learner = BackgroundLearner(slow_learn, coalesce_delay=0)
+		learner.submit('episode')
+		self.assertTrue(started.wait(5))
+		learner.submit('other episode')
+		self.assertFalse(release.is_set())
+		self.assertEqual(learner.pending, 2)
+		release.set()
+		learner.stop()
+		self.assertEqual(learner.stats()['learned'], 2)
+
+	def test_errors(self):
+		def failing_learn(episodes):
+			raise RuntimeError('Boom')
+		learner = BackgroundLearner(failing_learn, coalesce_delay=0)
+		learner.submit('episode')
+		self.assertTrue(learner.flush(timeout=5))
+		self.assertEqual(learner.stats()['errors'], 1)
+		self.assertEqual(learner.stats()['learned'], 0)
+
+		learner.stop()
+		with self.assertRaises(RuntimeError):
+			learner.submit('episode')
@@ -0,0 +1,63 @@
+import unittest
+import asyncio
+
+from due.corpora import toy
+from due.event import Event
+from due.models.tfidf import TfIdfAgent
+from due.serve.http import HttpServer
+from due.loadtest import *
+
+def _agent():
+	agent = TfIdfAgent()
+	agent.learn_episodes(toy.episodes())
+	return agent
+
+def _starter_utterances(episode):
+	return [e for e in episode.events if e.type == Event.Type.Utterance and e.agent == episode.starter_id]
+
+class FailingTarget(EpisodeTarget):
+
+	async def utterance(self, session, text):
+		raise RuntimeError("expected")
+
+class TestLoadTest(unittest.TestCase):
+
+	def test_episode_target(self):
+		corpus = toy.corpus()
+		agent = _agent()
+		n_episodes = len(agent._past_episodes)
+		report = run(EpisodeTarget(agent, max_workers=4, leave=False), corpus, n_users=10, arrival_rate=1000, seed=42)
+		self.assertEqual(report.users, 10)
+		self.assertGreater(report.requests, 0)
+		self.assertEqual(report.errors, 0)
+		self.assertGreater(report.throughput, 0)
+		self.assertLessEqual(report.latency_p50, report.latency_p99)
+		self.assertEqual(len(agent._past_episodes), n_episodes)
+
+		# The same seed replays the same conversations
+		same = run(EpisodeTarget(agent, leave=False), corpus, n_users=10, arrival_rate=1000, seed=42)
+		self.assertEqual(same.requests, report.requests)
+
+	def test_max_utterances(self):
+		report = run(EpisodeTarget(_agent()), toy.corpus(), n_users=5, arrival_rate=1000, max_utterances=1)
+		self.assertEqual(report.requests, 5)
+
+	def test_errors(self):
+		report = run(FailingTarget(_agent()), toy.corpus(), n_users=3, arrival_rate=1000, max_utterances=1)
+		self.assertEqual(report.requests, 3)
+		self.assertEqual(report.errors, 3)
+		self.assertEqual(report.throughput, 0)
+
+	def test_http_target(self):
+		async def run_test():
+			server = HttpServer(_agent(), port=0, max_wait=0.001)
+			await server.start()
+			try:
+				return await load_test(HttpTarget(port=server.port), toy.corpus(), n_users=8, arrival_rate=1000, max_utterances=2), server.stats()
+			finally:
+				await server.stop()
+
+		report, stats = asyncio.run(run_test())
+		self.assertEqual(report.errors, 0)
+		self.assertEqual(report.requests + 8, stats['requests'])
+		self.assertEqual(stats['closed'], 8)
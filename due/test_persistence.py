@@ -46,3 +46,44 @@ class TestPersistence(object):
             serialize(TEST_OBJECT, path, file_format='pickle')
             with pytest.raises(ValueError):
                 deserialize(path)
+
+    def test_yaml_marker(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'saved.due')
+            serialize(TEST_OBJECT, path, file_format='yaml')
+            with open(path, 'rb') as f:
+                assert f.read().startswith(b'%YAML')
+            assert deserialize(path) == TEST_OBJECT
+
+    def test_json_no_extension(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'saved.due')
+            serialize(TEST_OBJECT, path, file_format='json')
+            assert deserialize(path) == TEST_OBJECT
+
+    def test_file_objects(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'saved.yaml')
+            serialize(TEST_OBJECT, path, file_format='yaml')
+            with open(path, 'r') as f:
+                assert deserialize(f) == TEST_OBJECT
+            with open(path, 'rb') as f:
+                assert deserialize(f) == TEST_OBJECT
+
+            path = os.path.join(d, 'saved.pickle')
+            serialize(TEST_OBJECT, path, file_format='pickle')
+            with open(path, 'rb') as f:
+                assert deserialize(f, allow_pickle=True) == TEST_OBJECT
+
+    def test_bytes(self):
+        assert deserialize(b'{"a": 1, "b": [1, 2]}') == {'a': 1, 'b': [1, 2]}
+        assert deserialize(b'a: 1\nb: [1, 2]\n') == {'a': 1, 'b': [1, 2]}
+        assert deserialize(b'{a: 1, b: [1, 2]}') == {'a': 1, 'b': [1, 2]}
+
+    def test_forced_format(self):
+        assert deserialize(b'{"a": 1}', file_format='yaml') == {'a': 1}
+        assert deserialize(b'{"a": 1}', file_format='json') == {'a': 1}
+        with pytest.raises(ValueError):
+            deserialize(b'{"a": 1}', file_format='pickle')
+        with pytest.raises(ValueError):
+            deserialize(b'{"a": 1}', file_format='xml')
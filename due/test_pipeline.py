@@ -0,0 +1,47 @@
+import unittest
+from collections import Counter
+
+from due.corpora import toy
+from due.models.tfidf import TfIdfAgent
+from due.pipeline import *
+
+class TestPipeline(unittest.TestCase):
+
+	def test_ingest(self):
+		episodes = list(toy.episodes())
+		serial = ingest(episodes, chunk_size=3)
+		self.assertEqual(len(serial.episodes), len(episodes))
+		self.assertEqual(len(serial.normalized_utterances), len(serial.utterances_metadata))
+		self.assertEqual([s.name for s in serial.stages], ['parse', 'normalize', 'reduce'])
+		self.assertEqual(serial.stages[1].items, len(serial.normalized_utterances))
+
+		expected_df = sum((Counter(set(u)) for u in serial.normalized_utterances), Counter())
+		self.assertEqual(serial.document_frequencies, expected_df)
+
+		parallel = ingest(toy.corpus(), n_jobs=2, chunk_size=2)
+		self.assertEqual(parallel.episodes, serial.episodes)
+		self.assertEqual(parallel.normalized_utterances, serial.normalized_utterances)
+		self.assertEqual(parallel.utterances_metadata, serial.utterances_metadata)
+		self.assertEqual(parallel.document_frequencies, serial.document_frequencies)
+
+	def test_learn_ingestion(self):
+		episodes = list(toy.episodes())
+		expected = TfIdfAgent()
+		expected.learn_episodes(episodes)
+
+		ingestion = ingest(toy.corpus(), chunk_size=4)
+		agent = TfIdfAgent()
+		agent.learn_ingestion(ingestion)
+		self.assertEqual(ingestion.stages[-1].name, 'index')
+
+		self.assertEqual(agent._normalized_past_utterances, expected._normalized_past_utterances)
+		self.assertEqual(agent._vectorizer.vocabulary_, expected._vectorizer.vocabulary_)
+		self.assertLess(abs(agent._vectorized_past_utterances - expected._vectorized_past_utterances).max(), 1e-12)
+		self.assertEqual(
+			[(m.episode.id, m.index) for m in agent._past_utterances_metadata],
+			[(m.episode.id, m.index) for m in expected._past_utterances_metadata]
+		)
+
+		# Learning more Episodes after an ingestion refits the whole index
+		agent.learn_episodes(episodes[:1])
+		self.assertEqual(agent._vectorized_past_utterances.shape[0], len(agent._normalized_past_utterances))
@@ -0,0 +1,60 @@
+import unittest
+import tempfile
+from datetime import datetime, timedelta
+
+from due.retention import RetentionPolicy, RetainedEvents
+from due.action import RecordedAction
+from due.event import Event
+
+T_0 = datetime(2019, 12, 28, 12, 0, 0)
+
+def _events(n):
+	result = []
+	for i in range(n):
+		timestamp = T_0 + timedelta(seconds=i)
+		if i % 5 == 3:
+			result.append(Event(Event.Type.Action, timestamp, 'alice', RecordedAction()))
+		else:
+			result.append(Event(Event.Type.Utterance, timestamp, 'alice' if i % 2 else 'bob', f'utterance {i}'))
+	return result
+
+class TestRetainedEvents(unittest.TestCase):
+
+	def test_unbounded(self):
+		events = _events(20)
+		retained = RetainedEvents()
+		retained.extend(events)
+		self.assertEqual(len(retained), 20)
+		self.assertEqual(retained.spilled, 0)
+		self.assertEqual(list(retained), events)
+		self.assertEqual(retained, events)
+		self.assertIs(retained[4], events[4])
+
+	def test_spill(self):
+		events = _events(50)
+		with tempfile.TemporaryDirectory() as tmp_dir:
+			retained = RetainedEvents(RetentionPolicy(window=10, spill_dir=tmp_dir))
+			retained.extend(events)
+			self.assertEqual(len(retained), 50)
+			self.assertEqual(retained.spilled, 40)
+			self.assertEqual(list(retained), events)
+			self.assertEqual(retained[0], events[0])
+			self.assertEqual(retained[39], events[39])
+			self.assertIs(retained[40], events[40])
+			self.assertIs(retained[-1], events[-1])
+			self.assertEqual(retained[5:45:10], events[5:45:10])
+			with self.assertRaises(IndexError):
+				retained[50]
+
+	def test_last(self):
+		events = _events(50)
+		retained = RetainedEvents(RetentionPolicy(window=1))
+		self.assertIsNone(retained.last())
+		self.assertIsNone(retained.last(Event.Type.Utterance))
+
+		retained.extend(events)
+		self.assertIs(retained.last(), events[49])
+		self.assertIs(retained.last(Event.Type.Utterance), events[49])
+		self.assertIs(retained.last(Event.Type.Action), events[48])
+		self.assertIs(retained.last([Event.Type.Action, Event.Type.Leave]), events[48])
+		self.assertIsNone(retained.last(Event.Type.Leave))
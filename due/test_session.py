@@ -0,0 +1,94 @@
+import unittest
+
+from due.session import *
+
+class FakeClock(object):
+
+	def __init__(self):
+		self.now = 0.
+
+	def __call__(self):
+		return self.now
+
+class TestSessionStore(unittest.TestCase):
+
+	def test_idle_timeout(self):
+		clock = FakeClock()
+		evicted = []
+		store = SessionStore(idle_timeout=10, on_evict=lambda *args: evicted.append(args), clock=clock)
+		store['a'] = 'A'
+		clock.now = 5
+		store['b'] = 'B'
+		clock.now = 9
+		self.assertEqual(store['a'], 'A')
+
+		clock.now = 16
+		self.assertEqual(store.evict_expired(), 1)
+		self.assertEqual(evicted, [('b', 'B', EVICTED_IDLE)])
+		self.assertIn('a', store)
+		self.assertNotIn('b', store)
+
+		clock.now = 100
+		self.assertIsNone(store.get('a'))
+		self.assertEqual(len(store), 0)
+		self.assertEqual(store.stats(), {'sessions': 0, 'created': 2, 'closed': 0, 'evicted_idle': 2, 'evicted_capacity': 0})
+
+	def test_max_sessions(self):
+		evicted = []
+		store = SessionStore(max_sessions=3, on_evict=lambda *args: evicted.append(args))
+		for i in range(3):
+			store[i] = str(i)
+		store.touch(0)
+		store[3] = '3'
+		self.assertEqual(evicted, [(1, '1', EVICTED_CAPACITY)])
+		self.assertEqual(store.keys(), [2, 0, 3])
+
+		for i in range(1000):
+			store[i] = str(i)
+		self.assertEqual(len(store), 3)
+		stats = store.stats()
+		self.assertEqual(stats['evicted_capacity'], stats['created'] - 3)
+
+	def test_can_evict(self):
+		clock = FakeClock()
+		evicted = []
+		busy = {'a'}
+		store = SessionStore(idle_timeout=10, max_sessions=2, on_evict=lambda *args: evicted.append(args), clock=clock, can_evict=lambda key, session: key not in busy)
+		store['a'] = 'A'
+		store['b'] = 'B'
+		store['c'] = 'C'
+		self.assertEqual(evicted, [('b', 'B', EVICTED_CAPACITY)])
+		self.assertEqual(store.keys(), ['a', 'c'])
+
+		busy.add('c')
+		store['d'] = 'D'
+		self.assertEqual(store.keys(), ['a', 'c', 'd'])
+
+		clock.now = 20
+		self.assertEqual(store.evict_expired(), 1)
+		self.assertEqual(store.keys(), ['a', 'c'])
+		busy.clear()
+		self.assertEqual(store.evict_expired(), 2)
+		self.assertEqual(len(store), 0)
+
+	def test_pop(self):
+		evicted = []
+		store = SessionStore(on_evict=lambda *args: evicted.append(args))
+		store['a'] = 'A'
+		self.assertEqual(store.pop('a'), 'A')
+		self.assertIsNone(store.pop('a'))
+		with self.assertRaises(KeyError):
+			del store['a']
+		with self.assertRaises(KeyError):
+			store['a']
+		self.assertEqual(evicted, [])
+		self.assertEqual(store.stats()['closed'], 1)
+
+	def test_hook_error(self):
+		def on_evict(key, session, reason):
+			raise RuntimeError("expected")
+
+		store = SessionStore(max_sessions=1, on_evict=on_evict)
+		store['a'] = 'A'
+		store['b'] = 'B'
+		self.assertEqual(store.keys(), ['b'])
@@ -0,0 +1,104 @@
+"""
+Concurrency helpers.
+
+API
+===
+"""
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+class KeyedExecutor(object):
+	"""
+	Run tasks on a pool of threads, so that tasks submitted with the same
+	**key** run one at a time, in submission order, while tasks with different
+	keys run in parallel. This is used to serve many users at once, preserving
+	the order of the messages of each user.
+
+	:param max_workers: the maximum number of threads
+	:type max_workers: `int`
+	:param thread_name_prefix: a prefix for the names of the worker threads
+	:type thread_name_prefix: `str`
+	"""
+
+	def __init__(self, max_workers=None, thread_name_prefix=''):
+		self._logger = logging.getLogger(__name__ + ".KeyedExecutor")
+		self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix=thread_name_prefix)
+		self._queues = {}
+		self._lock = threading.Lock()
+
+	def submit(self, key, fn, *args, **kwargs):
+		"""
+		Schedule `fn(*args, **kwargs)` to run after all the tasks previously
+		submitted with the same key.
+
+		:param key: the ordering key (eg. a user ID)
+		:type key: *hashable*
+		:param fn: a callable
+		:type fn: `callable`
+		:return: the Future of the task
+		:rtype: :class:`concurrent.futures.Future`
+		"""
+		future = Future()
+		with self._lock:
+			if key in self._queues:
+				self._queues[key].append((future, fn, args, kwargs))
+				return future
+			self._queues[key] = deque([(future, fn, args, kwargs)])
+		self._executor.submit(self._drain, key)
+		return future
+
+	def pending(self, key=None):
+		"""
+		Return the number of tasks that are queued or running, for the given
+		key or in total.
+
+		:param key: an ordering key. If `None`, count all the tasks
+		:type key: *hashable*
+		:return: number of pending tasks
+		:rtype: `int`
+		"""
+		with self._lock:
+			if key is not None:
+				return len(self._queues.get(key, ()))
+			return sum(len(q) for q in self._queues.values())
+
+	def shutdown(self, wait=True):
+		"""
+		Stop accepting tasks, and release the worker threads once the pending
+		ones are done.
+
+		:param wait: if `True`, block until the pending tasks are done
+		:type wait: `bool`
+		"""
+		self._executor.shutdown(wait=wait)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.shutdown()
+
+	def _drain(self, key):
+		"""
+		Run the tasks of a key until its queue is empty. The queue is removed
+		only when it's empty, so no other worker can run the same key.
+		"""
+		while True:
+			with self._lock:
+				future, fn, args, kwargs = self._queues[key][0]
+
+			if future.set_running_or_notify_cancel():
+				try:
+					future.set_result(fn(*args, **kwargs))
+				except BaseException as e:
+					self._logger.exception("Task for key %s failed", key)
+					future.set_exception(e)
+
+			with self._lock:
+				queue = self._queues[key]
+				queue.popleft()
+				if not queue:
+					del self._queues[key]
+					return
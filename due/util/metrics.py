@@ -0,0 +1,674 @@
+"""
+Counters, gauges and histograms describing a served Agent under load (eg.
+events per second, active Episodes, reply latency, cache hit rate, learning
+queue depth, index size), exposed in the `Prometheus text format
+<https://prometheus.io/docs/instrumenting/exposition_formats/>`_.
+
+Metrics are registered in a :class:`MetricsRegistry`. The serving channels
+(:mod:`due.serve`), :class:`due.episode.LiveEpisode`, the learners and the
+Agents update the global :data:`REGISTRY`:
+
+.. code-block:: python
+
+	from due.util import metrics
+
+	REPLIES = metrics.REGISTRY.counter('replies_total', "Replies sent", ['kind'])
+	REPLIES.labels(kind='text').inc()
+
+	LATENCY = metrics.REGISTRY.histogram('reply_latency_seconds', "Reply latency")
+	LATENCY.observe(0.012)
+
+Counters and histograms keep one cell per thread, which only that thread
+writes to: updating them takes no lock, and cells are summed when the metrics
+are read. Every sample also carries the registry's **default labels**, which
+the `serve()` functions of the serving channels set, once per process, to the
+class of the served Agent and the name of the channel (eg.
+`agent_class="TfIdfAgent", channel="http"`). Metrics of the single servers,
+such as `due_active_episodes`, have a `channel` label of their own, so that
+servers of different channels in the same process are told apart.
+
+Metrics are exposed by :class:`MetricsServer` (a local `GET /metrics`
+endpoint), by :class:`MetricsFileWriter` (a file that is periodically
+rewritten, eg. for the node exporter's textfile collector), or by the
+`GET /metrics` endpoint of :class:`due.serve.http.HttpServer`:
+
+.. code-block:: python
+
+	server = metrics.MetricsServer(port=9464).start()
+	...
+	server.stop()
+
+API
+===
+"""
+import os
+import re
+import math
+import time
+import bisect
+import logging
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DEFAULT_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1., 2.5, 5., 10.)
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 9464
+DEFAULT_WRITE_INTERVAL = 15.
+
+TYPE_COUNTER = 'counter'
+TYPE_GAUGE = 'gauge'
+TYPE_HISTOGRAM = 'histogram'
+
+_METRIC_NAME = re.compile(r'^[a-zA-Z_:][a-zA-Z0-9_:]*$')
+_LABEL_NAME = re.compile(r'^[a-zA-Z_][a-zA-Z0-9_]*$')
+
+class MetricsRegistry(object):
+	"""
+	A collection of metrics, that can be rendered in the Prometheus text
+	format. Metrics are created with :meth:`counter`, :meth:`gauge` and
+	:meth:`histogram`, which return the existing metric if one with the same
+	name was already registered, so that modules can declare the metrics they
+	share independently.
+
+	:param default_labels: labels added to every sample
+	:type default_labels: `dict`
+	"""
+
+	def __init__(self, default_labels=None):
+		self._metrics = {}
+		self._lock = threading.Lock()
+		self.default_labels = {}
+		self.set_default_labels(**(default_labels or {}))
+
+	def set_default_labels(self, **labels):
+		"""
+		Set labels that are added to every sample (eg. `channel='http'`).
+		Labels of the single metrics take precedence over default labels with
+		the same name.
+
+		:param labels: label names and values
+		"""
+		for name in labels:
+			_check_label_name(name)
+		with self._lock:
+			self.default_labels = {**self.default_labels, **{k: str(v) for k, v in labels.items()}}
+
+	def counter(self, name, documentation, labelnames=()):
+		"""
+		Return the counter with the given name, creating it if needed.
+
+		:param name: the name of the metric (eg. 'due_events_total')
+		:type name: `str`
+		:param documentation: a description of the metric
+		:type documentation: `str`
+		:param labelnames: the names of the metric's labels
+		:type labelnames: `list` of `str`
+		:return: the counter
+		:rtype: :class:`Metric`
+		"""
+		return self._get_or_create(TYPE_COUNTER, name, documentation, labelnames)
+
+	def gauge(self, name, documentation, labelnames=()):
+		"""
+		Return the gauge with the given name, creating it if needed. See
+		:meth:`counter` for the parameters.
+
+		:return: the gauge
+		:rtype: :class:`Metric`
+		"""
+		return self._get_or_create(TYPE_GAUGE, name, documentation, labelnames)
+
+	def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+		"""
+		Return the histogram with the given name, creating it if needed. See
+		:meth:`counter` for the other parameters.
+
+		:param buckets: upper bounds of the histogram buckets
+		:type buckets: `list` of `float`
+		:return: the histogram
+		:rtype: :class:`Metric`
+		"""
+		return self._get_or_create(TYPE_HISTOGRAM, name, documentation, labelnames, buckets)
+
+	def get(self, name):
+		"""
+		:param name: the name of a metric
+		:type name: `str`
+		:return: the metric with the given name, or `None`
+		:rtype: :class:`Metric`
+		"""
+		return self._metrics.get(name)
+
+	def render(self):
+		"""
+		Render the current value of every metric in the Prometheus text
+		format, version 0.0.4.
+
+		:return: the metrics, as text
+		:rtype: `str`
+		"""
+		with self._lock:
+			metrics = sorted(self._metrics.values(), key=lambda m: m.name)
+			default_labels = self.default_labels
+		lines = []
+		for metric in metrics:
+			lines.append(f"# HELP {metric.name} {_escape_help(metric.documentation)}")
+			lines.append(f"# TYPE {metric.name} {metric.type}")
+			for suffix, labels, value in metric.samples():
+				labels = {**default_labels, **labels}
+				lines.append(f"{metric.name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+		return '\n'.join(lines) + '\n'
+
+	def _get_or_create(self, metric_type, name, documentation, labelnames, buckets=None):
+		labelnames = tuple(labelnames)
+		with self._lock:
+			metric = self._metrics.get(name)
+			if metric is None:
+				metric = self._metrics[name] = Metric(metric_type, name, documentation, labelnames, buckets)
+			elif metric.type != metric_type or metric.labelnames != labelnames:
+				raise ValueError(f"Metric '{name}' is already registered as a {metric.type} with labels {metric.labelnames}")
+			return metric
+
+class Metric(object):
+	"""
+	A metric family: a counter, gauge or histogram, with one child per
+	combination of label values. Metrics without labels can be updated
+	directly (eg. `metric.inc()`); the others through :meth:`labels` (eg.
+	`metric.labels(type='Utterance').inc()`). Use
+	:meth:`MetricsRegistry.counter`, :meth:`MetricsRegistry.gauge` or
+	:meth:`MetricsRegistry.histogram` to create metrics.
+
+	:param metric_type: one of `TYPE_COUNTER`, `TYPE_GAUGE`, `TYPE_HISTOGRAM`
+	:type metric_type: `str`
+	:param name: the name of the metric
+	:type name: `str`
+	:param documentation: a description of the metric
+	:type documentation: `str`
+	:param labelnames: the names of the metric's labels
+	:type labelnames: `tuple` of `str`
+	:param buckets: upper bounds of the histogram buckets (histograms only)
+	:type buckets: `list` of `float`
+	"""
+
+	def __init__(self, metric_type, name, documentation, labelnames=(), buckets=None):
+		if metric_type not in _CHILD_CLASSES:
+			raise ValueError(f"Unknown metric type: {metric_type}")
+		if not _METRIC_NAME.match(name):
+			raise ValueError(f"Invalid metric name: '{name}'")
+		for labelname in labelnames:
+			_check_label_name(labelname)
+			if metric_type == TYPE_HISTOGRAM and labelname == 'le':
+				raise ValueError("Histograms cannot have a label named 'le'")
+		self.type = metric_type
+		self.name = name
+		self.documentation = documentation
+		self.labelnames = tuple(labelnames)
+		self.buckets = None
+		if metric_type == TYPE_HISTOGRAM:
+			self.buckets = tuple(sorted(float(b) for b in (buckets or DEFAULT_BUCKETS) if b != math.inf))
+		self._children = {}
+		self._lock = threading.Lock()
+
+	def labels(self, **labels):
+		"""
+		Return the child of the metric with the given label values.
+
+		:param labels: a value for each label of the metric
+		:return: the child metric
+		:rtype: :class:`Counter`, :class:`Gauge` or :class:`Histogram`
+		"""
+		if set(labels) != set(self.labelnames):
+			raise ValueError(f"Metric '{self.name}' expects labels {self.labelnames}, got {tuple(labels)}")
+		return self._child(tuple(str(labels[n]) for n in self.labelnames))
+
+	def inc(self, amount=1.):
+		"""Increment a metric without labels (see :meth:`Counter.inc`, :meth:`Gauge.inc`)."""
+		self._unlabeled().inc(amount)
+
+	def dec(self, amount=1.):
+		"""Decrement a gauge without labels (see :meth:`Gauge.dec`)."""
+		self._unlabeled().dec(amount)
+
+	def set(self, value):
+		"""Set a gauge without labels (see :meth:`Gauge.set`)."""
+		self._unlabeled().set(value)
+
+	def set_function(self, f):
+		"""Compute a gauge without labels with a function (see :meth:`Gauge.set_function`)."""
+		self._unlabeled().set_function(f)
+
+	def observe(self, value):
+		"""Observe a value in a histogram without labels (see :meth:`Histogram.observe`)."""
+		self._unlabeled().observe(value)
+
+	def samples(self):
+		"""
+		Return the samples of the metric.
+
+		:return: (name suffix, labels, value) tuples
+		:rtype: `list` of `tuple`
+		"""
+		with self._lock:
+			children = sorted(self._children.items())
+		result = []
+		for values, child in children:
+			labels = dict(zip(self.labelnames, values))
+			result.extend((suffix, {**labels, **extra}, value) for suffix, extra, value in child.samples())
+		return result
+
+	def _unlabeled(self):
+		if self.labelnames:
+			raise ValueError(f"Metric '{self.name}' has labels {self.labelnames}: use labels()")
+		return self._child(())
+
+	def _child(self, values):
+		child = self._children.get(values)
+		if child is None:
+			with self._lock:
+				child = self._children.get(values)
+				if child is None:
+					child_class = _CHILD_CLASSES[self.type]
+					child = child_class(self.buckets) if self.type == TYPE_HISTOGRAM else child_class()
+					self._children[values] = child
+		return child
+
+class Counter(object):
+	"""
+	A value that only goes up (eg. the number of Events). Each thread
+	increments its own cell, without locking.
+	"""
+
+	def __init__(self):
+		self._cells = _ThreadCells(lambda: [0.])
+
+	def inc(self, amount=1.):
+		"""
+		Increment the counter.
+
+		:param amount: a non-negative amount
+		:type amount: `float`
+		"""
+		if amount < 0:
+			raise ValueError("Counters can only be incremented by non-negative amounts")
+		self._cells.get()[0] += amount
+
+	@property
+	def value(self):
+		"""The current value of the counter"""
+		return sum(cell[0] for cell in self._cells.all())
+
+	def samples(self):
+		return [('', {}, self.value)]
+
+class Gauge(object):
+	"""
+	A value that goes up and down (eg. the number of active Episodes), or
+	that is computed by a function when metrics are read.
+	"""
+
+	def __init__(self):
+		self._value = 0.
+		self._function = None
+		self._lock = threading.Lock()
+
+	def set(self, value):
+		"""
+		Set the gauge.
+
+		:param value: the new value
+		:type value: `float`
+		"""
+		with self._lock:
+			self._value = float(value)
+
+	def inc(self, amount=1.):
+		"""
+		Increment the gauge.
+
+		:param amount: the increment
+		:type amount: `float`
+		"""
+		with self._lock:
+			self._value += amount
+
+	def dec(self, amount=1.):
+		"""
+		Decrement the gauge.
+
+		:param amount: the decrement
+		:type amount: `float`
+		"""
+		with self._lock:
+			self._value -= amount
+
+	def set_function(self, f):
+		"""
+		Compute the gauge by calling `f` whenever metrics are read (eg.
+		`len(sessions)`). `f` should be fast, and safe to call from any thread.
+		Pass `None` to go back to the set value.
+
+		:param f: a function returning the value of the gauge
+		:type f: `callable`
+		"""
+		self._function = f
+
+	@property
+	def value(self):
+		"""The current value of the gauge"""
+		f = self._function
+		if f is not None:
+			return float(f())
+		return self._value
+
+	def samples(self):
+		return [('', {}, self.value)]
+
+class Histogram(object):
+	"""
+	Count observations (eg. reply latencies) in buckets. Each thread updates
+	its own cell, without locking.
+
+	:param buckets: upper bounds of the buckets, in increasing order
+	:type buckets: `tuple` of `float`
+	"""
+
+	def __init__(self, buckets=DEFAULT_BUCKETS):
+		self.buckets = tuple(buckets)
+		# Cell layout: a count per bucket, the count of values over the last bucket, the sum
+		size = len(self.buckets) + 2
+		self._cells = _ThreadCells(lambda: [0] * (size - 1) + [0.])
+
+	def observe(self, value):
+		"""
+		Observe a value.
+
+		:param value: the value
+		:type value: `float`
+		"""
+		cell = self._cells.get()
+		cell[bisect.bisect_left(self.buckets, value)] += 1
+		cell[-1] += value
+
+	def time(self):
+		"""
+		Return a context manager observing the duration of its block, in
+		seconds.
+		"""
+		return _Timer(self)
+
+	@property
+	def count(self):
+		"""The number of observed values"""
+		return sum(sum(cell[:-1]) for cell in self._cells.all())
+
+	@property
+	def sum(self):
+		"""The sum of the observed values"""
+		return sum(cell[-1] for cell in self._cells.all())
+
+	def samples(self):
+		totals = [0] * (len(self.buckets) + 2)
+		for cell in self._cells.all():
+			for i, value in enumerate(cell):
+				totals[i] += value
+
+		result = []
+		cumulative = 0
+		for bound, count in zip(self.buckets + (math.inf,), totals[:-1]):
+			cumulative += count
+			result.append(('_bucket', {'le': _format_value(bound)}, cumulative))
+		result.append(('_sum', {}, totals[-1]))
+		result.append(('_count', {}, cumulative))
+		return result
+
+_CHILD_CLASSES = {
+	TYPE_COUNTER: Counter,
+	TYPE_GAUGE: Gauge,
+	TYPE_HISTOGRAM: Histogram,
+}
+
+REGISTRY = MetricsRegistry()
+"""The registry updated by Due's modules"""
+
+def set_default_labels(**labels):
+	"""
+	Set default labels of the global :data:`REGISTRY` (see
+	:meth:`MetricsRegistry.set_default_labels`).
+	"""
+	REGISTRY.set_default_labels(**labels)
+
+def merge(texts):
+	"""
+	Merge metrics rendered by many registries (eg. by the workers of
+	:mod:`due.serve.prefork`) in a single text, with one `HELP` and `TYPE`
+	line per metric. The samples of each registry should be told apart by
+	their default labels.
+
+	:param texts: metrics in the Prometheus text format
+	:type texts: `list` of `str`
+	:return: the merged metrics
+	:rtype: `str`
+	"""
+	families = {}
+	for text in texts:
+		name = None
+		for line in text.splitlines():
+			if not line:
+				continue
+			if line.startswith('# HELP ') or line.startswith('# TYPE '):
+				name = line.split(' ', 3)[2]
+				headers, _ = families.setdefault(name, ([], []))
+				if line not in headers:
+					headers.append(line)
+			elif not line.startswith('#'):
+				families.setdefault(name, ([], []))[1].append(line)
+	lines = [line for headers, samples in families.values() for line in headers + samples]
+	return '\n'.join(lines) + '\n'
+
+#
+# Exporters
+#
+
+class MetricsServer(object):
+	"""
+	Serve the metrics of a registry over HTTP, on `GET /metrics`, from a
+	background thread. By default the server only listens on the local
+	interface. If `port` is 0, a free port is chosen, and the `port`
+	attribute is updated once the server is started.
+
+	:param registry: the registry to serve (defaults to :data:`REGISTRY`)
+	:type registry: :class:`MetricsRegistry`
+	:param host: the address to listen on
+	:type host: `str`
+	:param port: the port to listen on
+	:type port: `int`
+	"""
+
+	def __init__(self, registry=None, host=DEFAULT_HOST, port=DEFAULT_PORT):
+		self._logger = logging.getLogger(__name__ + ".MetricsServer")
+		self.registry = registry if registry is not None else REGISTRY
+		self.host = host
+		self.port = port
+		self._server = None
+		self._thread = None
+
+	def start(self):
+		"""
+		Start serving in a background thread.
+
+		:return: the server itself
+		:rtype: :class:`MetricsServer`
+		"""
+		self._server = ThreadingHTTPServer((self.host, self.port), _handler_class(self.registry, self._logger))
+		self._server.daemon_threads = True
+		self.port = self._server.server_address[1]
+		self._thread = threading.Thread(target=self._server.serve_forever, name='due-metrics', daemon=True)
+		self._thread.start()
+		self._logger.info("Serving metrics on http://%s:%s/metrics", self.host, self.port)
+		return self
+
+	def stop(self):
+		"""
+		Stop serving.
+		"""
+		if self._server is not None:
+			self._server.shutdown()
+			self._server.server_close()
+			self._thread.join()
+			self._server = None
+			self._thread = None
+
+class MetricsFileWriter(object):
+	"""
+	Write the metrics of a registry to a file every `interval` seconds, from
+	a background thread. The file is replaced atomically, so readers never see
+	a partial file.
+
+	:param path: the path of the file (eg. '/var/lib/node_exporter/due.prom')
+	:type path: `str`
+	:param registry: the registry to write (defaults to :data:`REGISTRY`)
+	:type registry: :class:`MetricsRegistry`
+	:param interval: how often to write the file, in seconds
+	:type interval: `float`
+	"""
+
+	def __init__(self, path, registry=None, interval=DEFAULT_WRITE_INTERVAL):
+		self._logger = logging.getLogger(__name__ + ".MetricsFileWriter")
+		self.path = path
+		self.registry = registry if registry is not None else REGISTRY
+		self.interval = interval
+		self._stopped = threading.Event()
+		self._thread = None
+
+	def write(self):
+		"""
+		Write the current metrics to the file.
+		"""
+		folder = os.path.dirname(os.path.abspath(self.path))
+		fd, tmp_path = tempfile.mkstemp(prefix='.tmp-', dir=folder)
+		try:
+			with os.fdopen(fd, 'w', encoding='utf-8') as f:
+				f.write(self.registry.render())
+			os.replace(tmp_path, self.path)
+		except BaseException:
+			os.unlink(tmp_path)
+			raise
+
+	def start(self):
+		"""
+		Start writing the file in a background thread.
+
+		:return: the writer itself
+		:rtype: :class:`MetricsFileWriter`
+		"""
+		self._stopped.clear()
+		self._thread = threading.Thread(target=self._run, name='due-metrics-writer', daemon=True)
+		self._thread.start()
+		return self
+
+	def stop(self):
+		"""
+		Stop writing, and write the file one last time.
+		"""
+		self._stopped.set()
+		if self._thread is not None:
+			self._thread.join()
+			self._thread = None
+		self.write()
+
+	def _run(self):
+		while True:
+			try:
+				self.write()
+			except Exception:
+				self._logger.exception("Could not write metrics to %s", self.path)
+			if self._stopped.wait(self.interval):
+				break
+
+#
+# Helpers
+#
+
+class _ThreadCells(object):
+	"""
+	Per-thread mutable cells. Each cell is only written by its own thread,
+	and all of them can be read from any thread. Cells of finished threads are
+	kept, so that their counts are not lost.
+	"""
+
+	def __init__(self, new_cell_f):
+		self._new_cell_f = new_cell_f
+		self._cells = {}
+		self._lock = threading.Lock()
+
+	def get(self):
+		ident = threading.get_ident()
+		cell = self._cells.get(ident)
+		if cell is None:
+			cell = self._new_cell_f()
+			with self._lock:
+				self._cells[ident] = cell
+		return cell
+
+	def all(self):
+		with self._lock:
+			return list(self._cells.values())
+
+class _Timer(object):
+
+	__slots__ = ('histogram', 'start')
+
+	def __init__(self, histogram):
+		self.histogram = histogram
+
+	def __enter__(self):
+		self.start = time.perf_counter()
+		return self
+
+	def __exit__(self, *args):
+		self.histogram.observe(time.perf_counter() - self.start)
+
+def _handler_class(registry, logger):
+	class Handler(BaseHTTPRequestHandler):
+
+		def do_GET(self):
+			if self.path.split('?')[0] != '/metrics':
+				self.send_error(404)
+				return
+			data = registry.render().encode('utf-8')
+			self.send_response(200)
+			self.send_header('Content-Type', CONTENT_TYPE)
+			self.send_header('Content-Length', str(len(data)))
+			self.end_headers()
+			self.wfile.write(data)
+
+		def log_message(self, format, *args):
+			logger.debug(format, *args)
+
+	return Handler
+
+def _check_label_name(name):
+	if not _LABEL_NAME.match(name) or name.startswith('__'):
+		raise ValueError(f"Invalid label name: '{name}'")
+
+def _format_labels(labels):
+	if not labels:
+		return ''
+	return '{' + ','.join(f'{k}="{_escape_label_value(v)}"' for k, v in labels.items()) + '}'
+
+def _escape_label_value(value):
+	return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _escape_help(text):
+	return text.replace('\\', '\\\\').replace('\n', '\\n')
+
+def _format_value(value):
+	if value == math.inf:
+		return '+Inf'
+	if value == -math.inf:
+		return '-Inf'
+	if value != value:
+		return 'NaN'
+	return repr(float(value))
@@ -1,33 +1,70 @@
 """
 This module defines the way resource files (eg. serialized models, corpora...) are
 downloaded, cached and retrieved in Due.
+
+Besides resource files, the Resource Manager keeps a cache of **derived
+artifacts**: files that are computed out of a resource (eg. a parsed corpus),
+and that can be reused as long as the resource does not change. Artifacts are
+stored in the `cache` subfolder of the resource folder, and they are keyed by
+resource name, artifact version and resource fingerprint (see
+:meth:`ResourceManager.cached_artifact`).
+
+Opened archives are kept in a small pool of handles, so that repeated reads of
+files in the same archive don't parse its central directory again. Archive
+members can also be extracted once in the cache, and opened (or memory-mapped)
+directly from there (see :meth:`ResourceManager.resource_file_path`).
 """
 import os
+import shutil
 import logging
+import tempfile
+import threading
 from io import TextIOWrapper
 from zipfile import ZipFile
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
 
 import yaml
 from magic import Magic
 
+from due.util import metrics
+
 DEFAULT_RESOURCE_FOLDER = '~/.due/resources'
 
+CACHE_FOLDER = 'cache'
+EXTRACTED_VERSION = 'extracted'
+DEFAULT_MAX_OPEN_ARCHIVES = 4
+
+_CACHE_HITS = metrics.REGISTRY.counter('due_resource_cache_hits_total', "Artifacts found in the resource cache", ['resource'])
+_CACHE_MISSES = metrics.REGISTRY.counter('due_resource_cache_misses_total', "Artifacts built because they were not in the resource cache", ['resource'])
+
 ResourceRecord = namedtuple('ResourceRecord', ['name', 'description', 'url', 'filename'])
+CacheRecord = namedtuple('CacheRecord', ['name', 'version', 'fingerprint', 'path', 'size', 'last_used'])
 
 class ResourceManager(object):
 	"""
 	The Resource Manager handles the download, caching and retrieval of resources
 	in a project.
+
+	:param resource_folder: the folder where resources are stored
+	:type resource_folder: `str`
+	:param max_open_archives: maximum number of archive handles kept open
+	:type max_open_archives: `int`
 	"""
 
-	def __init__(self, resource_folder=DEFAULT_RESOURCE_FOLDER):
+	def __init__(self, resource_folder=DEFAULT_RESOURCE_FOLDER, max_open_archives=DEFAULT_MAX_OPEN_ARCHIVES):
 		self._logger = logging.getLogger(__name__)
 		self.resource_folder = os.path.expanduser(resource_folder)
 		if not os.path.exists(self.resource_folder):
 			os.makedirs(self.resource_folder)
+		self.cache_folder = os.path.join(self.resource_folder, CACHE_FOLDER)
 		self.resources = {}
 		self.resource_filenames = {}
+		self.cache_hits = 0
+		self.cache_misses = 0
+		self.max_open_archives = max_open_archives
+		self._archives = OrderedDict()
+		self._mime_types = {}
+		self._lock = threading.RLock()
 
 	def register_resource(self, name, description, url, filename):
 		"""
@@ -92,31 +129,102 @@ class ResourceManager(object):
 		
 		return open(self.resource_path(name), mode)
 
-	def open_resource_file(self, name, filename, binary=False, encoding='utf-8'):
+	def open_resource_file(self, name, filename, binary=False, encoding='utf-8', extract=False):
 		"""
 		If the given resource is a compressed archive, extract the given filename
 		and return a file pointer to the extracted file.
 
 		Currently, only **ZIP** files are supported.
 
+		By default, the file is decompressed on the fly from a pooled handle of
+		the archive. If `extract` is `True`, the file is extracted in the cache
+		the first time it's requested, and then opened directly (see
+		:meth:`resource_file_path`).
+
 		:param name: the name of the resource containing the file
 		:type name: `str`
 		:param filename: the name of the file to extract and return
 		:type filename: `str`
 		:param binary: if True, open the file in binary mode ("rb")
+		:param encoding: the text encoding, if `binary` is `False`
+		:type encoding: `str`
+		:param extract: open the file from the extraction cache
+		:type extract: `bool`
 		"""
-		self._error_if_not_found(name)
+		if extract:
+			path = self.resource_file_path(name, filename)
+			return open(path, 'rb') if binary else open(path, 'r', encoding=encoding)
 
+		f = self._archive(name).open(filename, mode='r')
+		return f if binary else TextIOWrapper(f, encoding) # TODO: test encoding
+
+	def resource_file_path(self, name, filename):
+		"""
+		Extract a file from the given archive resource into the cache, and
+		return its path. The file is extracted only once per version of the
+		archive, so the returned path can be opened directly or memory-mapped
+		(eg. with :mod:`mmap` or :func:`numpy.memmap`).
+
+		:param name: the name of the resource containing the file
+		:type name: `str`
+		:param filename: the name of the file in the archive
+		:type filename: `str`
+		:return: the path of the extracted file
+		:rtype: `str`
+		"""
+		archive = self._archive(name)
+		extracted_folder = self.cached_artifact(name, EXTRACTED_VERSION, lambda path: None)
+		path = os.path.normpath(os.path.join(extracted_folder, filename))
+		if not path.startswith(extracted_folder + os.sep):
+			raise ValueError("Invalid archive member name: %s" % filename)
+
+		if not os.path.isfile(path):
+			os.makedirs(os.path.dirname(path), exist_ok=True)
+			fd, tmp_path = tempfile.mkstemp(prefix='.tmp-', dir=os.path.dirname(path))
+			with os.fdopen(fd, 'wb') as f_out, archive.open(filename, mode='r') as f_in:
+				shutil.copyfileobj(f_in, f_out)
+			os.replace(tmp_path, path)
+		return path
+
+	def close(self):
+		"""
+		Close the pooled archive handles. Files that were opened from them stay
+		readable until they are closed.
+		"""
+		with self._lock:
+			for _, zipfile in self._archives.values():
+				zipfile.close()
+			self._archives.clear()
+
+	def _archive(self, name):
+		"""
+		Return an open ZipFile for the given resource, from the handle pool if
+		possible. The MIME type of the resource is checked only the first time
+		each version of the file is opened.
+		"""
+		fingerprint = self.fingerprint(name)
 		path = self.resource_path(name)
-		magic = Magic(mime=True)
-		mime = magic.from_file(path)
-		if mime != 'application/zip':
-			raise ValueError("Unsupported MIME type: %s (application/zip is required)" % mime)
+		with self._lock:
+			if path in self._archives:
+				archive_fingerprint, zipfile = self._archives[path]
+				if archive_fingerprint == fingerprint:
+					self._archives.move_to_end(path)
+					return zipfile
+				del self._archives[path]
+				zipfile.close()
 
-		zipfile = ZipFile(path)
-		f =  zipfile.open(filename, mode='r')
+			if self._mime_types.get(path, (None, None))[0] != fingerprint:
+				self._mime_types[path] = (fingerprint, Magic(mime=True).from_file(path))
+			mime = self._mime_types[path][1]
+			if mime != 'application/zip':
+				raise ValueError("Unsupported MIME type: %s (application/zip is required)" % mime)
 
-		return f if binary else TextIOWrapper(f, encoding) # TODO: test encoding
+			zipfile = ZipFile(path)
+			self._archives[path] = (fingerprint, zipfile)
+			while len(self._archives) > self.max_open_archives:
+				_, (_, evicted) = self._archives.popitem(last=False)
+				evicted.close()
+			return zipfile
 
 	def resource_path(self, name):
 		"""
@@ -127,6 +235,150 @@ class ResourceManager(object):
 		"""
 		return os.path.join(self.resource_folder, self.resources[name].filename)
 
+	def fingerprint(self, name):
+		"""
+		Return a fingerprint of the resource file, which changes whenever the
+		file is replaced or modified. This is currently based on the size and
+		modification time of the file, so it's computed without reading it.
+
+		:param name: the name of the resource
+		:type name: `str`
+		:return: the resource fingerprint
+		:rtype: `str`
+		"""
+		self._error_if_not_found(name)
+		stat = os.stat(self.resource_path(name))
+		return f"{stat.st_size}-{stat.st_mtime_ns}"
+
+	def cached_artifact(self, name, version, build_f):
+		"""
+		Return the path of a directory containing an artifact derived from the
+		given resource. If the artifact is not in cache, or it was built from a
+		different version of the resource file, `build_f` is called with the
+		path of a new empty directory, where it's expected to write the artifact
+		files. Once `build_f` returns, the directory is atomically moved in the
+		cache, and stale artifacts with the same name and version are evicted.
+		If another process built the same artifact in the meantime, its
+		artifact is kept, and this build is discarded.
+
+		`version` should be changed whenever the way the artifact is built
+		changes, so that old artifacts are not loaded by mistake.
+
+		.. code-block:: python
+
+			def build(path):
+				with EpisodeArchive(os.path.join(path, 'episodes'), mode='w') as archive:
+					archive.add_episodes(parse_corpus())
+
+			path = rm.cached_artifact('corpora.cornell', 'episodes-1', build)
+
+		:param name: the name of the source resource
+		:type name: `str`
+		:param version: version of the artifact (eg. 'episodes-1')
+		:type version: `str`
+		:param build_f: a function building the artifact in the given directory
+		:type build_f: `callable`
+		:return: the path of the artifact directory
+		:rtype: `str`
+		"""
+		fingerprint = self.fingerprint(name)
+		name_folder = os.path.join(self.cache_folder, name)
+		path = os.path.join(name_folder, f"{version}-{fingerprint}")
+		if os.path.isdir(path):
+			self.cache_hits += 1
+			_CACHE_HITS.labels(resource=name).inc()
+			os.utime(path)
+			return path
+
+		self.cache_misses += 1
+		_CACHE_MISSES.labels(resource=name).inc()
+		self._logger.info("Building artifact '%s' of resource '%s'", version, name)
+		os.makedirs(name_folder, exist_ok=True)
+		tmp_path = tempfile.mkdtemp(prefix='.tmp-', dir=name_folder)
+		try:
+			build_f(tmp_path)
+		except BaseException:
+			shutil.rmtree(tmp_path, ignore_errors=True)
+			raise
+		try:
+			os.rename(tmp_path, path)
+		except OSError:
+			shutil.rmtree(tmp_path, ignore_errors=True)
+			if not os.path.isdir(path):
+				raise
+			self._logger.info("Artifact '%s' of resource '%s' was built by another process", version, name)
+			return path
+
+		for record in self.list_cache(name):
+			if record.version == version and record.path != path:
+				self._remove_artifact(record)
+		return path
+
+	def list_cache(self, name=None):
+		"""
+		List the artifacts in cache, optionally filtering by resource name.
+
+		:param name: if given, only list artifacts of this resource
+		:type name: `str`
+		:return: the cached artifacts
+		:rtype: `list` of :class:`CacheRecord`
+		"""
+		if not os.path.isdir(self.cache_folder):
+			return []
+
+		names = [name] if name is not None else sorted(os.listdir(self.cache_folder))
+		result = []
+		for n in names:
+			name_folder = os.path.join(self.cache_folder, n)
+			if not os.path.isdir(name_folder):
+				continue
+			for artifact in sorted(os.listdir(name_folder)):
+				path = os.path.join(name_folder, artifact)
+				if artifact.startswith('.tmp-') or artifact.count('-') < 2 or not os.path.isdir(path):
+					continue
+				version, size, mtime = artifact.rsplit('-', 2)
+				result.append(CacheRecord(n, version, f"{size}-{mtime}", path, _folder_size(path), os.stat(path).st_mtime))
+		return result
+
+	def cache_size(self, name=None):
+		"""
+		Return the total size of the cached artifacts, in bytes.
+
+		:param name: if given, only count artifacts of this resource
+		:type name: `str`
+		:return: size of the cache, in bytes
+		:rtype: `int`
+		"""
+		return sum(r.size for r in self.list_cache(name))
+
+	def evict_cache(self, name=None, max_size=None):
+		"""
+		Remove artifacts from the cache. If `max_size` is given, the least
+		recently used artifacts are removed until the cache size is below
+		`max_size` bytes; otherwise, all of them are removed.
+
+		:param name: if given, only evict artifacts of this resource
+		:type name: `str`
+		:param max_size: the maximum size of the cache, in bytes
+		:type max_size: `int`
+		:return: the evicted artifacts
+		:rtype: `list` of :class:`CacheRecord`
+		"""
+		records = sorted(self.list_cache(name), key=lambda r: r.last_used)
+		total_size = sum(r.size for r in records)
+		result = []
+		for r in records:
+			if max_size is not None and total_size <= max_size:
+				break
+			self._remove_artifact(r)
+			total_size -= r.size
+			result.append(r)
+		return result
+
+	def _remove_artifact(self, record):
+		self._logger.info("Evicting artifact %s", record.path)
+		shutil.rmtree(record.path, ignore_errors=True)
+
 	def _error_if_not_found(self, name):
 		record = self.resources[name]
 		path = self.resource_path(name)
@@ -135,3 +387,10 @@ class ResourceManager(object):
 				    "copy it in your resource folder (%s) with name '%s' to make "
 				    "it available in Due.") % (name, record.url, self.resource_folder, record.filename))
 			raise ValueError("Resource not found: %s. Please refer to the logs for guidance." % name)
+
+def _folder_size(path):
+	result = 0
+	for root, _, files in os.walk(path):
+		for f in files:
+			result += os.path.getsize(os.path.join(root, f))
+	return result
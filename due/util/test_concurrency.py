@@ -0,0 +1,41 @@
+import unittest
+import threading
+import time
+
+from due.util.concurrency import *
+
+class TestKeyedExecutor(unittest.TestCase):
+
+	def test_ordering(self):
+		results = {'a': [], 'b': []}
+		def task(key, i):
+			time.sleep(0.001)
+			results[key].append(i)
+			return i
+
+		with KeyedExecutor(4) as executor:
+			futures = [executor.submit(k, task, k, i) for i in range(20) for k in ('a', 'b')]
+			self.assertEqual([f.result() for f in futures], [i for i in range(20) for k in ('a', 'b')])
+
+		self.assertEqual(results['a'], list(range(20)))
+		self.assertEqual(results['b'], list(range(20)))
+		self.assertEqual(executor.pending(), 0)
+
+	def test_parallel_keys(self):
+		barrier = threading.Barrier(2, timeout=5)
+		with KeyedExecutor(2) as executor:
+			f1 = executor.submit('a', barrier.wait)
+			f2 = executor.submit('b', barrier.wait)
+			f1.result()
+			f2.result()
+
+	def test_error(self):
+		def fail():
+			raise RuntimeError("expected")
+
+		with KeyedExecutor(1) as executor:
+			f1 = executor.submit('a', fail)
+			f2 = executor.submit('a', lambda: 42)
+			with self.assertRaises(RuntimeError):
+				f1.result()
+			self.assertEqual(f2.result(), 42)
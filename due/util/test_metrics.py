@@ -0,0 +1,173 @@
+import os
+import tempfile
+import threading
+import unittest
+import urllib.request
+import urllib.error
+
+from due.util import metrics
+from due.util.metrics import *
+from due.learning import BackgroundLearner
+from due.models.dummy import DummyAgent
+from due.models.tfidf import TfIdfAgent
+
+class TestMetricsRegistry(unittest.TestCase):
+
+	def test_counter(self):
+		registry = MetricsRegistry()
+		counter = registry.counter('events_total', "Events", ['type'])
+		self.assertIs(registry.counter('events_total', "Events", ['type']), counter)
+
+		def work():
+			for _ in range(1000):
+				counter.labels(type='a').inc()
+		threads = [threading.Thread(target=work) for _ in range(8)]
+		for t in threads:
+			t.start()
+		for t in threads:
+			t.join()
+		counter.labels(type='b').inc(2)
+
+		self.assertEqual(counter.labels(type='a').value, 8000)
+		self.assertEqual(counter.labels(type='b').value, 2)
+		with self.assertRaises(ValueError):
+			counter.labels(type='a').inc(-1)
+		with self.assertRaises(ValueError):
+			counter.inc()
+		with self.assertRaises(ValueError):
+			counter.labels(kind='a')
+
+	def test_gauge(self):
+		registry = MetricsRegistry()
+		gauge = registry.gauge('queue_depth', "Queue depth")
+		gauge.inc(3)
+		gauge.dec()
+		self.assertEqual(gauge.labels().value, 2)
+		gauge.set(7)
+		self.assertEqual(gauge.labels().value, 7)
+		gauge.set_function(lambda: 42)
+		self.assertEqual(gauge.labels().value, 42)
+
+	def test_histogram(self):
+		registry = MetricsRegistry()
+		histogram = registry.histogram('latency_seconds', "Latency", buckets=[0.1, 1.])
+		for value in [0.05, 0.5, 0.5, 5.]:
+			histogram.observe(value)
+		with histogram.labels().time():
+			pass
+
+		self.assertEqual(histogram.labels().count, 5)
+		self.assertGreaterEqual(histogram.labels().sum, 6.05)
+		self.assertEqual([s[1]['le'] for s in histogram.samples()[:3]], ['0.1', '1.0', '+Inf'])
+		self.assertEqual([s[2] for s in histogram.samples()[:3]], [2, 4, 5])
+
+	def test_conflicts(self):
+		registry = MetricsRegistry()
+		registry.counter('a_total', "A")
+		with self.assertRaises(ValueError):
+			registry.gauge('a_total', "A")
+		with self.assertRaises(ValueError):
+			registry.counter('a_total', "A", ['type'])
+		with self.assertRaises(ValueError):
+			registry.counter('not a name', "A")
+		with self.assertRaises(ValueError):
+			registry.histogram('h', "H", ['le'])
+		with self.assertRaises(ValueError):
+			registry.set_default_labels(**{'__name': 'x'})
+
+	def test_render(self):
+		registry = MetricsRegistry({'channel': 'test'})
+		registry.counter('events_total', "Events\nacted", ['type']).labels(type='Say "hi"').inc()
+		registry.histogram('latency_seconds', "Latency", buckets=[1.]).observe(0.5)
+		registry.set_default_labels(agent_class='DummyAgent')
+
+		self.assertEqual(registry.render(), '\n'.join([
+			'# HELP events_total Events\\nacted',
+			'# TYPE events_total counter',
+			'events_total{channel="test",agent_class="DummyAgent",type="Say \\"hi\\""} 1.0',
+			'# HELP latency_seconds Latency',
+			'# TYPE latency_seconds histogram',
+			'latency_seconds_bucket{channel="test",agent_class="DummyAgent",le="1.0"} 1.0',
+			'latency_seconds_bucket{channel="test",agent_class="DummyAgent",le="+Inf"} 1.0',
+			'latency_seconds_sum{channel="test",agent_class="DummyAgent"} 0.5',
+			'latency_seconds_count{channel="test",agent_class="DummyAgent"} 1.0',
+		]) + '\n')
+
+	def test_merge(self):
+		texts = []
+		for worker in ['1', '2']:
+			registry = MetricsRegistry({'worker': worker})
+			registry.counter('a_total', "A").inc()
+			registry.gauge('b', "B").set(1)
+			texts.append(registry.render())
+
+		self.assertEqual(metrics.merge(texts), '\n'.join([
+			'# HELP a_total A',
+			'# TYPE a_total counter',
+			'a_total{worker="1"} 1.0',
+			'a_total{worker="2"} 1.0',
+			'# HELP b B',
+			'# TYPE b gauge',
+			'b{worker="1"} 1.0',
+			'b{worker="2"} 1.0',
+		]) + '\n')
+
+class TestExporters(unittest.TestCase):
+
+	def test_server(self):
+		registry = MetricsRegistry()
+		registry.counter('a_total', "A").inc()
+		server = MetricsServer(registry, port=0).start()
+		try:
+			with urllib.request.urlopen(f'http://127.0.0.1:{server.port}/metrics') as response:
+				self.assertEqual(response.headers['Content-Type'], CONTENT_TYPE)
+				self.assertIn('a_total 1.0', response.read().decode('utf-8'))
+			with self.assertRaises(urllib.error.HTTPError):
+				urllib.request.urlopen(f'http://127.0.0.1:{server.port}/other')
+		finally:
+			server.stop()
+
+	def test_file_writer(self):
+		registry = MetricsRegistry()
+		counter = registry.counter('a_total', "A")
+		with tempfile.TemporaryDirectory() as temp_dir:
+			path = os.path.join(temp_dir, 'due.prom')
+			writer = MetricsFileWriter(path, registry, interval=60).start()
+			counter.inc()
+			writer.stop()
+			with open(path) as f:
+				self.assertIn('a_total 1.0', f.read())
+			self.assertEqual(os.listdir(temp_dir), ['due.prom'])
+
+class TestInstrumentation(unittest.TestCase):
+
+	def test_episode_events(self):
+		utterances = REGISTRY.get('due_events_total').labels(type='Utterance')
+		before = utterances.value
+		alice, bob = DummyAgent('alice'), DummyAgent('bob')
+		episode = alice.start_episode(bob)
+		alice.say('Hi', episode)
+		alice.say('Bye', episode)
+		self.assertEqual(utterances.value - before, 2)
+
+	def test_learner(self):
+		depth = REGISTRY.get('due_learning_queue_depth').labels()
+		learned = REGISTRY.get('due_learned_episodes_total').labels()
+		before = learned.value
+		release = threading.Event()
+		learner = BackgroundLearner(lambda batch: release.wait(), coalesce_delay=0)
+		learner.submit('episode')
+		self.assertGreaterEqual(depth.value, 1)
+		release.set()
+		learner.stop()
+		self.assertEqual(learned.value - before, 1)
+
+	def test_tfidf_index_size(self):
+		agent = TfIdfAgent()
+		alice, bob = DummyAgent('alice'), DummyAgent('bob')
+		episode = alice.start_episode(bob)
+		alice.say('Hi there', episode)
+		bob.say('Hello you', episode)
+		agent.learn_episodes([episode])
+		self.assertEqual(REGISTRY.get('due_tfidf_index_utterances').labels(agent=agent.id).value, 2)
+		self.assertEqual(REGISTRY.get('due_tfidf_index_terms').labels(agent=agent.id).value, 4)
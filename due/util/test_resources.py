@@ -3,6 +3,7 @@ import os
 import tempfile
 import shutil
 from io import StringIO
+from zipfile import ZipFile
 
 from due.util.resources import *
 
@@ -77,6 +78,69 @@ class TestResourceManager(unittest.TestCase):
 			with rm.open_resource_file('test.resource', filename, binary=True) as f:
 				self.assertEqual(f.read(), bytes(content, 'utf-8'))
 
+	def test_open_resource_file_pooled(self):
+		with tempfile.TemporaryDirectory() as tmp_dir:
+			rm = ResourceManager(resource_folder=tmp_dir, max_open_archives=1)
+			_make_zip_resource(rm, tmp_dir, 'test.resource', {'a.txt': 'aaa', 'dir/b.txt': 'bbb'})
+			_make_zip_resource(rm, tmp_dir, 'test.other', {'c.txt': 'ccc'})
+
+			with rm.open_resource_file('test.resource', 'a.txt') as f:
+				self.assertEqual(f.read(), 'aaa')
+			archive = rm._archive('test.resource')
+			with rm.open_resource_file('test.resource', 'dir/b.txt') as f:
+				self.assertEqual(f.read(), 'bbb')
+			self.assertIs(rm._archive('test.resource'), archive)
+
+			with rm.open_resource_file('test.other', 'c.txt') as f:
+				self.assertEqual(f.read(), 'ccc')
+			self.assertEqual(len(rm._archives), 1)
+			self.assertIsNot(rm._archive('test.resource'), archive)
+
+			rm.close()
+			self.assertEqual(len(rm._archives), 0)
+
+	def test_open_resource_file_changed(self):
+		with tempfile.TemporaryDirectory() as tmp_dir:
+			rm = ResourceManager(resource_folder=tmp_dir)
+			_make_zip_resource(rm, tmp_dir, 'test.resource', {'a.txt': 'old'})
+			with rm.open_resource_file('test.resource', 'a.txt') as f:
+				self.assertEqual(f.read(), 'old')
+			self.assertTrue(rm.resource_file_path('test.resource', 'a.txt').endswith('a.txt'))
+
+			_make_zip_resource(rm, tmp_dir, 'test.resource', {'a.txt': 'new content'})
+			with rm.open_resource_file('test.resource', 'a.txt') as f:
+				self.assertEqual(f.read(), 'new content')
+			with rm.open_resource_file('test.resource', 'a.txt', extract=True) as f:
+				self.assertEqual(f.read(), 'new content')
+
+	def test_open_resource_file_unsupported(self):
+		with tempfile.TemporaryDirectory() as tmp_dir:
+			with open(os.path.join(tmp_dir, 'plain.txt'), 'w') as f:
+				f.write("not an archive")
+			rm = ResourceManager(resource_folder=tmp_dir)
+			rm.register_resource('test.resource', 'a text resource', 'http://fake.com/plain.txt', 'plain.txt')
+			with self.assertRaises(ValueError):
+				rm.open_resource_file('test.resource', 'a.txt')
+
+	def test_resource_file_path(self):
+		with tempfile.TemporaryDirectory() as tmp_dir:
+			rm = ResourceManager(resource_folder=tmp_dir)
+			_make_zip_resource(rm, tmp_dir, 'test.resource', {'dir/b.txt': 'bbb'})
+
+			path = rm.resource_file_path('test.resource', 'dir/b.txt')
+			self.assertTrue(path.startswith(rm.cache_folder))
+			with open(path) as f:
+				self.assertEqual(f.read(), 'bbb')
+			mtime = os.stat(path).st_mtime_ns
+			self.assertEqual(rm.resource_file_path('test.resource', 'dir/b.txt'), path)
+			self.assertEqual(os.stat(path).st_mtime_ns, mtime)
+
+			with rm.open_resource_file('test.resource', 'dir/b.txt', binary=True, extract=True) as f:
+				self.assertEqual(f.read(), b'bbb')
+
+			with self.assertRaises(ValueError):
+				rm.resource_file_path('test.resource', '../../escape.txt')
+
 	def test_error_if_not_found(self):
 		with tempfile.TemporaryDirectory() as tmp_dir:
 			rm = ResourceManager(resource_folder=tmp_dir)
@@ -86,4 +150,115 @@ class TestResourceManager(unittest.TestCase):
 				rm.open_resource('test.resource')
 
 			with self.assertRaises(ValueError):
-				rm.open_resource_file('test.resource', 'foo.txt')
\ No newline at end of file
+				rm.open_resource_file('test.resource', 'foo.txt')
+
+	def test_cached_artifact(self):
+		with tempfile.TemporaryDirectory() as tmp_dir:
+			with open(os.path.join(tmp_dir, 'test_file.txt'), 'w') as f:
+				f.write("content")
+
+			rm = ResourceManager(resource_folder=tmp_dir)
+			rm.register_resource('test.resource', 'a test resource', 'http://fake.com/res.txt', 'test_file.txt')
+
+			builds = []
+			def build(path):
+				builds.append(path)
+				with open(os.path.join(path, 'artifact.txt'), 'w') as f:
+					f.write("artifact content")
+
+			path = rm.cached_artifact('test.resource', 'v1', build)
+			self.assertEqual(len(builds), 1)
+			with open(os.path.join(path, 'artifact.txt')) as f:
+				self.assertEqual(f.read(), "artifact content")
+
+			self.assertEqual(rm.cached_artifact('test.resource', 'v1', build), path)
+			self.assertEqual(len(builds), 1)
+			self.assertEqual((rm.cache_hits, rm.cache_misses), (1, 1))
+
+			rm.cached_artifact('test.resource', 'v2', build)
+			self.assertEqual(len(builds), 2)
+			self.assertEqual([r.version for r in rm.list_cache()], ['v1', 'v2'])
+			self.assertEqual(rm.cache_size(), 2*len("artifact content"))
+
+			# A modified resource invalidates its artifacts
+			os.utime(rm.resource_path('test.resource'), ns=(0, 0))
+			new_path = rm.cached_artifact('test.resource', 'v1', build)
+			self.assertEqual(len(builds), 3)
+			self.assertNotEqual(new_path, path)
+			self.assertFalse(os.path.exists(path))
+			self.assertEqual(len(rm.list_cache('test.resource')), 2)
+
+	def test_cached_artifact_build_error(self):
+		with tempfile.TemporaryDirectory() as tmp_dir:
+			with open(os.path.join(tmp_dir, 'test_file.txt'), 'w') as f:
+				f.write("content")
+
+			rm = ResourceManager(resource_folder=tmp_dir)
+			rm.register_resource('test.resource', 'a test resource', 'http://fake.com/res.txt', 'test_file.txt')
+
+			def build(path):
+				raise RuntimeError("build failed")
+
+			with self.assertRaises(RuntimeError):
+				rm.cached_artifact('test.resource', 'v1', build)
+			self.assertEqual(rm.list_cache(), [])
+			self.assertEqual(os.listdir(os.path.join(rm.cache_folder, 'test.resource')), [])
+
+	def test_cached_artifact_concurrent_build(self):
+		with tempfile.TemporaryDirectory() as tmp_dir:
+			with open(os.path.join(tmp_dir, 'test_file.txt'), 'w') as f:
+				f.write("content")
+
+			rm = ResourceManager(resource_folder=tmp_dir)
+			rm.register_resource('test.resource', 'a test resource', 'http://fake.com/res.txt', 'test_file.txt')
+
+			def build(path):
+				with open(os.path.join(path, 'artifact.txt'), 'w') as f:
+					f.write("artifact content")
+				# Another process completes the same build in the meantime
+				other_path = os.path.join(os.path.dirname(path), 'v1-' + rm.fingerprint('test.resource'))
+				os.mkdir(other_path)
+				with open(os.path.join(other_path, 'artifact.txt'), 'w') as f:
+					f.write("other content")
+
+			path = rm.cached_artifact('test.resource', 'v1', build)
+			with open(os.path.join(path, 'artifact.txt')) as f:
+				self.assertEqual(f.read(), "other content")
+			self.assertEqual(os.listdir(os.path.join(rm.cache_folder, 'test.resource')), [os.path.basename(path)])
+
+	def test_evict_cache(self):
+		with tempfile.TemporaryDirectory() as tmp_dir:
+			with open(os.path.join(tmp_dir, 'test_file.txt'), 'w') as f:
+				f.write("content")
+
+			rm = ResourceManager(resource_folder=tmp_dir)
+			rm.register_resource('test.resource', 'a test resource', 'http://fake.com/res.txt', 'test_file.txt')
+
+			def build(path):
+				with open(os.path.join(path, 'artifact.txt'), 'w') as f:
+					f.write("0123456789")
+
+			paths = [rm.cached_artifact('test.resource', f'v{i}', build) for i in range(3)]
+			for i, path in enumerate(paths):
+				os.utime(path, (i, i))
+			rm.cached_artifact('test.resource', 'v0', build)
+
+			evicted = rm.evict_cache(max_size=20)
+			self.assertEqual([r.version for r in evicted], ['v1'])
+			self.assertEqual(rm.cache_size(), 20)
+
+			evicted = rm.evict_cache()
+			self.assertEqual(len(evicted), 2)
+			self.assertEqual(rm.list_cache(), [])
+
+#
+# Helpers
+#
+
+def _make_zip_resource(rm, folder, name, files):
+	filename = name + '.zip'
+	with ZipFile(os.path.join(folder, filename), 'w') as zf:
+		for member, content in files.items():
+			zf.writestr(member, content)
+	if name not in rm.resources:
+		rm.register_resource(name, 'a test ZIP resource', 'http://fake.com/res.zip', filename)
@@ -0,0 +1,92 @@
+import os
+import json
+import time
+import tempfile
+import unittest
+
+from due.util import tracing
+from due.episode import Episode
+from due.models.dummy import DummyAgent
+from due.models.tfidf import TfIdfAgent
+
+class TestTracing(unittest.TestCase):
+
+	def tearDown(self):
+		tracing.disable()
+
+	def test_disabled(self):
+		self.assertFalse(tracing.enabled())
+		self.assertIs(tracing.span('a'), tracing.span('b'))
+		with tracing.trace() as breakdown:
+			with tracing.span('a'):
+				pass
+		self.assertEqual(breakdown, {})
+
+	def test_histograms(self):
+		memory = tracing.MemoryExporter()
+		tracer = tracing.enable(memory)
+		for i in range(10):
+			with tracing.span('fast'):
+				pass
+		with tracing.span('slow'):
+			time.sleep(0.01)
+
+		stats = tracer.stats()
+		self.assertEqual(list(stats), ['fast', 'slow'])
+		self.assertEqual(stats['fast']['count'], 10)
+		self.assertGreaterEqual(stats['slow']['total'], 0.01)
+		self.assertGreaterEqual(stats['slow']['p99'], 0.01)
+		self.assertLessEqual(stats['slow']['p99'], stats['slow']['max'])
+		self.assertEqual([r.name for r in memory.records], ['fast'] * 10 + ['slow'])
+
+		tracer.reset()
+		self.assertEqual(tracer.stats(), {})
+
+	def test_breakdown(self):
+		tracing.enable()
+		with tracing.trace() as outer:
+			with tracing.span('a'):
+				pass
+			with tracing.trace() as inner:
+				with tracing.span('b'):
+					pass
+		self.assertEqual(set(inner), {'b'})
+		self.assertEqual(set(outer), {'a', 'b'})
+
+	def test_file_exporter(self):
+		with tempfile.TemporaryDirectory() as temp_dir:
+			path = os.path.join(temp_dir, 'spans.jsonl')
+			tracing.enable(tracing.FileExporter(path), tracing.LogExporter())
+			with tracing.span('a'):
+				pass
+			tracing.disable()
+			with open(path) as f:
+				records = [json.loads(l) for l in f]
+		self.assertEqual(len(records), 1)
+		self.assertEqual(records[0]['name'], 'a')
+
+	def test_episode_trace(self):
+		alice = DummyAgent('alice')
+		bob = DummyAgent('bob')
+		episode = alice.start_episode(bob)
+		alice.say('Hi!', episode)
+		bob.say('Hello', episode)
+		agent = TfIdfAgent()
+		agent.learn_episodes([episode])
+		self.assertIsNone(episode.events[0].trace)
+
+		tracer = tracing.enable()
+		e2 = alice.start_episode(agent)
+		alice.say('Hi!', e2)
+		self.assertEqual(e2.events[-1].payload, 'Hello')
+		trace = e2.events[0].trace
+		self.assertEqual(set(trace), {'episode.notify', 'normalize_sentence', 'tfidf.transform', 'tfidf.cosine_similarity'})
+		self.assertGreaterEqual(trace['episode.notify'], trace['tfidf.transform'])
+		self.assertEqual(set(e2.events[1].trace), {'episode.notify'})
+		self.assertEqual(tracer.stats()['tfidf.transform']['count'], 1)
+		self.assertEqual(tracer.stats()['episode.add_event']['count'], 1)
+
+		saved = Episode.load(e2.save())
+		self.assertEqual([e.trace for e in saved.events], [e.trace for e in e2.events])
+		compact = Episode.load(e2.save(output_format='compact'))
+		self.assertEqual([e.trace for e in compact.events], [None, None])
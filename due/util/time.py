@@ -54,3 +54,17 @@ def parse_timedelta(delta):
         minutes=int(groups[2]),
         seconds=int(groups[3])
     )
+
+def json_default(obj):
+    """
+    Serialize `datetime` objects as ISO strings. This is meant to be passed as
+    the `default` argument of :func:`json.dump` and :func:`json.dumps`.
+
+    :param obj: an object that the :mod:`json` module can't serialize
+    :type obj: `datetime`
+    :return: the ISO representation of `obj`
+    :rtype: `str`
+    """
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
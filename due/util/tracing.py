@@ -0,0 +1,343 @@
+"""
+Timers for the stages of an Agent's hot path (eg. sentence normalization,
+vectorization, similarity scoring, Event dispatch), to find out where the time
+of a slow reply went.
+
+Code reports stages with :func:`span`:
+
+.. code-block:: python
+
+	from due.util import tracing
+
+	with tracing.span('tfidf.transform'):
+		vectors = vectorizer.transform(sentences)
+
+Tracing is **disabled** by default: in that case, :func:`span` returns a
+shared no-op context manager, and costs about as much as a function call.
+Once enabled, the duration of each span is added to a per-stage histogram, and
+passed to the exporters:
+
+.. code-block:: python
+
+	tracer = tracing.enable(tracing.LogExporter(), tracing.FileExporter('spans.jsonl'))
+	...
+	print(tracer.stats())
+	tracing.disable()
+
+Spans that run within a :func:`trace` block are also collected in a per-request
+**breakdown**. :meth:`due.episode.LiveEpisode.add_event` traces the processing
+of each Event (including the time the other participants spent answering
+it), and stores its breakdown in the Event's `trace` attribute. Breakdowns are
+saved with the Events (see :meth:`due.event.Event.save`) and recorded in the
+Event Log (see :meth:`due.eventlog.EventLog.log_trace`), so that they can be
+analysed offline.
+
+API
+===
+"""
+import json
+import time
+import bisect
+import logging
+import threading
+import contextvars
+from collections import namedtuple, deque
+
+DEFAULT_BUCKETS = tuple(1e-6 * 2**i for i in range(28))
+
+SpanRecord = namedtuple('SpanRecord', ['name', 'start', 'duration', 'thread'])
+SpanRecord.__doc__ = """
+A span that was completed.
+
+:param name: the name of the stage
+:type name: `str`
+:param start: when the span started, as a UNIX timestamp
+:type start: `float`
+:param duration: the duration of the span, in seconds
+:type duration: `float`
+:param thread: the name of the thread that ran the span
+:type thread: `str`
+"""
+
+_tracer = None
+_breakdown = contextvars.ContextVar('due_tracing_breakdown', default=None)
+
+class Tracer(object):
+	"""
+	Collect the spans reported with :func:`span` in per-stage histograms, and
+	send them to the exporters. Use :func:`enable` to install a Tracer.
+
+	:param exporters: objects with an `export(record)` method, receiving each :class:`SpanRecord`
+	:type exporters: `list`
+	:param buckets: upper bounds of the histogram buckets, in seconds
+	:type buckets: `list` of `float`
+	"""
+
+	def __init__(self, exporters=None, buckets=DEFAULT_BUCKETS):
+		self._logger = logging.getLogger(__name__ + ".Tracer")
+		self.exporters = list(exporters) if exporters else []
+		self.buckets = tuple(buckets)
+		self._histograms = {}
+		self._lock = threading.Lock()
+
+	def record(self, name, start, duration):
+		"""
+		Record a completed span.
+
+		:param name: the name of the stage
+		:type name: `str`
+		:param start: when the span started, as a UNIX timestamp
+		:type start: `float`
+		:param duration: the duration of the span, in seconds
+		:type duration: `float`
+		"""
+		with self._lock:
+			histogram = self._histograms.get(name)
+			if histogram is None:
+				histogram = self._histograms[name] = _Histogram(self.buckets)
+			histogram.add(duration)
+
+		breakdown = _breakdown.get()
+		if breakdown is not None:
+			breakdown[name] = breakdown.get(name, 0.) + duration
+
+		record = SpanRecord(name, start, duration, threading.current_thread().name)
+		for exporter in self.exporters:
+			try:
+				exporter.export(record)
+			except Exception:
+				self._logger.exception("Exporter %s failed", exporter)
+
+	def stats(self):
+		"""
+		Return the statistics of each stage: `count`, `total`, `mean`, `min`
+		and `max` durations, and the `p50`, `p95`, `p99` percentiles. Times are
+		in seconds; percentiles are estimated as the upper bound of the
+		histogram bucket they fall into.
+
+		:return: per-stage statistics
+		:rtype: `dict` of `dict`
+		"""
+		with self._lock:
+			return {name: h.stats() for name, h in sorted(self._histograms.items())}
+
+	def reset(self):
+		"""
+		Clear the histograms.
+		"""
+		with self._lock:
+			self._histograms = {}
+
+	def close(self):
+		"""
+		Close the exporters.
+		"""
+		for exporter in self.exporters:
+			close = getattr(exporter, 'close', None)
+			if close is not None:
+				close()
+
+class _Span(object):
+
+	__slots__ = ('tracer', 'name', 'start', 'wall_start')
+
+	def __init__(self, tracer, name):
+		self.tracer = tracer
+		self.name = name
+
+	def __enter__(self):
+		self.wall_start = time.time()
+		self.start = time.perf_counter()
+		return self
+
+	def __exit__(self, *args):
+		self.tracer.record(self.name, self.wall_start, time.perf_counter() - self.start)
+
+class _NoopSpan(object):
+
+	__slots__ = ()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		pass
+
+_NOOP_SPAN = _NoopSpan()
+
+def span(name):
+	"""
+	Time a stage of the hot path. Use the result as a context manager.
+
+	:param name: the name of the stage (eg. 'tfidf.transform')
+	:type name: `str`
+	:return: a context manager timing its block
+	"""
+	tracer = _tracer
+	if tracer is None:
+		return _NOOP_SPAN
+	return _Span(tracer, name)
+
+def enabled():
+	"""
+	:return: `True` if tracing is enabled
+	:rtype: `bool`
+	"""
+	return _tracer is not None
+
+def enable(*exporters, buckets=DEFAULT_BUCKETS):
+	"""
+	Enable tracing, replacing the current Tracer (if any).
+
+	:param exporters: exporters receiving each completed span
+	:param buckets: upper bounds of the histogram buckets, in seconds
+	:type buckets: `list` of `float`
+	:return: the new Tracer
+	:rtype: :class:`Tracer`
+	"""
+	global _tracer
+	tracer = Tracer(exporters, buckets)
+	old_tracer, _tracer = _tracer, tracer
+	if old_tracer is not None:
+		old_tracer.close()
+	return tracer
+
+def disable():
+	"""
+	Disable tracing, and close the exporters of the current Tracer.
+
+	:return: the Tracer that was installed, if any
+	:rtype: :class:`Tracer`
+	"""
+	global _tracer
+	tracer, _tracer = _tracer, None
+	if tracer is not None:
+		tracer.close()
+	return tracer
+
+class trace(object):
+	"""
+	Collect the spans that run in this block (in the same thread, or in the
+	same asyncio task) in a breakdown, which is a `dict` of the total time
+	spent in each stage. Nested blocks report their spans to the outer one,
+	too. If tracing is disabled, the breakdown stays empty.
+
+	.. code-block:: python
+
+		with tracing.trace() as breakdown:
+			agent.utterance_callback(episode)
+		print(breakdown)  # {'normalize_sentence': 0.0012, 'tfidf.transform': 0.0003, ...}
+	"""
+
+	__slots__ = ('breakdown', '_token', '_outer')
+
+	def __enter__(self):
+		self._outer = _breakdown.get()
+		self.breakdown = {}
+		self._token = _breakdown.set(self.breakdown)
+		return self.breakdown
+
+	def __exit__(self, *args):
+		_breakdown.reset(self._token)
+		if self._outer is not None:
+			for name, duration in self.breakdown.items():
+				self._outer[name] = self._outer.get(name, 0.) + duration
+
+#
+# Exporters
+#
+
+class LogExporter(object):
+	"""
+	Log each span.
+
+	:param logger: the logger to use (defaults to this module's one)
+	:type logger: :class:`logging.Logger`
+	:param level: the logging level
+	:type level: `int`
+	"""
+
+	def __init__(self, logger=None, level=logging.DEBUG):
+		self.logger = logger if logger is not None else logging.getLogger(__name__)
+		self.level = level
+
+	def export(self, record):
+		self.logger.log(self.level, "Span %s: %.6fs (%s)", record.name, record.duration, record.thread)
+
+class MemoryExporter(object):
+	"""
+	Keep the most recent spans in memory, in the `records` attribute.
+
+	:param max_records: the maximum number of spans to keep
+	:type max_records: `int`
+	"""
+
+	def __init__(self, max_records=10000):
+		self.records = deque(maxlen=max_records)
+
+	def export(self, record):
+		self.records.append(record)
+
+class FileExporter(object):
+	"""
+	Append each span to a file, as a line of JSON.
+
+	:param path: the path of the file
+	:type path: `str`
+	"""
+
+	def __init__(self, path):
+		self.path = path
+		self._file = open(path, 'a')
+		self._lock = threading.Lock()
+
+	def export(self, record):
+		line = json.dumps(record._asdict()) + '\n'
+		with self._lock:
+			self._file.write(line)
+
+	def close(self):
+		with self._lock:
+			self._file.close()
+
+#
+# Helpers
+#
+
+class _Histogram(object):
+
+	def __init__(self, buckets):
+		self.buckets = buckets
+		self.counts = [0] * (len(buckets) + 1)
+		self.count = 0
+		self.total = 0.
+		self.min = float('inf')
+		self.max = 0.
+
+	def add(self, value):
+		self.counts[bisect.bisect_left(self.buckets, value)] += 1
+		self.count += 1
+		self.total += value
+		self.min = min(self.min, value)
+		self.max = max(self.max, value)
+
+	def percentile(self, q):
+		rank = q * self.count
+		cumulative = 0
+		for i, c in enumerate(self.counts):
+			cumulative += c
+			if cumulative >= rank:
+				return min(self.buckets[i], self.max) if i < len(self.buckets) else self.max
+		return self.max
+
+	def stats(self):
+		return {
+			'count': self.count,
+			'total': self.total,
+			'mean': self.total / self.count if self.count else 0.,
+			'min': self.min if self.count else 0.,
+			'max': self.max,
+			'p50': self.percentile(0.5),
+			'p95': self.percentile(0.95),
+			'p99': self.percentile(0.99),
+		}